@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+BENCHMARK DEL MOTOR DE RECOMENDACIONES - DATATÓN ITAM 2025
+Datasets sintéticos reproducibles a escala CDMX y métricas de latencia/memoria
+
+David Fernando Ávila Díaz - ITAM
+"""
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from recommendation_engine import IntelligentRecommendationEngine, UserProfile, ZoneTable
+
+MOCK_DATASET_PATH = Path(__file__).parent / "dataset_mock_cdmx.json"
+DEFAULT_SIZES = [20, 1000, 10000, 100000]
+
+# Niveles por colonia tal como los asigna DatatonDataExtractor
+SECURITY_TIERS = [
+    (["Polanco", "Santa Fe", "San Ángel", "Del Valle"], (75, 90)),
+    (["Roma Norte", "Condesa", "Coyoacán Centro"], (60, 80)),
+]
+SECURITY_DEFAULT = (40, 70)
+
+PRICE_TIERS = [
+    (["Polanco", "Santa Fe", "San Ángel"], (80000, 120000)),
+    (["Roma Norte", "Condesa", "Del Valle", "Zona Rosa"], (50000, 80000)),
+    (["Narvarte", "Escandón", "Coyoacán Centro"], (30000, 50000)),
+]
+PRICE_DEFAULT = (20000, 35000)
+
+TRANSPORT_TIERS = [
+    (["Centro Histórico", "Juárez", "Roma Norte", "Condesa"], {
+        'estaciones_metro_1km': (3, 8), 'tiempo_centro_historico_min': (5, 20),
+        'tiempo_polanco_min': (15, 35), 'tiempo_santa_fe_min': (35, 60), 'score_conectividad': (80, 95)
+    }),
+    (["Polanco", "Del Valle", "Narvarte"], {
+        'estaciones_metro_1km': (2, 5), 'tiempo_centro_historico_min': (20, 40),
+        'tiempo_polanco_min': (10, 25), 'tiempo_santa_fe_min': (25, 45), 'score_conectividad': (65, 85)
+    }),
+]
+TRANSPORT_DEFAULT = {
+    'estaciones_metro_1km': (0, 3), 'tiempo_centro_historico_min': (30, 60),
+    'tiempo_polanco_min': (25, 50), 'tiempo_santa_fe_min': (20, 40), 'score_conectividad': (40, 70)
+}
+
+# Conteos de amenidades: (campo, rango premium, rango bueno, rango resto, máximo, peso)
+AMENITY_FIELDS = [
+    ('hospitales_1km', (3, 8), (2, 5), (1, 3), 10, 0.15),
+    ('escuelas_primarias_1km', (5, 12), (3, 8), (2, 6), 15, 0.1),
+    ('escuelas_secundarias_1km', (3, 8), (2, 5), (1, 3), 10, 0.1),
+    ('universidades_5km', (2, 6), (1, 4), (0, 2), 8, 0.1),
+    ('supermercados_1km', (8, 15), (5, 10), (2, 6), 20, 0.15),
+    ('bancos_1km', (10, 20), (5, 12), (2, 8), 25, 0.1),
+    ('parques_1km', (3, 8), (2, 5), (1, 3), 10, 0.1),
+    ('restaurantes_1km', (50, 120), (25, 60), (10, 30), 150, 0.1),
+    ('centros_comerciales_5km', (2, 6), (1, 4), (0, 2), 8, 0.1),
+]
+AMENITY_TIERS = [
+    ["Polanco", "Santa Fe", "San Ángel", "Roma Norte"],
+    ["Condesa", "Del Valle", "Zona Rosa", "Coyoacán Centro"],
+]
+
+SOCIOECONOMIC_TIERS = [
+    (["Polanco", "Santa Fe", "San Ángel", "Zona Rosa"], (8, 11)),
+    (["Roma Norte", "Condesa", "Del Valle", "Anzures"], (6, 9)),
+    (["Narvarte", "Escandón", "Juárez", "Coyoacán Centro"], (4, 7)),
+]
+SOCIOECONOMIC_DEFAULT = (2, 6)
+
+COORD_JITTER_DEG = 0.015  # Dispersión alrededor de la colonia plantilla
+
+def tier_index(name: str, tiers: List, default: int) -> int:
+    """Posición del primer nivel que contiene a la colonia (o default)"""
+    for index, tier in enumerate(tiers):
+        names = tier[0] if isinstance(tier, tuple) else tier
+        if name in names:
+            return index
+    return default
+
+def tiered_randint(rng: np.random.Generator, tiers: np.ndarray,
+                   ranges: List[tuple]) -> np.ndarray:
+    """randint [low, high) por zona según su nivel"""
+    low = np.array([r[0] for r in ranges])[tiers]
+    high = np.array([r[1] for r in ranges])[tiers]
+    return rng.integers(low, high)
+
+def generate_synthetic_zones(num_zones: int, seed: int = 42,
+                             mock_path: Path = MOCK_DATASET_PATH) -> List[Dict[str, Any]]:
+    """Zonas sintéticas con las distribuciones del extractor y las colonias del dataset mock
+
+    Cada zona toma una colonia del mock como plantilla (alcaldía y coordenadas
+    con dispersión) y sus variables se sortean con los rangos por nivel de
+    DatatonDataExtractor.
+    """
+    rng = np.random.default_rng(seed)
+    with open(mock_path, encoding='utf-8') as f:
+        templates = json.load(f)['colonias']
+
+    names = [template['nombre'] for template in templates]
+    template_ids = rng.integers(0, len(templates), num_zones)
+    base_lat = np.array([t['coordenadas']['lat'] for t in templates])[template_ids]
+    base_lon = np.array([t['coordenadas']['lon'] for t in templates])[template_ids]
+
+    def tiers_for(tiers: List) -> np.ndarray:
+        return np.array([tier_index(name, tiers, len(tiers)) for name in names])[template_ids]
+
+    columns: Dict[str, np.ndarray] = {
+        'lat': base_lat + rng.normal(0, COORD_JITTER_DEG, num_zones),
+        'lon': base_lon + rng.normal(0, COORD_JITTER_DEG, num_zones),
+        'indice_seguridad': tiered_randint(
+            rng, tiers_for(SECURITY_TIERS), [r for _, r in SECURITY_TIERS] + [SECURITY_DEFAULT]
+        ),
+        'nivel_socioeconomico': tiered_randint(
+            rng, tiers_for(SOCIOECONOMIC_TIERS), [r for _, r in SOCIOECONOMIC_TIERS] + [SOCIOECONOMIC_DEFAULT]
+        ),
+    }
+
+    venta = tiered_randint(rng, tiers_for(PRICE_TIERS), [r for _, r in PRICE_TIERS] + [PRICE_DEFAULT])
+    columns['precio_m2_venta_pesos'] = venta
+    columns['precio_m2_renta_pesos'] = (venta * 0.015).astype(int)
+
+    transport_tiers = tiers_for(TRANSPORT_TIERS)
+    transport_ranges = [ranges for _, ranges in TRANSPORT_TIERS] + [TRANSPORT_DEFAULT]
+    for field in TRANSPORT_DEFAULT:
+        columns[field] = tiered_randint(rng, transport_tiers, [ranges[field] for ranges in transport_ranges])
+
+    amenity_tiers = tiers_for(AMENITY_TIERS)
+    score_amenidades = np.zeros(num_zones)
+    for field, premium, good, rest, max_value, weight in AMENITY_FIELDS:
+        counts = tiered_randint(rng, amenity_tiers, [premium, good, rest])
+        columns[field] = counts
+        score_amenidades += np.minimum(counts, max_value) / max_value * 100 * weight
+    columns['score_amenidades'] = score_amenidades
+
+    population = rng.integers(5000, 50000, num_zones)
+    columns['densidad_poblacional'] = population / rng.uniform(1.5, 8.0, num_zones)
+
+    alcaldias = [template['alcaldia'] for template in templates]
+    python_columns = {field: values.tolist() for field, values in columns.items()}
+    zones = []
+    for i, template_id in enumerate(template_ids.tolist()):
+        zone = {'colonia': f"{names[template_id]} {i:06d}", 'alcaldia': alcaldias[template_id]}
+        for field, values in python_columns.items():
+            zone[field] = values[i]
+        zones.append(zone)
+    return zones
+
+def generate_synthetic_profiles(num_profiles: int, engine: IntelligentRecommendationEngine,
+                                seed: int = 42) -> List[UserProfile]:
+    """Perfiles aleatorios reproducibles sobre los estilos y ubicaciones del motor"""
+    rng = np.random.default_rng(seed)
+    lifestyles = list(engine.lifestyle_profiles)
+    work_locations = list(engine.work_locations)
+
+    profiles = []
+    for _ in range(num_profiles):
+        tiene_hijos = bool(rng.random() < 0.4)
+        profiles.append(UserProfile(
+            presupuesto_max_renta=int(rng.integers(8, 80)) * 1000,
+            tamano_familia=int(rng.integers(1, 6)),
+            tiene_hijos=tiene_hijos,
+            edades_hijos=rng.integers(0, 18, int(rng.integers(1, 4))).tolist() if tiene_hijos else [],
+            prioridad_seguridad=int(rng.integers(0, 11)),
+            prioridad_transporte=int(rng.integers(0, 11)),
+            prioridad_precio=int(rng.integers(0, 11)),
+            prioridad_escuelas=int(rng.integers(0, 11)),
+            prioridad_hospitales=int(rng.integers(0, 11)),
+            prioridad_centros_comerciales=int(rng.integers(0, 11)),
+            prefiere_zonas_tranquilas=bool(rng.random() < 0.5),
+            tiempo_max_trabajo_min=int(rng.integers(20, 90)),
+            ubicacion_trabajo=str(rng.choice(work_locations)),
+            estilo_vida=str(rng.choice(lifestyles))
+        ))
+    return profiles
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """p50/p95 (ms) y throughput de una serie de latencias en segundos"""
+    values = np.array(samples)
+    return {
+        'n': int(values.size),
+        'p50_ms': float(np.percentile(values, 50) * 1000),
+        'p95_ms': float(np.percentile(values, 95) * 1000),
+        'media_ms': float(values.mean() * 1000),
+        'throughput_por_s': float(values.size / values.sum()) if values.sum() > 0 else None
+    }
+
+def time_calls(function: Callable[[Any], Any], items: List[Any],
+               setup: Optional[Callable[[Any], Any]] = None) -> List[float]:
+    """Latencia de function(item) por elemento; setup corre fuera del tiempo medido"""
+    samples = []
+    for item in items:
+        if setup is not None:
+            setup(item)
+        start = time.perf_counter()
+        function(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def benchmark_size(num_zones: int, num_profiles: int, batch_size: int,
+                   seed: int = 42) -> Dict[str, Any]:
+    """Mide cada etapa del motor sobre una tabla sintética de num_zones zonas"""
+    engine = IntelligentRecommendationEngine()
+    zone_table = ZoneTable.from_records(generate_synthetic_zones(num_zones, seed))
+    profiles = generate_synthetic_profiles(num_profiles, engine, seed)
+    batch = generate_synthetic_profiles(batch_size, engine, seed + 1)
+
+    def clear_result_caches(_):
+        engine.weights_cache.clear()
+        engine.recommendation_cache.clear()
+
+    def cold_features(_):
+        engine.feature_store.invalidate()
+        engine.feature_store.get(zone_table)
+
+    stages: Dict[str, Any] = {'features': summarize(time_calls(cold_features, range(3)))}
+
+    # Calentamiento: matriz de traslados y caches de columnas fuera de la medición
+    start = time.perf_counter()
+    for work_location in engine.work_locations:
+        engine.generate_recommendations(zone_table, UserProfile(ubicacion_trabajo=work_location))
+    warmup_s = time.perf_counter() - start
+
+    stages['generate_recommendations'] = summarize(time_calls(
+        lambda profile: engine.generate_recommendations(zone_table, profile), profiles,
+        setup=clear_result_caches
+    ))
+    stages['generate_recommendations_cache'] = summarize(time_calls(
+        lambda profile: engine.generate_recommendations(zone_table, profile), profiles,
+        setup=lambda profile: engine.generate_recommendations(zone_table, profile)
+    ))
+    stages['pesos'] = summarize(time_calls(engine.compute_personalized_weights, profiles))
+
+    # Etapas internas con entradas precalculadas por perfil
+    prepared = []
+    for profile in profiles:
+        weights = engine.compute_personalized_weights(profile)
+        category_matrix = engine.calculate_category_score_matrix(zone_table, profile)
+        total_scores = engine.combine_category_scores(category_matrix, weights)
+        prepared.append((profile, weights, category_matrix, total_scores))
+
+    stages['scoring'] = summarize(time_calls(
+        lambda item: engine.combine_category_scores(
+            engine.calculate_category_score_matrix(zone_table, item[0]), item[1]
+        ), prepared
+    ))
+    stages['diversificacion'] = summarize(time_calls(
+        lambda item: engine.select_recommendation_indices(zone_table, item[3], 5, item[2]), prepared
+    ))
+
+    selections = [engine.select_recommendation_indices(zone_table, item[3], 5, item[2]) for item in prepared]
+    stages['explicaciones'] = summarize(time_calls(
+        lambda pair: engine.build_recommendations(
+            zone_table, pair[0][2], pair[0][3], pair[1][0], pair[1][1], pair[0][0], pair[0][1]
+        ), list(zip(prepared, selections))
+    ))
+
+    clear_result_caches(None)
+    start = time.perf_counter()
+    engine.generate_batch_recommendations(zone_table, batch)
+    batch_s = time.perf_counter() - start
+    stages['lote'] = {
+        'perfiles': batch_size,
+        'total_ms': batch_s * 1000,
+        'throughput_por_s': batch_size / batch_s if batch_s > 0 else None
+    }
+
+    # Memoria pico en una corrida aparte (tracemalloc distorsiona las latencias)
+    clear_result_caches(None)
+    engine.feature_store.invalidate()
+    tracemalloc.start()
+    engine.generate_recommendations(zone_table, profiles[0])
+    engine.generate_batch_recommendations(zone_table, batch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'zonas': num_zones,
+        'perfiles': num_profiles,
+        'calentamiento_ms': warmup_s * 1000,
+        'memoria_pico_mb': peak / 2 ** 20,
+        'etapas': stages
+    }
+
+def run_benchmark(sizes: List[int] = None, num_profiles: int = 50, batch_size: int = 200,
+                  seed: int = 42) -> Dict[str, Any]:
+    """Corre el benchmark para cada tamaño y devuelve el reporte completo"""
+    sizes = sizes or DEFAULT_SIZES
+    results = [benchmark_size(num_zones, num_profiles, batch_size, seed) for num_zones in sizes]
+
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_mb = max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'semilla': seed,
+        'rss_maximo_mb': max_rss_mb,
+        'resultados': results
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de recomendaciones CasaMX")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Número de zonas por corrida")
+    parser.add_argument('--profiles', type=int, default=50, help="Perfiles para medir latencias")
+    parser.add_argument('--batch', type=int, default=200, help="Perfiles del lote")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=Path, help="Archivo JSON de salida (por defecto stdout)")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sizes, args.profiles, args.batch, args.seed)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(output, encoding='utf-8')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+MODELO DE TRASLADOS - DATATÓN ITAM 2025
+Matriz precomputada de tiempos colonia×destino para CasaMX
+
+David Fernando Ávila Díaz - ITAM
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple, Union
+
+import numpy as np
+
+GEO_DATA_PATH = Path(__file__).parent / "datos_geograficos_cdmx.json"
+
+# Velocidades comerciales por modo (km/h) y parámetros del modelo
+MODE_SPEEDS_KMH = {
+    'caminando': 4.5,
+    'metro': 32.0,
+    'superficie': 16.0  # Autobús, metrobús y auto en tráfico mixto
+}
+DETOUR_FACTOR = 1.3  # Distancia real de la red vs. línea recta
+METRO_OVERHEAD_MIN = 5.0  # Andén, transbordos y espera
+SURFACE_OVERHEAD_MIN = 6.0  # Espera / estacionamiento
+ROWS_PER_CHUNK = 8192
+
+class KDTree2D:
+    """KD-tree mínimo para vecino más cercano sobre coordenadas proyectadas (km)"""
+
+    def __init__(self, points: np.ndarray):
+        self.points = np.asarray(points, dtype=float)
+        # Nodo: (índice del punto, eje, hijo izquierdo, hijo derecho)
+        self.nodes: List[Tuple[int, int, int, int]] = []
+        self.root = self._build(np.arange(len(self.points)), 0)
+
+    def _build(self, indices: np.ndarray, depth: int) -> int:
+        if indices.size == 0:
+            return -1
+
+        axis = depth % 2
+        indices = indices[np.argsort(self.points[indices, axis], kind='stable')]
+        median = indices.size // 2
+
+        node_id = len(self.nodes)
+        self.nodes.append((int(indices[median]), axis, -1, -1))
+        left = self._build(indices[:median], depth + 1)
+        right = self._build(indices[median + 1:], depth + 1)
+        self.nodes[node_id] = (int(indices[median]), axis, left, right)
+        return node_id
+
+    def nearest(self, point: Tuple[float, float]) -> Tuple[int, float]:
+        """Índice del punto más cercano y su distancia euclidiana"""
+        best_index, best_distance = -1, np.inf
+        stack = [self.root]
+
+        while stack:
+            node_id = stack.pop()
+            if node_id < 0:
+                continue
+
+            index, axis, left, right = self.nodes[node_id]
+            node_point = self.points[index]
+            distance = float(np.hypot(node_point[0] - point[0], node_point[1] - point[1]))
+            if distance < best_distance:
+                best_index, best_distance = index, distance
+
+            delta = point[axis] - node_point[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            # La rama lejana solo se visita si puede contener algo más cercano
+            if abs(delta) < best_distance:
+                stack.append(far)
+            stack.append(near)
+
+        return best_index, best_distance
+
+def project_km(lat: np.ndarray, lon: np.ndarray, ref_lat: float = 19.4326) -> np.ndarray:
+    """Proyección equirectangular a km (suficiente a escala de la CDMX)"""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    return np.column_stack([lon * 111.32 * np.cos(np.radians(ref_lat)), lat * 110.57])
+
+def load_default_hubs(work_locations: Dict[str, Dict[str, Any]] = None,
+                      geo_data_path: Union[str, Path] = GEO_DATA_PATH
+                      ) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """Destinos por defecto (ubicaciones de trabajo, puntos de interés y estaciones de metro)
+
+    Devuelve la lista de hubs y las coordenadas (lat, lon) de las estaciones de metro.
+    """
+    hubs: Dict[str, Dict[str, Any]] = {}
+    stations = []
+
+    for name, location in (work_locations or {}).items():
+        hubs[name] = {'nombre': name, 'lat': location['lat'], 'lon': location['lon'], 'tipo': 'trabajo'}
+
+    geo_data_path = Path(geo_data_path)
+    if geo_data_path.exists():
+        with open(geo_data_path, encoding='utf-8') as f:
+            geo_data = json.load(f)
+
+        for point in geo_data.get('puntos_interes', []):
+            coords = point['coordenadas']
+            hubs.setdefault(point['nombre'], {
+                'nombre': point['nombre'], 'lat': coords['lat'], 'lon': coords['lon'],
+                'tipo': point.get('tipo', 'interes')
+            })
+
+        for line in geo_data.get('transporte_metro', {}).get('lineas', []):
+            for station in line.get('estaciones', []):
+                stations.append((station['lat'], station['lon']))
+                hubs.setdefault(f"Metro {station['nombre']}", {
+                    'nombre': f"Metro {station['nombre']}", 'lat': station['lat'],
+                    'lon': station['lon'], 'tipo': 'metro'
+                })
+
+    return list(hubs.values()), np.array(stations, dtype=float).reshape(-1, 2)
+
+class CommuteModel:
+    """Matriz densa de tiempos de traslado (minutos) colonia×destino"""
+
+    def __init__(self, travel_times: np.ndarray, hubs: List[Dict[str, Any]],
+                 data_version: str = ""):
+        self.travel_times = travel_times  # M×H float32 (puede ser un memmap)
+        self.hubs = hubs
+        self.data_version = data_version
+        self.hub_index = {hub['nombre']: i for i, hub in enumerate(hubs)}
+
+        hub_coords = np.array([[hub['lat'], hub['lon']] for hub in hubs], dtype=float).reshape(-1, 2)
+        self.hub_coords = hub_coords
+        self.hub_tree = KDTree2D(project_km(hub_coords[:, 0], hub_coords[:, 1]))
+
+    @classmethod
+    def build(cls, lat: np.ndarray, lon: np.ndarray, hubs: List[Dict[str, Any]],
+              metro_stations: Optional[np.ndarray] = None,
+              data_version: str = "") -> 'CommuteModel':
+        """Precalcula la matriz con distancia haversine y velocidades por modo"""
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        hub_lat = np.array([hub['lat'] for hub in hubs], dtype=float)
+        hub_lon = np.array([hub['lon'] for hub in hubs], dtype=float)
+
+        has_metro = metro_stations is not None and len(metro_stations) > 0
+        if has_metro:
+            hub_to_metro = nearest_station_km(hub_lat, hub_lon, metro_stations)
+
+        travel_times = np.empty((lat.size, len(hubs)), dtype=np.float32)
+        for start in range(0, lat.size, ROWS_PER_CHUNK):
+            rows = slice(start, start + ROWS_PER_CHUNK)
+            distance = haversine_km(lat[rows, None], lon[rows, None], hub_lat[None, :], hub_lon[None, :])
+            network_km = distance * DETOUR_FACTOR
+
+            minutes = SURFACE_OVERHEAD_MIN + network_km / MODE_SPEEDS_KMH['superficie'] * 60
+            if has_metro:
+                # Caminar a la estación, viajar en metro y caminar al destino
+                walk_km = nearest_station_km(lat[rows], lon[rows], metro_stations)[:, None] + hub_to_metro[None, :]
+                metro_minutes = (METRO_OVERHEAD_MIN
+                                 + walk_km / MODE_SPEEDS_KMH['caminando'] * 60
+                                 + network_km / MODE_SPEEDS_KMH['metro'] * 60)
+                minutes = np.fmin(minutes, metro_minutes)
+
+            travel_times[rows] = minutes
+
+        return cls(travel_times, hubs, data_version)
+
+    def save(self, directory: Union[str, Path]) -> Path:
+        """Guarda la matriz como .npy (memory-mappable) más sus metadatos"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        matrix_path = directory / f"travel_times_{self.data_version}.npy"
+
+        np.save(matrix_path, np.asarray(self.travel_times, dtype=np.float32))
+        with open(matrix_path.with_suffix('.json'), 'w', encoding='utf-8') as f:
+            json.dump({'data_version': self.data_version, 'hubs': self.hubs}, f, ensure_ascii=False)
+
+        return matrix_path
+
+    @classmethod
+    def load(cls, directory: Union[str, Path], data_version: str) -> Optional['CommuteModel']:
+        """Carga una matriz guardada con mmap; None si no existe esa versión"""
+        matrix_path = Path(directory) / f"travel_times_{data_version}.npy"
+        if not matrix_path.exists() or not matrix_path.with_suffix('.json').exists():
+            return None
+
+        with open(matrix_path.with_suffix('.json'), encoding='utf-8') as f:
+            metadata = json.load(f)
+
+        travel_times = np.load(matrix_path, mmap_mode='r')
+        return cls(travel_times, metadata['hubs'], metadata['data_version'])
+
+    def nearest_hub(self, lat: float, lon: float) -> Tuple[int, float]:
+        """Hub más cercano a un punto arbitrario (índice y distancia en km)"""
+        index, _ = self.hub_tree.nearest(tuple(project_km([lat], [lon])[0]))
+        hub_lat, hub_lon = self.hub_coords[index]
+        return index, float(haversine_km(lat, lon, hub_lat, hub_lon))
+
+    def times_to_hub(self, hub_name: str) -> Optional[np.ndarray]:
+        """Tiempos de todas las zonas a un destino conocido"""
+        index = self.hub_index.get(hub_name)
+        if index is None:
+            return None
+        return np.asarray(self.travel_times[:, index], dtype=float)
+
+    def times_to_point(self, lat: float, lon: float) -> np.ndarray:
+        """Tiempos de todas las zonas a un lugar de trabajo arbitrario"""
+        index, hub_km = self.nearest_hub(lat, lon)
+        # Última milla del hub al lugar de trabajo
+        last_mile = hub_km * DETOUR_FACTOR / MODE_SPEEDS_KMH['superficie'] * 60
+        return np.asarray(self.travel_times[:, index], dtype=float) + last_mile
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distancia haversine en km (acepta escalares o arrays NumPy)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+def nearest_station_km(lat: np.ndarray, lon: np.ndarray, stations: np.ndarray) -> np.ndarray:
+    """Distancia (km) de cada punto a la estación de metro más cercana"""
+    distance = haversine_km(np.asarray(lat, dtype=float)[:, None], np.asarray(lon, dtype=float)[:, None],
+                            stations[None, :, 0], stations[None, :, 1])
+    return distance.min(axis=1)
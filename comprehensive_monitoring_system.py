@@ -18,13 +18,14 @@ from enum import Enum
 from typing import Dict, List, Optional, Any, Callable
 from pathlib import Path
 import logging
-import sqlite3
 import queue
 import statistics
 from collections import deque, defaultdict
 import warnings
 warnings.filterwarnings("ignore")
 
+from sqlite_schema import connect_database, migrate_database
+
 class AlertLevel(Enum):
     INFO = "info"
     WARNING = "warning"
@@ -301,9 +302,10 @@ class ComprehensiveMonitoringSystem:
         self.logger.info("🔍 Sistema de monitoreo comprehensivo iniciado")
     
     def init_monitoring_database(self):
-        """Inicializa base de datos de monitoreo"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
+        """Inicializa base de datos de monitoreo (WAL + migraciones)"""
+        migrate_database(self.db_path, [
+            [
+                '''
                 CREATE TABLE IF NOT EXISTS performance_metrics (
                     id TEXT PRIMARY KEY,
                     name TEXT NOT NULL,
@@ -311,13 +313,10 @@ class ComprehensiveMonitoringSystem:
                     unit TEXT,
                     timestamp TEXT NOT NULL,
                     tags TEXT,
-                    metric_type TEXT,
-                    INDEX(name),
-                    INDEX(timestamp)
+                    metric_type TEXT
                 )
-            ''')
-            
-            conn.execute('''
+                ''',
+                '''
                 CREATE TABLE IF NOT EXISTS system_alerts (
                     id TEXT PRIMARY KEY,
                     level TEXT NOT NULL,
@@ -326,14 +325,10 @@ class ComprehensiveMonitoringSystem:
                     timestamp TEXT NOT NULL,
                     metadata TEXT,
                     resolved BOOLEAN DEFAULT 0,
-                    resolution_timestamp TEXT,
-                    INDEX(level),
-                    INDEX(component),
-                    INDEX(timestamp)
+                    resolution_timestamp TEXT
                 )
-            ''')
-            
-            conn.execute('''
+                ''',
+                '''
                 CREATE TABLE IF NOT EXISTS agent_health_history (
                     id TEXT PRIMARY KEY,
                     agent_id TEXT NOT NULL,
@@ -344,11 +339,22 @@ class ComprehensiveMonitoringSystem:
                     avg_response_time REAL,
                     memory_usage_mb REAL,
                     cpu_usage_percent REAL,
-                    error_rate REAL,
-                    INDEX(agent_id),
-                    INDEX(timestamp)
+                    error_rate REAL
                 )
-            ''')
+                '''
+            ],
+            [
+                # Series por métrica/agente en orden temporal y purgas por antigüedad
+                'CREATE INDEX IF NOT EXISTS idx_metrics_name_timestamp ON performance_metrics (name, timestamp, value)',
+                'CREATE INDEX IF NOT EXISTS idx_metrics_timestamp ON performance_metrics (timestamp)',
+                # Conteo de alertas recientes por nivel (dashboard) sin tocar la tabla
+                'CREATE INDEX IF NOT EXISTS idx_alerts_timestamp_level ON system_alerts (timestamp, level)',
+                'CREATE INDEX IF NOT EXISTS idx_alerts_level ON system_alerts (level, timestamp)',
+                'CREATE INDEX IF NOT EXISTS idx_alerts_component ON system_alerts (component, timestamp)',
+                'CREATE INDEX IF NOT EXISTS idx_health_agent_timestamp ON agent_health_history (agent_id, timestamp)',
+                'CREATE INDEX IF NOT EXISTS idx_health_timestamp ON agent_health_history (timestamp)'
+            ]
+        ])
     
     def setup_monitoring_logging(self):
         """Configuración de logging para monitoreo"""
@@ -396,7 +402,7 @@ class ComprehensiveMonitoringSystem:
         )
         
         # Guardar alerta en base de datos
-        with sqlite3.connect(self.db_path) as conn:
+        with connect_database(self.db_path) as conn:
             conn.execute('''
                 INSERT INTO system_alerts
                 (id, level, component, message, timestamp, metadata)
@@ -418,7 +424,7 @@ class ComprehensiveMonitoringSystem:
     
     def _persist_metrics(self):
         """Persiste métricas en base de datos"""
-        with sqlite3.connect(self.db_path) as conn:
+        with connect_database(self.db_path) as conn:
             # Obtener métricas del buffer
             metrics_to_persist = []
             
@@ -448,7 +454,7 @@ class ComprehensiveMonitoringSystem:
     
     def _persist_agent_health(self):
         """Persiste estado de salud de agentes"""
-        with sqlite3.connect(self.db_path) as conn:
+        with connect_database(self.db_path) as conn:
             with self.real_time_monitor.lock:
                 for agent_id, health in self.real_time_monitor.agent_health.items():
                     conn.execute('''
@@ -475,7 +481,7 @@ class ComprehensiveMonitoringSystem:
         performance_metrics = self.performance_tracker.get_performance_summary()
         
         # Obtener alertas recientes
-        with sqlite3.connect(self.db_path) as conn:
+        with connect_database(self.db_path) as conn:
             cursor = conn.execute('''
                 SELECT level, COUNT(*) FROM system_alerts
                 WHERE timestamp > datetime('now', '-1 hour')
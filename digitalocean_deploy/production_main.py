@@ -4,27 +4,82 @@ CasaMX Production FastAPI Application
 Optimized for DigitalOcean deployment
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+import asyncio
+import csv
+import io
+import gzip
+import hashlib
+import hmac
+import inspect
+import json
 import sqlite3
-import redis
+import threading
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+import redis.asyncio as aioredis
 from pathlib import Path
 import os
 import logging
-from typing import Dict, List, Any
-from pydantic import BaseModel
+import random
+import math
+import fcntl
+import sys
+from dataclasses import asdict
+from typing import Dict, List, Any, Optional, Tuple, Iterator, Callable, Union
+from pydantic import BaseModel, Field
 import time
-from prometheus_client import Counter, Histogram, generate_latest
+import re
+import unicodedata
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+from starlette.background import BackgroundTask
 from starlette.responses import Response
+from starlette.routing import Match
 import structlog
 
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are precomputed
+    brotli = None
+
+# The recommendation engine lives at the repository root
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.append(str(REPO_ROOT))
+from recommendation_engine import (
+    DIVERSIFICATION_PRESETS, IntelligentRecommendationEngine, UserProfile, ZoneTable
+)
+
 # Configuration
 DATABASE_PATH = Path("data/casamx.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+L1_CACHE_SIZE = int(os.getenv("L1_CACHE_SIZE", "2048"))
+L1_CACHE_TTL = int(os.getenv("L1_CACHE_TTL", "300"))
+SNAPSHOT_MAX_ENTRIES = int(os.getenv("SNAPSHOT_MAX_ENTRIES", "512"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "500"))
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "2"))
+RECOMMEND_CACHE_TTL = int(os.getenv("RECOMMEND_CACHE_TTL", "3600"))
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.5"))
+RELOAD_SOURCE_PATH = Path(os.getenv("RELOAD_SOURCE_PATH", str(DATABASE_PATH.with_name("casamx.db.new"))))
+RELOAD_WATCH_INTERVAL = float(os.getenv("RELOAD_WATCH_INTERVAL", "5"))  # 0 disables the watcher
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD", "0.5"))  # seconds
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv("SLOW_REQUEST_SAMPLE_RATE", "0.25"))
+SLOW_REQUEST_MAX_STATEMENTS = 20
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-me")
 ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "casamx.store,www.casamx.store,localhost").split(",")
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
@@ -50,36 +105,111 @@ structlog.configure(
 logger = structlog.get_logger()
 
 # Prometheus metrics
-REQUEST_COUNT = Counter('casamx_requests_total', 'Total requests', ['method', 'endpoint'])
-REQUEST_DURATION = Histogram('casamx_request_duration_seconds', 'Request duration')
+# Labels use the route template (/api/colonias/{id}), never the raw path
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PHASE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+REQUEST_COUNT = Counter('casamx_requests_total', 'Total requests', ['method', 'route'])
+REQUEST_DURATION = Histogram('casamx_request_duration_seconds', 'Request duration',
+                             ['method', 'route'], buckets=LATENCY_BUCKETS)
+REQUEST_PHASE_DURATION = Histogram('casamx_request_phase_seconds',
+                                   'Time spent per request in db, cache and serialization',
+                                   ['route', 'phase'], buckets=PHASE_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge('casamx_requests_in_flight', 'Requests being processed', ['method'])
 DATABASE_QUERIES = Counter('casamx_database_queries_total', 'Database queries')
-CACHE_HITS = Counter('casamx_cache_hits_total', 'Cache hits')
-CACHE_MISSES = Counter('casamx_cache_misses_total', 'Cache misses')
+CACHE_HITS = Counter('casamx_cache_hits_total', 'Cache hits', ['tier'])
+CACHE_MISSES = Counter('casamx_cache_misses_total', 'Cache misses', ['tier'])
+RECOMMENDATION_DURATION = Histogram('casamx_recommendation_duration_seconds',
+                                    'Recommendation scoring duration (cache misses only)')
+DB_POOL_CONNECTIONS = Gauge('casamx_db_pool_connections', 'SQLite pool connections', ['state'])
+
+# Per-request timings
+class RequestTimings:
+    """Time one request spent in SQLite, Redis and serialization, plus its SQL"""
+
+    PHASES = ("db", "cache", "serialization")
+    __slots__ = PHASES + ("statements",)
+
+    def __init__(self):
+        self.db = self.cache = self.serialization = 0.0
+        self.statements: List[str] = []
+
+    def add_statement(self, sql: str):
+        # SQLite trace callback: statements arrive expanded with their bound parameters;
+        # "-- " ones are issued internally by virtual tables and triggers
+        if len(self.statements) < SLOW_REQUEST_MAX_STATEMENTS and not sql.startswith("-- "):
+            self.statements.append(sql)
+
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
 
-# Redis connection
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Add the duration of the block to the current request's phase total"""
+    timings = request_timings.get()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            setattr(timings, phase, getattr(timings, phase) + time.perf_counter() - start_time)
+
+# Redis connection (asyncio client over a bounded connection pool; verified at startup)
 try:
-    redis_client = redis.Redis.from_url(REDIS_URL, password=REDIS_PASSWORD, decode_responses=True)
-    redis_client.ping()
-    logger.info("Redis connection established")
+    redis_client = aioredis.Redis.from_url(
+        REDIS_URL, password=REDIS_PASSWORD, decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT
+    )
 except Exception as e:
-    logger.error("Redis connection failed", error=str(e))
+    logger.error("Redis client setup failed", error=str(e))
     redis_client = None
 
 # Pydantic models
 class ColoniaResponse(BaseModel):
-    id: int
+    id: Union[int, str]
     nombre: str
     delegacion: str
     cp: str
     lat: float = None
     lng: float = None
 
+class UserProfileRequest(BaseModel):
+    """Request body of /api/recommend; mirrors recommendation_engine.UserProfile"""
+    presupuesto_max_renta: int = Field(25000, ge=0)
+    presupuesto_max_compra: int = Field(3000000, ge=0)
+    tamano_familia: int = Field(2, ge=1)
+    tiene_hijos: bool = False
+    edades_hijos: List[int] = []
+    prioridad_seguridad: int = Field(8, ge=0, le=10)
+    prioridad_transporte: int = Field(7, ge=0, le=10)
+    prioridad_precio: int = Field(6, ge=0, le=10)
+    prioridad_escuelas: int = Field(3, ge=0, le=10)
+    prioridad_hospitales: int = Field(5, ge=0, le=10)
+    prioridad_vida_nocturna: int = Field(4, ge=0, le=10)
+    prioridad_areas_verdes: int = Field(6, ge=0, le=10)
+    prioridad_centros_comerciales: int = Field(5, ge=0, le=10)
+    prefiere_zonas_tranquilas: bool = True
+    requiere_estacionamiento: bool = True
+    acepta_ruido_trafico: bool = False
+    tiempo_max_trabajo_min: int = Field(45, ge=0)
+    ubicacion_trabajo: str = "Centro"
+    trabajo_lat: Optional[float] = None
+    trabajo_lon: Optional[float] = None
+    estilo_vida: str = "familiar"
+
+class ColoniaBatchRequest(BaseModel):
+    ids: List[Union[int, str]] = Field(..., min_length=1, max_length=BATCH_MAX_IDS)
+
+class ColoniaBatchResponse(BaseModel):
+    colonias: List[ColoniaResponse]
+    missing: List[Union[int, str]]
+
 class HealthResponse(BaseModel):
     status: str
     timestamp: str
     version: str
     database: str
     redis: str
+    database_pool: Optional[Dict[str, int]] = None
 
 # FastAPI app
 app = FastAPI(
@@ -105,62 +235,876 @@ app.add_middleware(GZipMiddleware, minimum_size=1000)
 if Path("static").exists():
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Database helper
-def get_db():
-    """Get database connection"""
+# Database connection pool
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up in time"""
+
+class SQLitePool:
+    """Bounded pool of read-only SQLite connections shared by all routes
+
+    Connections are opened lazily up to max_size, reused LIFO (warm page cache and
+    statement cache) and re-validated with SELECT 1 after sitting idle.
+    """
+
+    def __init__(self, path: Path, max_size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT,
+                 health_check_interval: float = 30.0):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle: "queue.LifoQueue[Tuple[sqlite3.Connection, float]]" = queue.LifoQueue()
+        self._created = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            f"file:{self.path}?mode=ro", uri=True, check_same_thread=False,
+            cached_statements=256  # Prepared statement reuse per connection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, open a new one below max_size, or wait for one"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.max_size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    self._update_metrics()
+                    return conn
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                try:
+                    conn, released_at = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+            if time.monotonic() - released_at < self.health_check_interval:
+                self._update_metrics()
+                return conn
+            try:
+                conn.execute("SELECT 1").fetchone()
+                self._update_metrics()
+                return conn
+            except sqlite3.Error as e:
+                logger.warning("Discarding broken pooled connection", error=str(e))
+                self._discard(conn)
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            self._update_metrics()
+            return
+        if self._closed:
+            self._discard(conn)
+            self._update_metrics()
+            return
+        self._idle.put((conn, time.monotonic()))
+        self._update_metrics()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def warm(self, count: int):
+        """Open up to count connections ahead of traffic"""
+        conns = [self.acquire() for _ in range(min(count, self.max_size))]
+        for conn in conns:
+            self.release(conn)
+
+    def close(self):
+        """Close all idle connections (in-use ones are closed when released after this)"""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+        self._update_metrics()
+
+    def stats(self) -> Dict[str, int]:
+        idle = self._idle.qsize()
+        return {"size": self._created, "idle": idle, "in_use": self._created - idle, "max_size": self.max_size}
+
+    def _update_metrics(self):
+        stats = self.stats()
+        DB_POOL_CONNECTIONS.labels(state="idle").set(stats["idle"])
+        DB_POOL_CONNECTIONS.labels(state="in_use").set(stats["in_use"])
+
+db_pool = SQLitePool(DATABASE_PATH)
+
+def configure_database(conn: sqlite3.Connection):
+    """Persistent database settings applied once from a read-write connection"""
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+
+# Blocking SQLite work runs on a bounded thread pool, never on the event loop
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="casamx-db")
+
+async def run_db(query: Callable[[sqlite3.Connection], Any]) -> Any:
+    """Run query(conn) with a pooled connection on the database thread pool"""
     if not DATABASE_PATH.exists():
         raise HTTPException(status_code=500, detail="Database not found")
-    
-    conn = sqlite3.connect(str(DATABASE_PATH))
-    conn.row_factory = sqlite3.Row
+
+    # Executor threads don't inherit contextvars, so capture the timings here
+    timings = request_timings.get()
+
+    def run():
+        with db_pool.connection() as conn:
+            if timings is None:
+                return query(conn)
+            conn.set_trace_callback(timings.add_statement)
+            try:
+                return query(conn)
+            finally:
+                conn.set_trace_callback(None)
+
     try:
-        yield conn
-    finally:
-        conn.close()
+        with timed("db"):
+            return await asyncio.get_running_loop().run_in_executor(db_executor, run)
+    except PoolTimeout as e:
+        logger.error("Database pool exhausted", error=str(e))
+        raise HTTPException(status_code=503, detail="Database busy")
 
 # Cache helper
-def get_from_cache(key: str) -> Any:
+async def get_from_cache(key: str) -> Any:
     """Get data from Redis cache"""
     if not redis_client:
         return None
     
     try:
-        data = redis_client.get(key)
+        with timed("cache"):
+            data = await redis_client.get(key)
         if data:
-            CACHE_HITS.inc()
+            CACHE_HITS.labels(tier="l2").inc()
             return data
         else:
-            CACHE_MISSES.inc()
+            CACHE_MISSES.labels(tier="l2").inc()
             return None
     except Exception as e:
         logger.error("Cache get failed", key=key, error=str(e))
         return None
 
-def set_to_cache(key: str, value: str, ttl: int = 3600) -> bool:
+async def get_many_from_cache(keys: List[str]) -> List[Any]:
+    """Get several keys in one round trip (MGET); None for misses"""
+    if not redis_client or not keys:
+        return [None] * len(keys)
+
+    try:
+        with timed("cache"):
+            values = await redis_client.mget(keys)
+        hits = sum(1 for value in values if value)
+        CACHE_HITS.labels(tier="l2").inc(hits)
+        CACHE_MISSES.labels(tier="l2").inc(len(keys) - hits)
+        return values
+    except Exception as e:
+        logger.error("Cache multi-get failed", keys=len(keys), error=str(e))
+        return [None] * len(keys)
+
+async def set_to_cache(key: str, value: str, ttl: int = 3600) -> bool:
     """Set data to Redis cache"""
     if not redis_client:
         return False
     
     try:
-        redis_client.setex(key, ttl, value)
+        with timed("cache"):
+            await redis_client.setex(key, ttl, value)
         return True
     except Exception as e:
         logger.error("Cache set failed", key=key, error=str(e))
         return False
 
+async def set_many_to_cache(items: Dict[str, Tuple[str, int]]) -> bool:
+    """Set several keys with their own TTLs in one round trip (pipelined SETEX)"""
+    if not redis_client or not items:
+        return False
+
+    try:
+        with timed("cache"):
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key, (value, ttl) in items.items():
+                    pipe.setex(key, ttl, value)
+                await pipe.execute()
+        return True
+    except Exception as e:
+        logger.error("Cache pipeline set failed", keys=len(items), error=str(e))
+        return False
+
+class LocalCache:
+    """In-process LRU with per-entry TTL (L1 in front of Redis)"""
+
+    def __init__(self, maxsize: int = L1_CACHE_SIZE, ttl: int = L1_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class ResponseCache:
+    """Two-tier cache (L1 in-process, L2 Redis) with per-key single-flight
+
+    On a miss only the first coroutine for a key runs compute; concurrent
+    requests for the same key await its result instead of hitting SQLite.
+    Without Redis it works as L1 only.
+    """
+
+    # Result given to waiters when the leader is cancelled: they retry instead
+    ABANDONED = object()
+
+    def __init__(self, l1: LocalCache):
+        self.l1 = l1
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: int = 3600) -> Any:
+        found, value = self.l1.get(key)
+        if found:
+            CACHE_HITS.labels(tier="l1").inc()
+            return value
+        CACHE_MISSES.labels(tier="l1").inc()
+
+        while True:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            value = await asyncio.shield(inflight)
+            if value is not self.ABANDONED:
+                return value
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            cached = await get_from_cache(key)
+            if cached:
+                with timed("serialization"):
+                    value = json.loads(cached)
+            else:
+                value = compute()
+                if inspect.isawaitable(value):
+                    value = await value
+                with timed("serialization"):
+                    payload = json.dumps(value)
+                await set_to_cache(key, payload, ttl=ttl)
+
+            self.l1.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # Avoid "exception never retrieved" when nobody else was waiting
+            future.exception()
+            raise
+        except BaseException:
+            # Cancellation belongs to this request only; a waiter takes over the key
+            future.set_result(self.ABANDONED)
+            raise
+        finally:
+            del self._inflight[key]
+
+    def clear(self):
+        self.l1.clear()
+
+response_cache = ResponseCache(LocalCache())
+
+# Schema helpers
+def colonias_column(conn: sqlite3.Connection, *candidates: str) -> str:
+    """First candidate column name present in colonias (e.g. delegacion/alcaldia)"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(colonias)")}
+    return next((column for column in candidates if column in columns), candidates[-1])
+
+# Response snapshots
+def dataset_version(conn: sqlite3.Connection) -> str:
+    """Content hash of the colonias table (changes only when the data is rebuilt)"""
+    digest = hashlib.sha256()
+    for row in conn.execute("SELECT * FROM colonias ORDER BY rowid"):
+        digest.update(json.dumps(tuple(row), default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Accept-Encoding -> {coding: q}"""
+    codings = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+class Snapshot:
+    """Serialized JSON body plus pre-compressed variants and strong ETags"""
+
+    def __init__(self, data: Any, version: str):
+        self.data = data
+        with timed("serialization"):
+            self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self.etag = f'"{version}-{hashlib.sha256(self.body).hexdigest()[:16]}"'
+            # Content-coding specific strong ETags for each precompressed representation
+            self.variants: Dict[str, Tuple[bytes, str]] = {
+                "gzip": (gzip.compress(self.body, compresslevel=9, mtime=0), self.etag[:-1] + '-gzip"')
+            }
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(self.body, quality=11), self.etag[:-1] + '-br"')
+        self.etags = {self.etag} | {etag for _, etag in self.variants.values()}
+
+    def not_modified(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or bool(tags & self.etags)
+
+    def response(self, request: Request, extra_headers: Optional[Dict[str, str]] = None) -> Response:
+        """200 with the best precompressed body for the client, or 304"""
+        codings = parse_accept_encoding(request.headers.get("accept-encoding", ""))
+        coding = next((c for c in ("br", "gzip") if c in self.variants and codings.get(c, 0) > 0), None)
+        body, etag = self.variants[coding] if coding else (self.body, self.etag)
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "public, max-age=0, must-revalidate",
+            "Vary": "Accept-Encoding",
+            **(extra_headers or {})
+        }
+        if self.not_modified(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        if coding:
+            headers["Content-Encoding"] = coding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+class SnapshotStore:
+    """Snapshots of read-mostly responses for the current dataset version
+
+    Data comes through response_cache (L1/L2 + single-flight) under version-scoped
+    keys; serialized and compressed bodies are kept until the dataset changes.
+    """
+
+    def __init__(self, max_entries: int = SNAPSHOT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.version = "unversioned"
+        self._snapshots: "OrderedDict[str, Snapshot]" = OrderedDict()
+
+    async def get_or_build(self, key: str, load: Callable[[sqlite3.Connection], Any],
+                           ttl: int = 3600) -> Snapshot:
+        version = self.version
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            self._snapshots.move_to_end(key)
+            return snapshot
+
+        data = await response_cache.get_or_compute(f"{version}:{key}", lambda: run_db(load), ttl=ttl)
+        return self._remember(key, data, version)
+
+    def _remember(self, key: str, data: Any, version: str) -> Snapshot:
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            snapshot = Snapshot(data, version)
+            if version == self.version:  # Skip storing if the data was reloaded meanwhile
+                self._snapshots[key] = snapshot
+                while len(self._snapshots) > self.max_entries:
+                    self._snapshots.popitem(last=False)
+        return snapshot
+
+    async def rebuild(self):
+        """Recompute the dataset version and prebuild the hot snapshots
+
+        The hot keys are read from Redis with one MGET; the ones missing are
+        loaded from SQLite and written back with one pipelined SETEX.
+        """
+        version = await run_db(dataset_version)
+        self.version = version
+        self._snapshots = OrderedDict()
+
+        hot = [
+            ("colonias:50:0:all", lambda db: load_colonias(db, 50, 0), 1800),
+            ("delegaciones:all", load_delegaciones, 3600),
+            ("stats:general", load_stats, 3600),
+        ]
+        cached = await get_many_from_cache([f"{version}:{key}" for key, _, _ in hot])
+        missing: Dict[str, Tuple[str, int]] = {}
+        for (key, load, ttl), payload in zip(hot, cached):
+            cache_key = f"{version}:{key}"
+            if payload:
+                with timed("serialization"):
+                    data = json.loads(payload)
+            else:
+                data = await run_db(load)
+                with timed("serialization"):
+                    missing[cache_key] = (json.dumps(data), ttl)
+            response_cache.l1.set(cache_key, data, ttl)
+            self._remember(key, data, version)
+        await set_many_to_cache(missing)
+        logger.info("Response snapshots built", version=self.version, entries=len(self._snapshots),
+                    loaded=len(missing))
+
+snapshots = SnapshotStore()
+
+# Recommendations
+class RecommendationService:
+    """Recommendation engine over a zone table loaded once from SQLite
+
+    Scoring is CPU-bound, so it runs on its own small thread pool; results go
+    through response_cache keyed by the dataset version and a hash of the
+    canonical profile, so equivalent profiles share one entry.
+    """
+
+    def __init__(self, max_workers: int = SCORING_WORKERS):
+        self.engine = IntelligentRecommendationEngine()
+        self.zone_table: Optional[ZoneTable] = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scoring")
+
+    def load(self, db_path: Path = DATABASE_PATH) -> ZoneTable:
+        """Build the zone table and its precomputed features"""
+        zone_table = ZoneTable.from_sqlite(db_path)
+        self.engine.feature_store.get(zone_table)
+        self.zone_table = zone_table
+        return zone_table
+
+    def cache_key(self, zone_table: ZoneTable, profile: UserProfile,
+                  num_recommendations: int, diversification: Optional[str]) -> str:
+        canonical = json.dumps(
+            [self.engine.canonical_profile_key(profile), num_recommendations, diversification],
+            default=str
+        )
+        digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+        return f"recommend:{zone_table.data_version}:{digest}"
+
+    def score(self, zone_table: ZoneTable, profile: UserProfile,
+              num_recommendations: int, diversification: Optional[str]) -> List[Dict[str, Any]]:
+        start_time = time.perf_counter()
+        recommendations = self.engine.generate_recommendations(
+            zone_table, profile, num_recommendations=num_recommendations,
+            diversification=diversification
+        )
+        RECOMMENDATION_DURATION.observe(time.perf_counter() - start_time)
+        return [asdict(recommendation) for recommendation in recommendations]
+
+    async def recommend(self, profile: UserProfile, num_recommendations: int = 5,
+                        diversification: Optional[str] = None) -> List[Dict[str, Any]]:
+        zone_table = self.zone_table
+        if zone_table is None:
+            raise HTTPException(status_code=503, detail="Recommendation engine not ready")
+
+        loop = asyncio.get_running_loop()
+        return await response_cache.get_or_compute(
+            self.cache_key(zone_table, profile, num_recommendations, diversification),
+            lambda: loop.run_in_executor(
+                self.executor, self.score, zone_table, profile, num_recommendations, diversification
+            ),
+            ttl=RECOMMEND_CACHE_TTL
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.engine.disable_parallel_scoring()
+
+recommendations = RecommendationService()
+
+# Warm-up and hot reload
+def warm_page_cache(path: Path, chunk_size: int = 1024 * 1024):
+    """Read the database file once so the first queries hit the OS page cache"""
+    with open(path, "rb") as f:
+        while f.read(chunk_size):
+            pass
+
+def prepare_database(conn: sqlite3.Connection):
+    """Indexes every served copy of the database needs"""
+    ensure_spatial_index(conn)
+    ensure_pagination_index(conn)
+    ensure_search_index(conn)
+
+def swap_database(source: Path, target: Path) -> bool:
+    """Atomically replace the contents of target with a staged database
+
+    The staged file is copied to a scratch file, checked and indexed there, then
+    copied into the live file with the online backup API in one write
+    transaction. WAL readers keep their snapshot until their query ends, so no
+    request fails or sees a half-written table. user_version is bumped so other
+    workers notice the new data. Returns False if another worker got there first.
+    A staged file that fails the checks is renamed to *.rejected before raising.
+    """
+    with open(target.with_name(target.name + ".reload.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not source.exists():
+            return False
+
+        scratch_path = target.with_name(target.name + ".staging")
+        scratch_path.unlink(missing_ok=True)
+        staged = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        scratch = sqlite3.connect(str(scratch_path))
+        live = sqlite3.connect(str(target), timeout=30)
+        try:
+            page_size = live.execute("PRAGMA page_size").fetchone()[0]
+            try:
+                staged.backup(scratch)
+                if scratch.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                    raise ValueError(f"{source} failed PRAGMA quick_check")
+                if not scratch.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'colonias'"
+                ).fetchone():
+                    raise ValueError(f"{source} has no colonias table")
+
+                # Backing up into a WAL database requires matching page sizes
+                if scratch.execute("PRAGMA page_size").fetchone()[0] != page_size:
+                    scratch.execute(f"PRAGMA page_size = {page_size}")
+                    scratch.execute("VACUUM")
+
+                prepare_database(scratch)
+            except (sqlite3.Error, ValueError):
+                # The same file would fail again on every watcher pass
+                source.replace(source.with_name(source.name + ".rejected"))
+                raise
+            generation = live.execute("PRAGMA user_version").fetchone()[0] + 1
+            scratch.execute(f"PRAGMA user_version = {generation}")
+            scratch.commit()
+
+            scratch.backup(live)
+            configure_database(live)
+        finally:
+            staged.close()
+            scratch.close()
+            live.close()
+            scratch_path.unlink(missing_ok=True)
+
+        source.replace(source.with_name(source.name + ".loaded"))
+        return True
+
+class DataLifecycle:
+    """Warm-up before readiness and hot reload of casamx.db without a restart
+
+    A reload is triggered by POST /api/admin/reload or by dropping a rebuilt
+    database at RELOAD_SOURCE_PATH (write it elsewhere, then rename it there). The watcher also picks up reloads done by
+    other workers through PRAGMA user_version. Swapped files end up as *.loaded
+    and files that fail validation as *.rejected, so each is tried only once.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.generation: Optional[int] = None
+        self.loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._watcher: Optional["asyncio.Task"] = None
+
+    async def warm_up(self):
+        """Indexes, page cache, pool, snapshots (which also prime Redis) and the zone table"""
+        loop = asyncio.get_running_loop()
+
+        def setup_database():
+            conn = sqlite3.connect(str(DATABASE_PATH))
+            try:
+                configure_database(conn)
+                prepare_database(conn)
+            finally:
+                conn.close()
+            warm_page_cache(DATABASE_PATH)
+            db_pool.warm(DB_POOL_SIZE)
+
+        start_time = time.perf_counter()
+        await loop.run_in_executor(db_executor, setup_database)
+        await self.refresh()
+        self.ready = True
+        logger.info("Warm-up complete", seconds=round(time.perf_counter() - start_time, 3))
+
+    async def refresh(self):
+        """Rebuild everything derived from the database contents"""
+        self.generation = await run_db(lambda db: db.execute("PRAGMA user_version").fetchone()[0])
+        response_cache.clear()
+        await snapshots.rebuild()
+        zone_table = await asyncio.get_running_loop().run_in_executor(
+            recommendations.executor, recommendations.load
+        )
+        self.loaded_at = time.time()
+        logger.info("Dataset loaded", version=snapshots.version, generation=self.generation,
+                    zones=len(zone_table))
+
+    async def reload(self, source: Path = RELOAD_SOURCE_PATH) -> bool:
+        """Swap in the staged database and refresh; False if there was nothing to load"""
+        async with self._lock:
+            swapped = await asyncio.get_running_loop().run_in_executor(
+                db_executor, swap_database, source, DATABASE_PATH
+            )
+            if swapped:
+                await self.refresh()
+            return swapped
+
+    async def watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if RELOAD_SOURCE_PATH.exists():
+                    await self.reload()
+                generation = await run_db(lambda db: db.execute("PRAGMA user_version").fetchone()[0])
+                if generation != self.generation:
+                    async with self._lock:
+                        await self.refresh()
+            except Exception as e:
+                logger.error("Data reload failed", error=str(e))
+
+    def start_watcher(self, interval: float = RELOAD_WATCH_INTERVAL):
+        if interval > 0:
+            self._watcher = asyncio.get_running_loop().create_task(self.watch(interval))
+
+    async def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+data_lifecycle = DataLifecycle()
+
+# Spatial index helpers
+SPATIAL_INDEX_TABLE = "colonias_rtree"
+
+def coordinate_columns(conn: sqlite3.Connection) -> Tuple[str, str]:
+    """Return the (lat, lon) column names of the colonias table"""
+    return "lat", colonias_column(conn, "lon", "lng")
+
+def ensure_spatial_index(conn: sqlite3.Connection) -> int:
+    """Create (or rebuild) the R*Tree over colonias coordinates, kept in sync by triggers"""
+    lat, lon = coordinate_columns(conn)
+    conn.executescript(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SPATIAL_INDEX_TABLE}
+            USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+
+        CREATE TRIGGER IF NOT EXISTS {SPATIAL_INDEX_TABLE}_insert AFTER INSERT ON colonias
+        WHEN NEW.{lat} IS NOT NULL AND NEW.{lon} IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO {SPATIAL_INDEX_TABLE}
+            VALUES (NEW.rowid, NEW.{lat}, NEW.{lat}, NEW.{lon}, NEW.{lon});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {SPATIAL_INDEX_TABLE}_update AFTER UPDATE OF {lat}, {lon} ON colonias
+        BEGIN
+            DELETE FROM {SPATIAL_INDEX_TABLE} WHERE id = OLD.rowid;
+            INSERT INTO {SPATIAL_INDEX_TABLE}
+            SELECT NEW.rowid, NEW.{lat}, NEW.{lat}, NEW.{lon}, NEW.{lon}
+            WHERE NEW.{lat} IS NOT NULL AND NEW.{lon} IS NOT NULL;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {SPATIAL_INDEX_TABLE}_delete AFTER DELETE ON colonias
+        BEGIN
+            DELETE FROM {SPATIAL_INDEX_TABLE} WHERE id = OLD.rowid;
+        END;
+    """)
+
+    # Rebuild when the index drifted (first run or rows loaded before the triggers existed)
+    indexed = conn.execute(f"SELECT COUNT(*) FROM {SPATIAL_INDEX_TABLE}").fetchone()[0]
+    expected = conn.execute(
+        f"SELECT COUNT(*) FROM colonias WHERE {lat} IS NOT NULL AND {lon} IS NOT NULL"
+    ).fetchone()[0]
+    if indexed != expected:
+        with conn:
+            conn.execute(f"DELETE FROM {SPATIAL_INDEX_TABLE}")
+            conn.execute(f"""
+                INSERT INTO {SPATIAL_INDEX_TABLE}
+                SELECT rowid, {lat}, {lat}, {lon}, {lon} FROM colonias
+                WHERE {lat} IS NOT NULL AND {lon} IS NOT NULL
+            """)
+        logger.info("Spatial index rebuilt", rows=expected)
+    return expected
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in km"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+def query_bbox(db: sqlite3.Connection, min_lat: float, min_lon: float,
+               max_lat: float, max_lon: float, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Colonias inside a bounding box, resolved through the R*Tree"""
+    query = f"""
+        SELECT c.* FROM {SPATIAL_INDEX_TABLE} r
+        JOIN colonias c ON c.rowid = r.id
+        WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ?
+    """
+    params: List[Any] = [min_lat, max_lat, min_lon, max_lon]
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    rows = db.execute(query, params).fetchall()
+    DATABASE_QUERIES.inc()
+    return [dict(row) for row in rows]
+
+def ensure_pagination_index(conn: sqlite3.Connection):
+    """Composite (delegacion, id) index so filtered keyset pages are a single range seek"""
+    delegacion_column = colonias_column(conn, "delegacion", "alcaldia")
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_colonias_{delegacion_column}_id "
+        f"ON colonias({delegacion_column}, id)"
+    )
+    conn.commit()
+
+# Search index helpers
+SEARCH_INDEX_TABLE = "colonias_fts"
+# Accent-insensitive word tokenizer; prefix indexes make type-ahead queries index lookups
+SEARCH_TOKENIZER = "unicode61 remove_diacritics 2"
+SEARCH_PREFIX_LENGTHS = "2 3 4"
+SEARCH_NAME_WEIGHT = 10.0  # bm25 weight of nombre vs delegacion
+
+def ensure_search_index(conn: sqlite3.Connection) -> int:
+    """Create (or rebuild) the FTS5 index over colonias, kept in sync by triggers"""
+    delegacion = colonias_column(conn, "delegacion", "alcaldia")
+    conn.executescript(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_INDEX_TABLE} USING fts5(
+            nombre, {delegacion},
+            content='colonias', content_rowid='rowid',
+            tokenize='{SEARCH_TOKENIZER}', prefix='{SEARCH_PREFIX_LENGTHS}'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_insert AFTER INSERT ON colonias BEGIN
+            INSERT INTO {SEARCH_INDEX_TABLE}(rowid, nombre, {delegacion})
+            VALUES (NEW.rowid, NEW.nombre, NEW.{delegacion});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_delete AFTER DELETE ON colonias BEGIN
+            INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, nombre, {delegacion})
+            VALUES ('delete', OLD.rowid, OLD.nombre, OLD.{delegacion});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_update AFTER UPDATE OF nombre, {delegacion} ON colonias BEGIN
+            INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, nombre, {delegacion})
+            VALUES ('delete', OLD.rowid, OLD.nombre, OLD.{delegacion});
+            INSERT INTO {SEARCH_INDEX_TABLE}(rowid, nombre, {delegacion})
+            VALUES (NEW.rowid, NEW.nombre, NEW.{delegacion});
+        END;
+    """)
+
+    # Rebuild when rows were loaded before the triggers existed
+    indexed = conn.execute(f"SELECT COUNT(*) FROM {SEARCH_INDEX_TABLE}_docsize").fetchone()[0]
+    expected = conn.execute("SELECT COUNT(*) FROM colonias").fetchone()[0]
+    if indexed != expected:
+        with conn:
+            conn.execute(f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('rebuild')")
+        logger.info("Search index rebuilt", rows=expected)
+    return expected
+
+def fold_accents(text: str) -> str:
+    """Lowercase and strip diacritics ("Coyoacán" -> "coyoacan")"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def search_match_expression(q: str) -> Optional[str]:
+    """FTS5 MATCH expression: every word of q as a quoted prefix term (AND)"""
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
 # Middleware for metrics
+def route_template(request: Request) -> str:
+    """Path template of the matching route, so metric labels stay bounded"""
+    partial = None
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
 @app.middleware("http")
 async def metrics_middleware(request, call_next):
-    start_time = time.time()
-    
+    start_time = time.perf_counter()
+    route = route_template(request)
+    timings = RequestTimings()
+    token = request_timings.set(timings)
+    in_flight = REQUESTS_IN_FLIGHT.labels(method=request.method)
+    in_flight.inc()
+
     # Process request
-    response = await call_next(request)
-    
+    try:
+        response = await call_next(request)
+    finally:
+        in_flight.dec()
+        request_timings.reset(token)
+
     # Record metrics
-    process_time = time.time() - start_time
-    REQUEST_COUNT.labels(method=request.method, endpoint=request.url.path).inc()
-    REQUEST_DURATION.observe(process_time)
-    
+    process_time = time.perf_counter() - start_time
+    REQUEST_COUNT.labels(method=request.method, route=route).inc()
+    REQUEST_DURATION.labels(method=request.method, route=route).observe(process_time)
+    for phase in RequestTimings.PHASES:
+        phase_time = getattr(timings, phase)
+        if phase_time:
+            REQUEST_PHASE_DURATION.labels(route=route, phase=phase).observe(phase_time)
+
+    if process_time >= SLOW_REQUEST_THRESHOLD and random.random() < SLOW_REQUEST_SAMPLE_RATE:
+        logger.warning(
+            "Slow request",
+            method=request.method, route=route, path=request.url.path,
+            query=request.url.query, status=response.status_code,
+            duration_ms=round(process_time * 1000, 2),
+            **{f"{phase}_ms": round(getattr(timings, phase) * 1000, 2) for phase in RequestTimings.PHASES},
+            statements=timings.statements
+        )
+
     # Add performance headers
     response.headers["X-Process-Time"] = str(process_time)
     
@@ -193,9 +1137,7 @@ async def health_check():
     # Check database
     db_status = "ok"
     try:
-        conn = sqlite3.connect(str(DATABASE_PATH))
-        conn.execute("SELECT 1")
-        conn.close()
+        await run_db(lambda conn: conn.execute("SELECT 1").fetchone())
         DATABASE_QUERIES.inc()
     except Exception as e:
         db_status = f"error: {str(e)}"
@@ -205,7 +1147,7 @@ async def health_check():
     redis_status = "ok"
     if redis_client:
         try:
-            redis_client.ping()
+            await redis_client.ping()
         except Exception as e:
             redis_status = f"error: {str(e)}"
             logger.error("Redis health check failed", error=str(e))
@@ -219,9 +1161,40 @@ async def health_check():
         timestamp=time.strftime('%Y-%m-%d %H:%M:%S'),
         version="1.0.0",
         database=db_status,
-        redis=redis_status
+        redis=redis_status,
+        database_pool=db_pool.stats()
     )
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 only once warm-up has finished"""
+    if not data_lifecycle.ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {
+        "status": "ready",
+        "dataset_version": snapshots.version,
+        "generation": data_lifecycle.generation,
+        "loaded_at": data_lifecycle.loaded_at
+    }
+
+@app.post("/api/admin/reload")
+async def reload_data(request: Request):
+    """Swap in the rebuilt database staged at RELOAD_SOURCE_PATH"""
+    token = request.headers.get("x-admin-token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    try:
+        swapped = await data_lifecycle.reload()
+    except (sqlite3.Error, ValueError) as e:
+        logger.error("Data reload failed", error=str(e))
+        raise HTTPException(status_code=422, detail=f"Reload rejected: {e}")
+    if not swapped:
+        # 409, not 404: the custom 404 handler would turn this into a route-not-found body
+        raise HTTPException(status_code=409, detail=f"No staged database at {RELOAD_SOURCE_PATH}")
+    return {"status": "reloaded", "dataset_version": snapshots.version,
+            "generation": data_lifecycle.generation}
+
 @app.get("/api/")
 async def api_root():
     """API root endpoint"""
@@ -232,141 +1205,321 @@ async def api_root():
         "environment": "production"
     })
 
-@app.get("/api/colonias", response_model=List[ColoniaResponse])
-async def get_colonias(
-    limit: int = 50,
-    offset: int = 0,
-    delegacion: str = None,
-    db=Depends(get_db)
-):
-    """Get colonias with optional filtering"""
-    
-    # Try cache first
-    cache_key = f"colonias:{limit}:{offset}:{delegacion or 'all'}"
-    cached_data = get_from_cache(cache_key)
-    
-    if cached_data:
-        import json
-        return json.loads(cached_data)
-    
+# Data loaders (run on the database thread pool)
+def colonia_record(row: sqlite3.Row, delegacion_column: str, cp_column: str,
+                   lon_column: str) -> Dict[str, Any]:
+    """Convert a colonias row to the ColoniaResponse shape"""
+    row = dict(row)
+    return ColoniaResponse(
+        id=row.get('id', 0),
+        nombre=row.get('nombre', ''),
+        delegacion=row.get(delegacion_column) or '',
+        cp=row.get(cp_column) or '',
+        lat=row.get('lat'),
+        lng=row.get(lon_column)
+    ).dict()
+
+def load_colonias_by_ids(db: sqlite3.Connection, ids: List[Union[int, str]]) -> Dict[str, Dict[str, Any]]:
+    """Resolve many colonia ids with a single IN query, keyed by str(id)"""
+    delegacion_column = colonias_column(db, "delegacion", "alcaldia")
+    cp_column = colonias_column(db, "cp", "codigo_postal")
+    _, lon_column = coordinate_columns(db)
+
+    unique_ids = list(dict.fromkeys(ids))
+    placeholders = ", ".join("?" * len(unique_ids))
+    rows = db.execute(f"SELECT * FROM colonias WHERE id IN ({placeholders})", unique_ids).fetchall()
+    DATABASE_QUERIES.inc()
+    return {str(row["id"]): colonia_record(row, delegacion_column, cp_column, lon_column) for row in rows}
+
+def load_colonias(db: sqlite3.Connection, limit: int, offset: int,
+                  delegacion: Optional[str] = None,
+                  after_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """One page of colonias; with after_id it is a keyset page ordered by id"""
     try:
-        cursor = db.cursor()
-        
+        delegacion_column = colonias_column(db, "delegacion", "alcaldia")
+        cp_column = colonias_column(db, "cp", "codigo_postal")
+        _, lon_column = coordinate_columns(db)
+
         # Build query
         query = "SELECT * FROM colonias"
-        params = []
-        
+        conditions: List[str] = []
+        params: List[Any] = []
+
         if delegacion:
-            query += " WHERE delegacion = ?"
+            conditions.append(f"{delegacion_column} = ?")
             params.append(delegacion)
-        
-        query += " LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
+
+        if after_id is not None:
+            # Keyset: seek past the last id of the previous page ("" = first page)
+            if after_id:
+                conditions.append("id > ?")
+                params.append(after_id)
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY id LIMIT ?"
+            params.append(limit)
+        else:
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+
+        rows = db.execute(query, params).fetchall()
+
         DATABASE_QUERIES.inc()
-        
-        # Convert to response model
-        colonias = []
-        for row in rows:
-            colonia = ColoniaResponse(
-                id=row.get('id', 0),
-                nombre=row.get('nombre', ''),
-                delegacion=row.get('delegacion', ''),
-                cp=row.get('cp', ''),
-                lat=row.get('lat'),
-                lng=row.get('lng')
-            )
-            colonias.append(colonia)
-        
-        # Cache result
-        import json
-        cache_data = json.dumps([c.dict() for c in colonias])
-        set_to_cache(cache_key, cache_data, ttl=1800)  # 30 minutes
-        
+
+        colonias = [colonia_record(row, delegacion_column, cp_column, lon_column) for row in rows]
         logger.info("Colonias fetched", count=len(colonias), delegacion=delegacion)
-        
         return colonias
-        
+
     except Exception as e:
         logger.error("Database query failed", error=str(e))
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-@app.get("/api/delegaciones")
-async def get_delegaciones(db=Depends(get_db)):
-    """Get list of available delegaciones"""
-    
-    cache_key = "delegaciones:all"
-    cached_data = get_from_cache(cache_key)
-    
-    if cached_data:
-        import json
-        return json.loads(cached_data)
-    
+def load_delegaciones(db: sqlite3.Connection) -> Dict[str, Any]:
     try:
-        cursor = db.cursor()
-        cursor.execute("SELECT DISTINCT delegacion FROM colonias ORDER BY delegacion")
-        rows = cursor.fetchall()
-        
+        delegacion_column = colonias_column(db, "delegacion", "alcaldia")
+        rows = db.execute(
+            f"SELECT DISTINCT {delegacion_column} FROM colonias ORDER BY {delegacion_column}"
+        ).fetchall()
+
         DATABASE_QUERIES.inc()
-        
+
         delegaciones = [row[0] for row in rows if row[0]]
-        
-        # Cache result
-        import json
-        cache_data = json.dumps({"delegaciones": delegaciones})
-        set_to_cache(cache_key, cache_data, ttl=3600)  # 1 hour
-        
         return {"delegaciones": delegaciones}
-        
+
     except Exception as e:
         logger.error("Database query failed", error=str(e))
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-@app.get("/api/stats")
-async def get_stats(db=Depends(get_db)):
-    """Get basic statistics"""
-    
-    cache_key = "stats:general"
-    cached_data = get_from_cache(cache_key)
-    
-    if cached_data:
-        import json
-        return json.loads(cached_data)
-    
+def load_stats(db: sqlite3.Connection) -> Dict[str, Any]:
     try:
-        cursor = db.cursor()
-        
+        delegacion_column = colonias_column(db, "delegacion", "alcaldia")
+
         # Get total colonias
-        cursor.execute("SELECT COUNT(*) FROM colonias")
-        total_colonias = cursor.fetchone()[0]
-        
+        total_colonias = db.execute("SELECT COUNT(*) FROM colonias").fetchone()[0]
+
         # Get delegaciones count
-        cursor.execute("SELECT COUNT(DISTINCT delegacion) FROM colonias")
-        total_delegaciones = cursor.fetchone()[0]
-        
+        total_delegaciones = db.execute(
+            f"SELECT COUNT(DISTINCT {delegacion_column}) FROM colonias"
+        ).fetchone()[0]
+
         DATABASE_QUERIES.inc(2)
-        
-        stats = {
+
+        return {
             "total_colonias": total_colonias,
             "total_delegaciones": total_delegaciones,
             "api_version": "1.0.0",
             "status": "active"
         }
-        
-        # Cache result
-        import json
-        cache_data = json.dumps(stats)
-        set_to_cache(cache_key, cache_data, ttl=3600)  # 1 hour
-        
-        return stats
-        
+
     except Exception as e:
         logger.error("Stats query failed", error=str(e))
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+# Snapshot-backed endpoints (ETag / 304 and pre-compressed bodies)
+@app.get("/api/colonias", response_model=List[ColoniaResponse])
+async def get_colonias(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    delegacion: str = None,
+    after_id: Optional[str] = None
+):
+    """Get colonias with optional filtering
+
+    Pass after_id (empty for the first page, then the X-Next-Cursor value) for
+    keyset pagination ordered by id; limit/offset is kept for existing clients.
+    """
+    if after_id is None:
+        cache_key = f"colonias:{limit}:{offset}:{delegacion or 'all'}"
+    else:
+        cache_key = f"colonias:keyset:{limit}:{after_id}:{delegacion or 'all'}"
+    snapshot = await snapshots.get_or_build(
+        cache_key, lambda db: load_colonias(db, limit, offset, delegacion, after_id), ttl=1800  # 30 minutes
+    )
+
+    headers = {}
+    if after_id is not None and len(snapshot.data) == limit:
+        next_cursor = str(snapshot.data[-1]["id"])
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(after_id=next_cursor)}>; rel="next"'
+    return snapshot.response(request, headers)
+
+@app.post("/api/colonias/batch", response_model=ColoniaBatchResponse)
+async def get_colonias_batch(batch: ColoniaBatchRequest):
+    """Look up several colonias in one round trip; results follow the request order"""
+    found = await run_db(lambda db: load_colonias_by_ids(db, batch.ids))
+    return {
+        "colonias": [found[str(colonia_id)] for colonia_id in batch.ids if str(colonia_id) in found],
+        "missing": [colonia_id for colonia_id in batch.ids if str(colonia_id) not in found]
+    }
+
+@app.get("/api/colonias/export")
+async def export_colonias(format: str = "ndjson"):
+    """Stream the whole colonias table as NDJSON or CSV straight from the SQLite cursor"""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    if not DATABASE_PATH.exists():
+        raise HTTPException(status_code=500, detail="Database not found")
+
+    try:
+        conn = await asyncio.get_running_loop().run_in_executor(db_executor, db_pool.acquire)
+    except PoolTimeout as e:
+        logger.error("Database pool exhausted", error=str(e))
+        raise HTTPException(status_code=503, detail="Database busy")
+
+    release_lock = threading.Lock()
+    released = False
+
+    def release():
+        """Return the connection once, from whichever path finishes first"""
+        nonlocal released
+        with release_lock:
+            if released:
+                return
+            released = True
+        db_pool.release(conn)
+
+    def rows() -> Iterator[str]:
+        # Runs in Starlette's thread pool; memory is bounded by EXPORT_BATCH_SIZE
+        try:
+            cursor = conn.execute("SELECT * FROM colonias ORDER BY id")
+            DATABASE_QUERIES.inc()
+            columns = [description[0] for description in cursor.description]
+
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                yield buffer.getvalue()
+
+            while True:
+                batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                if format == "csv":
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(tuple(row) for row in batch)
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch
+                    )
+        finally:
+            release()
+
+    stream = rows()
+
+    def finish():
+        # Runs after the response even if the client left before the first chunk,
+        # when the generator never started and its finally cannot run
+        try:
+            stream.close()
+        except ValueError:
+            pass  # Still inside next() on a worker thread
+        release()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="colonias.{format}"'},
+        background=BackgroundTask(finish)
+    )
+
+@app.get("/api/delegaciones")
+async def get_delegaciones(request: Request):
+    """Get list of available delegaciones"""
+    snapshot = await snapshots.get_or_build("delegaciones:all", load_delegaciones, ttl=3600)  # 1 hour
+    return snapshot.response(request)
+
+@app.get("/api/stats")
+async def get_stats(request: Request):
+    """Get basic statistics"""
+    snapshot = await snapshots.get_or_build("stats:general", load_stats, ttl=3600)  # 1 hour
+    return snapshot.response(request)
+
+@app.get("/api/colonias/cercanas")
+async def get_colonias_cercanas(
+    lat: float,
+    lng: float,
+    radio_km: float = 2.0,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Colonias within radio_km of a point, nearest first"""
+    if not (0 < radio_km <= 50):
+        raise HTTPException(status_code=400, detail="radio_km must be between 0 and 50")
+
+    def query(db: sqlite3.Connection):
+        # R*Tree prefilter on the circle's bounding box, exact haversine afterwards
+        delta_lat = radio_km / 110.57
+        delta_lon = radio_km / (111.32 * max(math.cos(math.radians(lat)), 1e-6))
+        candidates = query_bbox(db, lat - delta_lat, lng - delta_lon, lat + delta_lat, lng + delta_lon)
+        return candidates, coordinate_columns(db)[1]
+
+    try:
+        candidates, lon_column = await run_db(query)
+        results = []
+        for colonia in candidates:
+            distance = haversine_km(lat, lng, colonia['lat'], colonia[lon_column])
+            if distance <= radio_km:
+                colonia['distancia_km'] = round(distance, 3)
+                results.append(colonia)
+        results.sort(key=lambda colonia: colonia['distancia_km'])
+
+        return {
+            "centro": {"lat": lat, "lng": lng},
+            "radio_km": radio_km,
+            "results": results[:limit],
+            "total": len(results)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Radius query failed", error=str(e))
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@app.get("/api/colonias/viewport")
+async def get_colonias_viewport(
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+    limit: int = Query(500, ge=1, le=2000)
+):
+    """Colonias inside a map viewport"""
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+
+    try:
+        results = await run_db(lambda db: query_bbox(db, min_lat, min_lng, max_lat, max_lng, limit=limit))
+        return {"results": results, "total": len(results)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Viewport query failed", error=str(e))
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@app.post("/api/recommend")
+async def recommend(
+    profile: UserProfileRequest,
+    limit: int = Query(5, ge=1, le=50),
+    diversificacion: Optional[str] = None
+):
+    """Personalized zone recommendations for a user profile"""
+    if diversificacion is not None and diversificacion not in DIVERSIFICATION_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"diversificacion must be one of: {', '.join(DIVERSIFICATION_PRESETS)}"
+        )
+
+    result = await recommendations.recommend(
+        UserProfile(**profile.model_dump()), num_recommendations=limit, diversification=diversificacion
+    )
+    return {"recomendaciones": result}
+
 @app.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
@@ -375,65 +1528,65 @@ async def metrics():
 @app.get("/api/search")
 async def search_colonias(
     q: str,
-    limit: int = 20,
-    db=Depends(get_db)
+    limit: int = Query(20, ge=1, le=100)
 ):
     """Search colonias by name"""
     
     if not q or len(q) < 2:
         raise HTTPException(status_code=400, detail="Query must be at least 2 characters")
     
-    cache_key = f"search:{q}:{limit}"
-    cached_data = get_from_cache(cache_key)
-    
-    if cached_data:
-        import json
-        return json.loads(cached_data)
-    
-    try:
-        cursor = db.cursor()
-        
-        # Search in nombre and delegacion
-        query = """
-        SELECT * FROM colonias 
-        WHERE nombre LIKE ? OR delegacion LIKE ?
-        LIMIT ?
-        """
-        search_term = f"%{q}%"
-        cursor.execute(query, [search_term, search_term, limit])
-        rows = cursor.fetchall()
-        
-        DATABASE_QUERIES.inc()
-        
-        results = []
-        for row in rows:
-            result = {
-                "id": row.get('id', 0),
-                "nombre": row.get('nombre', ''),
-                "delegacion": row.get('delegacion', ''),
-                "cp": row.get('cp', ''),
-                "match_type": "nombre" if q.lower() in row.get('nombre', '').lower() else "delegacion"
+    cache_key = f"{snapshots.version}:search:{q}:{limit}"
+
+    match_expression = search_match_expression(q)
+    if match_expression is None:
+        raise HTTPException(status_code=400, detail="Query must contain letters or digits")
+
+    def load(db: sqlite3.Connection):
+        try:
+            delegacion = colonias_column(db, "delegacion", "alcaldia")
+            cp = colonias_column(db, "cp", "codigo_postal")
+
+            # Ranked prefix search on the FTS5 index (nombre weighs more than delegacion)
+            query = f"""
+            SELECT c.*, bm25({SEARCH_INDEX_TABLE}, ?, 1.0) AS rank
+            FROM {SEARCH_INDEX_TABLE}
+            JOIN colonias c ON c.rowid = {SEARCH_INDEX_TABLE}.rowid
+            WHERE {SEARCH_INDEX_TABLE} MATCH ?
+            ORDER BY rank
+            LIMIT ?
+            """
+            rows = db.execute(query, [SEARCH_NAME_WEIGHT, match_expression, limit]).fetchall()
+
+            DATABASE_QUERIES.inc()
+
+            folded_terms = [fold_accents(term) for term in re.findall(r"\w+", q)]
+            results = []
+            for row in rows:
+                row = dict(row)
+                nombre = fold_accents(row.get('nombre', ''))
+                result = {
+                    "id": row.get('id', 0),
+                    "nombre": row.get('nombre', ''),
+                    "delegacion": row.get(delegacion, ''),
+                    "cp": row.get(cp, ''),
+                    "match_type": "nombre" if any(term in nombre for term in folded_terms) else "delegacion",
+                    "score": round(-row['rank'], 4)
+                }
+                results.append(result)
+
+            logger.info("Search performed", query=q, results=len(results))
+
+            return {
+                "query": q,
+                "results": results,
+                "total": len(results)
             }
-            results.append(result)
-        
-        response_data = {
-            "query": q,
-            "results": results,
-            "total": len(results)
-        }
-        
-        # Cache result
-        import json
-        cache_data = json.dumps(response_data)
-        set_to_cache(cache_key, cache_data, ttl=1800)  # 30 minutes
-        
-        logger.info("Search performed", query=q, results=len(results))
-        
-        return response_data
-        
-    except Exception as e:
-        logger.error("Search query failed", query=q, error=str(e))
-        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+        except Exception as e:
+            logger.error("Search query failed", query=q, error=str(e))
+            raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+    return await response_cache.get_or_compute(cache_key, lambda: run_db(load), ttl=1800)  # 30 minutes
 
 # Error handlers
 @app.exception_handler(404)
@@ -461,26 +1614,42 @@ async def internal_error_handler(request, exc):
 # Startup event
 @app.on_event("startup")
 async def startup_event():
+    global redis_client
     logger.info("CasaMX API starting up", version="1.0.0", debug=DEBUG)
     
+    # Test Redis connection; without it the caches run L1-only
+    if redis_client:
+        try:
+            await redis_client.ping()
+            logger.info("Redis connection verified")
+        except Exception as e:
+            logger.error("Redis connection failed", error=str(e))
+            await redis_client.close()
+            redis_client = None
+
     # Verify database exists
     if not DATABASE_PATH.exists():
         logger.error("Database file not found", path=str(DATABASE_PATH))
     else:
         logger.info("Database found", path=str(DATABASE_PATH))
-    
-    # Test Redis connection
-    if redis_client:
+
+        # /ready stays 503 unless warm-up finishes
         try:
-            redis_client.ping()
-            logger.info("Redis connection verified")
+            await data_lifecycle.warm_up()
         except Exception as e:
-            logger.error("Redis connection failed", error=str(e))
+            logger.error("Warm-up failed", error=str(e))
+        data_lifecycle.start_watcher()
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("CasaMX API shutting down")
+    await data_lifecycle.stop_watcher()
+    if redis_client:
+        await redis_client.close()
+    db_executor.shutdown(wait=False)
+    recommendations.close()
+    db_pool.close()
 
 if __name__ == "__main__":
     import uvicorn
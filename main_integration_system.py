@@ -49,7 +49,9 @@ class MasterINEGISystem:
         # Sistema de persistencia enterprise
         self.persistence_manager = SessionPersistenceManager(
             persistence_level=PersistenceLevel.ENTERPRISE,
-            checkpoint_interval=self.config['checkpoint_interval']
+            checkpoint_interval=self.config['checkpoint_interval'],
+            delta_checkpoints=self.config.get('delta_checkpoints', False),
+            full_snapshot_every=self.config.get('full_snapshot_every', 20)
         )
         
         # Sistema de monitoreo comprehensivo
@@ -71,6 +73,8 @@ class MasterINEGISystem:
             'context_limit': 950000,  # 95% del límite de 1M tokens
             'delegation_threshold': 0.85,
             'checkpoint_interval': 300,  # 5 minutos
+            'delta_checkpoints': True,  # Checkpoints como diferencias contra el anterior
+            'full_snapshot_every': 20,
             'max_concurrent_agents': 12,
             'min_concurrent_agents': 3,
             'monitoring_enabled': True,
@@ -10,7 +10,6 @@ Sistema Multi-Sesión con Context Window Management
 import asyncio
 import json
 import pickle
-import sqlite3
 import time
 import uuid
 import hashlib
@@ -22,6 +21,8 @@ from pathlib import Path
 import threading
 import logging
 
+from sqlite_schema import connect_database, migrate_database
+
 class SessionStatus(Enum):
     ACTIVE = "active"
     DELEGATED = "delegated" 
@@ -73,9 +74,10 @@ class StateManager:
         self.lock = threading.RLock()
     
     def init_database(self):
-        """Inicializa base de datos SQLite para persistencia"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
+        """Inicializa base de datos SQLite para persistencia (WAL + migraciones)"""
+        migrate_database(self.db_path, [
+            [
+                '''
                 CREATE TABLE IF NOT EXISTS global_objectives (
                     id TEXT PRIMARY KEY,
                     name TEXT NOT NULL,
@@ -89,9 +91,8 @@ class StateManager:
                     progress REAL DEFAULT 0.0,
                     sub_objectives TEXT
                 )
-            ''')
-            
-            conn.execute('''
+                ''',
+                '''
                 CREATE TABLE IF NOT EXISTS session_contexts (
                     session_id TEXT PRIMARY KEY,
                     orchestrator_id TEXT,
@@ -106,9 +107,8 @@ class StateManager:
                     accumulated_results TEXT,
                     checkpoint_data TEXT
                 )
-            ''')
-            
-            conn.execute('''
+                ''',
+                '''
                 CREATE TABLE IF NOT EXISTS session_results (
                     id TEXT PRIMARY KEY,
                     session_id TEXT,
@@ -118,9 +118,8 @@ class StateManager:
                     created_at TEXT,
                     FOREIGN KEY (session_id) REFERENCES session_contexts(session_id)
                 )
-            ''')
-            
-            conn.execute('''
+                ''',
+                '''
                 CREATE TABLE IF NOT EXISTS orchestrator_genealogy (
                     id TEXT PRIMARY KEY,
                     parent_orchestrator TEXT,
@@ -129,11 +128,22 @@ class StateManager:
                     delegation_time TEXT,
                     context_transfer_data TEXT
                 )
-            ''')
+                '''
+            ],
+            [
+                'CREATE INDEX IF NOT EXISTS idx_objectives_status ON global_objectives (status, priority)',
+                'CREATE INDEX IF NOT EXISTS idx_contexts_parent ON session_contexts (parent_session)',
+                'CREATE INDEX IF NOT EXISTS idx_contexts_orchestrator ON session_contexts (orchestrator_id, start_time)',
+                'CREATE INDEX IF NOT EXISTS idx_results_session ON session_results (session_id, created_at)',
+                'CREATE INDEX IF NOT EXISTS idx_results_objective ON session_results (objective_id, created_at)',
+                'CREATE INDEX IF NOT EXISTS idx_genealogy_parent ON orchestrator_genealogy (parent_orchestrator, delegation_time)',
+                'CREATE INDEX IF NOT EXISTS idx_genealogy_child ON orchestrator_genealogy (child_orchestrator)'
+            ]
+        ])
     
     def save_global_objective(self, objective: GlobalObjective):
         """Guarda objetivo global"""
-        with self.lock, sqlite3.connect(self.db_path) as conn:
+        with self.lock, connect_database(self.db_path) as conn:
             conn.execute('''
                 INSERT OR REPLACE INTO global_objectives 
                 (id, name, description, priority, target_metrics, completion_criteria, 
@@ -148,7 +158,7 @@ class StateManager:
     
     def load_global_objectives(self) -> List[GlobalObjective]:
         """Carga todos los objetivos globales activos"""
-        with sqlite3.connect(self.db_path) as conn:
+        with connect_database(self.db_path) as conn:
             cursor = conn.execute('SELECT * FROM global_objectives WHERE status = "active"')
             objectives = []
             for row in cursor.fetchall():
@@ -162,7 +172,7 @@ class StateManager:
     
     def save_session_context(self, context: SessionContext):
         """Guarda contexto de sesión"""
-        with self.lock, sqlite3.connect(self.db_path) as conn:
+        with self.lock, connect_database(self.db_path) as conn:
             conn.execute('''
                 INSERT OR REPLACE INTO session_contexts
                 (session_id, orchestrator_id, level, parent_session, global_objectives,
@@ -180,7 +190,7 @@ class StateManager:
     
     def load_session_context(self, session_id: str) -> Optional[SessionContext]:
         """Carga contexto de sesión específica"""
-        with sqlite3.connect(self.db_path) as conn:
+        with connect_database(self.db_path) as conn:
             cursor = conn.execute('SELECT * FROM session_contexts WHERE session_id = ?', (session_id,))
             row = cursor.fetchone()
             if row:
@@ -197,7 +207,7 @@ class StateManager:
     def save_session_result(self, session_id: str, objective_id: str, 
                            result_type: str, result_data: Dict[str, Any]):
         """Guarda resultado de sesión"""
-        with self.lock, sqlite3.connect(self.db_path) as conn:
+        with self.lock, connect_database(self.db_path) as conn:
             result_id = str(uuid.uuid4())
             conn.execute('''
                 INSERT INTO session_results
@@ -211,7 +221,7 @@ class StateManager:
     def record_delegation(self, parent_id: str, child_id: str, 
                          reason: str, transfer_data: Dict[str, Any]):
         """Registra delegación entre orquestadores"""
-        with self.lock, sqlite3.connect(self.db_path) as conn:
+        with self.lock, connect_database(self.db_path) as conn:
             delegation_id = str(uuid.uuid4())
             conn.execute('''
                 INSERT INTO orchestrator_genealogy
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+SCORING PARALELO - DATATÓN ITAM 2025
+Scoring y selección top-k por tandas de perfiles en un ProcessPoolExecutor con memoria compartida
+
+David Fernando Ávila Díaz - ITAM
+"""
+
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Any, Deque, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Por debajo de este número de zonas el scoring se queda en el proceso
+PARALLEL_MIN_ZONES = 20000
+# Tamaño máximo de una tanda de matrices por categoría publicada en memoria compartida
+MAX_BLOCK_BYTES = 64 * 1024 * 1024
+# Tareas por worker en cada tanda (reparte mejor perfiles con costos desiguales)
+TASKS_PER_WORKER = 2
+# Tandas enviadas y sin recoger: con 2, el proceso principal prepara una mientras
+# los workers procesan la anterior
+MAX_BLOCKS_IN_FLIGHT = 2
+
+ArraySpec = Tuple[str, Tuple[int, ...], str]
+
+def attach_array(spec: ArraySpec) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Abre un array publicado en memoria compartida (sin copiarlo)"""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def create_shared_array(shape: Tuple[int, ...], dtype: str = '<f8',
+                        source: Optional[np.ndarray] = None
+                        ) -> Tuple[shared_memory.SharedMemory, ArraySpec]:
+    """Reserva un bloque de memoria compartida para un array (opcionalmente copiando source)"""
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    if source is not None:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = source
+    return shm, (shm.name, tuple(shape), dtype)
+
+def select_block(block_spec: ArraySpec, codes_spec: ArraySpec, coords_spec: Optional[ArraySpec],
+                 groups: np.ndarray, weights: np.ndarray, num_recommendations: int,
+                 config: Any) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Scores y top-k diversificado de varios perfiles de una tanda
+
+    block es (grupos × categorías × zonas); groups indica la matriz de cada
+    perfil y config es su DiversificationConfig. Devuelve, por perfil,
+    (índices, rankings, scores de esos índices).
+    """
+    from recommendation_engine import MMRDiversifier, select_diversified_indices
+
+    diversifier = MMRDiversifier(config)
+    block_shm, block = attach_array(block_spec)
+    codes_shm, alcaldia_codes = attach_array(codes_spec)
+    coords_shm, coords = attach_array(coords_spec) if coords_spec is not None else (None, None)
+    try:
+        results = []
+        for group, profile_weights in zip(groups.tolist(), weights):
+            columns = block[group]
+            # Misma suma secuencial por categoría que combine_category_scores
+            total_scores = np.zeros(columns.shape[1])
+            for column in range(columns.shape[0]):
+                total_scores = total_scores + columns[column] * profile_weights[column]
+
+            selected, rankings = select_diversified_indices(
+                total_scores, alcaldia_codes, num_recommendations, diversifier,
+                category_matrix=columns.T, coords=coords
+            )
+            results.append((selected, rankings, total_scores[selected]))
+        return results
+    finally:
+        # Las vistas deben soltarse antes de cerrar los bloques
+        block = alcaldia_codes = coords = columns = None
+        for shm in (block_shm, codes_shm, coords_shm):
+            if shm is not None:
+                shm.close()
+
+@dataclass
+class PendingBlock:
+    """Tanda enviada a los workers y pendiente de recoger"""
+    shm: Optional[shared_memory.SharedMemory]
+    first_group: int
+    matrices: List[np.ndarray]
+    futures: List[Tuple[np.ndarray, Future]] = field(default_factory=list)
+
+class ParallelScorer:
+    """Backend opcional de scoring en procesos para tablas de decenas de miles de zonas
+
+    Las matrices por categoría de varios grupos de perfiles se publican juntas
+    en un bloque de memoria compartida; cada tarea calcula los scores de varios
+    perfiles y hace su selección completa (top-k y diversificación), así que al
+    proceso principal solo vuelven los índices elegidos.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, min_zones: int = PARALLEL_MIN_ZONES,
+                 max_block_bytes: int = MAX_BLOCK_BYTES):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_zones = min_zones
+        self.max_block_bytes = max_block_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def should_parallelize(self, num_zones: int) -> bool:
+        """Solo conviene paralelizar con varios workers y tablas grandes"""
+        return self.max_workers > 1 and num_zones >= self.min_zones
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def select_profiles(self, contexts: Iterable[Tuple[np.ndarray, np.ndarray]],
+                        alcaldia_codes: np.ndarray, num_recommendations: int, config: Any,
+                        coords: Optional[np.ndarray] = None
+                        ) -> Iterator[Tuple[int, int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Recorre los perfiles: (grupo, posición en el grupo, matriz por categoría,
+        índices, rankings, scores de los índices)
+
+        contexts da, por grupo, los pesos apilados de sus perfiles y su matriz
+        zonas × categorías; se consume a medida que hay lugar para otra tanda, de
+        modo que las matrices se calculan mientras los workers trabajan.
+        """
+        shared = [create_shared_array(alcaldia_codes.shape, '<i8', alcaldia_codes)]
+        if coords is not None:
+            shared.append(create_shared_array(coords.shape, source=coords))
+        codes_spec = shared[0][1]
+        coords_spec = shared[1][1] if coords is not None else None
+
+        pending: Deque[PendingBlock] = deque()
+        try:
+            first_group = 0
+            for block_contexts in self.blocks(contexts):
+                pending.append(self.submit_block(
+                    block_contexts, first_group, codes_spec, coords_spec, num_recommendations, config
+                ))
+                first_group += len(block_contexts)
+                if len(pending) >= MAX_BLOCKS_IN_FLIGHT:
+                    yield from self.collect_block(pending.popleft())
+            while pending:
+                yield from self.collect_block(pending.popleft())
+        finally:
+            for block in pending:
+                self.release_block(block)
+            for shm, _ in shared:
+                shm.close()
+                shm.unlink()
+
+    def blocks(self, contexts: Iterable[Tuple[np.ndarray, np.ndarray]]
+               ) -> Iterator[List[Tuple[np.ndarray, np.ndarray]]]:
+        """Agrupa contextos en tandas de hasta max_block_bytes (al menos uno por tanda)"""
+        block: List[Tuple[np.ndarray, np.ndarray]] = []
+        block_bytes = 0
+        for weights, category_matrix in contexts:
+            if block and block_bytes + category_matrix.nbytes > self.max_block_bytes:
+                yield block
+                block, block_bytes = [], 0
+            block.append((weights, category_matrix))
+            block_bytes += category_matrix.nbytes
+        if block:
+            yield block
+
+    def submit_block(self, block_contexts: List[Tuple[np.ndarray, np.ndarray]], first_group: int,
+                     codes_spec: ArraySpec, coords_spec: Optional[ArraySpec],
+                     num_recommendations: int, config: Any) -> PendingBlock:
+        """Publica una tanda y reparte sus perfiles en pocas tareas"""
+        matrices = [category_matrix for _, category_matrix in block_contexts]
+        num_zones, num_categories = matrices[0].shape
+        shm, block_spec = create_shared_array((len(matrices), num_categories, num_zones))
+        pending = PendingBlock(shm, first_group, matrices)
+        try:
+            block = np.ndarray(block_spec[1], dtype=block_spec[2], buffer=shm.buf)
+            for group, category_matrix in enumerate(matrices):
+                # Categorías en filas contiguas para la suma por columna
+                block[group] = category_matrix.T
+            del block
+
+            groups = np.concatenate([
+                np.full(len(weights), group, dtype=np.intp)
+                for group, (weights, _) in enumerate(block_contexts)
+            ])
+            weights = np.concatenate([weights for weights, _ in block_contexts]).astype(float)
+            num_tasks = min(len(groups), self.max_workers * TASKS_PER_WORKER)
+            for task_groups, task_weights in zip(np.array_split(groups, num_tasks),
+                                                 np.array_split(weights, num_tasks)):
+                future = self.executor.submit(select_block, block_spec, codes_spec, coords_spec,
+                                              task_groups, task_weights, num_recommendations, config)
+                pending.futures.append((task_groups, future))
+        except BaseException:
+            self.release_block(pending)
+            raise
+        return pending
+
+    def collect_block(self, pending: PendingBlock) -> Iterator[Tuple]:
+        """Entrega los resultados de una tanda en orden y libera su bloque"""
+        try:
+            positions = [0] * len(pending.matrices)
+            for task_groups, future in pending.futures:
+                for group, (selected, rankings, scores) in zip(task_groups.tolist(), future.result()):
+                    yield (pending.first_group + group, positions[group], pending.matrices[group],
+                           selected, rankings, scores)
+                    positions[group] += 1
+        finally:
+            self.release_block(pending)
+
+    def release_block(self, pending: PendingBlock):
+        """Cancela las tareas pendientes de una tanda y libera su bloque compartido"""
+        for _, future in pending.futures:
+            future.cancel()
+        # Las tareas ya en curso deben terminar antes de liberar su memoria
+        for _, future in pending.futures:
+            if not future.cancelled():
+                try:
+                    future.exception()
+                except Exception:
+                    pass
+        if pending.shm is not None:
+            pending.shm.close()
+            pending.shm.unlink()
+            pending.shm = None
+
+    def close(self):
+        """Termina los procesos worker"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> 'ParallelScorer':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
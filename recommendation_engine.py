@@ -6,11 +6,32 @@ Algoritmo avanzado de scoring personalizado para zonas CDMX
 David Fernando Ávila Díaz - ITAM
 """
 
+import csv
+import hashlib
 import json
 import math
-from typing import Dict, List, Any, Optional, Tuple
-from dataclasses import dataclass
+import os
+import sqlite3
+import threading
+import time
+import copy
+from collections import OrderedDict
+from contextlib import closing
+from typing import Dict, List, Any, Optional, Tuple, Union
+from dataclasses import dataclass, field, astuple
 from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from commute_model import CommuteModel, haversine_km, load_default_hubs
+from parallel_scoring import PARALLEL_MIN_ZONES, ParallelScorer
+from spatial_index import GridIndex
+
+# Orden canónico de las categorías de score (columnas de la matriz de scores)
+SCORE_CATEGORIES = (
+    'seguridad', 'transporte', 'precio', 'amenidades', 'calidad_vida', 'compatibilidad_estilo'
+)
 
 @dataclass
 class UserProfile:
@@ -37,6 +58,8 @@ class UserProfile:
     acepta_ruido_trafico: bool = False
     tiempo_max_trabajo_min: int = 45
     ubicacion_trabajo: str = "Centro"  # Centro, Polanco, Santa Fe, etc.
+    trabajo_lat: Optional[float] = None  # Lugar de trabajo arbitrario (opcional)
+    trabajo_lon: Optional[float] = None
     
     # Estilo de vida
     estilo_vida: str = "familiar"  # familiar, joven_profesional, retirado, estudiante
@@ -73,6 +96,413 @@ class ZoneRecommendation:
     
     # Datos adicionales para mostrar
     datos_destacados: Dict[str, Any]
+    
+    # Entradas de la diversificación (última categoría de score y coordenadas)
+    score_compatibilidad_estilo: float = 50.0
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+
+class ZoneTable:
+    """Tabla columnar de zonas: un array NumPy por atributo, construido una sola vez"""
+
+    # Columnas de la tabla SQLite `colonias` → (campo del motor, factor de escala)
+    SQLITE_FIELD_MAPPING = {
+        'nombre': ('colonia', None),
+        'alcaldia': ('alcaldia', None),
+        'lat': ('lat', 1),
+        'lon': ('lon', 1),
+        'score_seguridad': ('indice_seguridad', 10),  # 0-10 → 0-100
+        'score_transporte': ('score_conectividad', 10),
+        'score_amenidades': ('score_amenidades', 10),
+        'renta_m2': ('precio_m2_renta_pesos', 1),
+        'venta_m2': ('precio_m2_venta_pesos', 1),
+        'densidad_poblacional': ('densidad_poblacional', 1)
+    }
+
+    def __init__(self, records: List[Dict[str, Any]], data_version: Optional[str] = None):
+        # Los registros originales se conservan para generar explicaciones
+        self.records = list(records)
+        self.size = len(self.records)
+        self._data_version = data_version
+
+        self.colonias = np.array([r.get('colonia') or '' for r in self.records], dtype=str)
+        self.alcaldias = np.array([r.get('alcaldia') or '' for r in self.records], dtype=str)
+
+        # Cache de columnas numéricas: (campo, default) → array float64
+        self._columns: Dict[Tuple[str, Optional[float]], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def data_version(self) -> str:
+        """Hash del contenido de las zonas (identifica la versión del dataset)"""
+        if self._data_version is None:
+            payload = json.dumps(self.records, sort_keys=True, ensure_ascii=False, default=str)
+            self._data_version = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+        return self._data_version
+
+    @classmethod
+    def from_records(cls, zones_data: List[Dict[str, Any]]) -> 'ZoneTable':
+        """Construye la tabla desde la lista de diccionarios de zonas"""
+        return cls(zones_data)
+
+    @classmethod
+    def from_sqlite(cls, db_path: Union[str, Path] = "data/casamx.db",
+                    table: str = "colonias") -> 'ZoneTable':
+        """Construye la tabla desde la tabla `colonias` de SQLite"""
+        # closing(): el with de sqlite3 solo confirma la transacción, no cierra la conexión
+        with closing(sqlite3.connect(str(db_path))) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(f"SELECT * FROM {table}").fetchall()
+
+        records = []
+        for row in rows:
+            record = {}
+            for column in row.keys():
+                field, scale = cls.SQLITE_FIELD_MAPPING.get(column, (None, None))
+                value = row[column]
+                if field is None or value is None:
+                    continue
+                record[field] = value * scale if scale else value
+            records.append(record)
+
+        return cls(records)
+
+    @classmethod
+    def from_csv(cls, csv_path: Union[str, Path] = "data/dataset_maestro_cdmx.csv") -> 'ZoneTable':
+        """Construye la tabla desde el CSV del dataset maestro (versión = hash del archivo)"""
+        raw = Path(csv_path).read_bytes()
+
+        records = []
+        for row in csv.DictReader(raw.decode('utf-8').splitlines()):
+            record = {}
+            for key, value in row.items():
+                if value is None or value == '':
+                    continue
+                for cast in (int, float):
+                    try:
+                        value = cast(value)
+                        break
+                    except ValueError:
+                        continue
+                record[key] = value
+            records.append(record)
+
+        return cls(records, data_version=hashlib.sha256(raw).hexdigest()[:16])
+
+    def column(self, field: str, default: Optional[float] = None) -> np.ndarray:
+        """Devuelve un atributo como array float64 (default=None → NaN si falta)"""
+        key = (field, default)
+        column = self._columns.get(key)
+
+        if column is None:
+            fill = np.nan if default is None else default
+            column = np.array(
+                [fill if r.get(field) is None else r[field] for r in self.records],
+                dtype=float
+            )
+            column.setflags(write=False)
+            self._columns[key] = column
+
+        return column
+
+    def colonia_mask(self, colonias: List[str]) -> np.ndarray:
+        """Máscara booleana de zonas cuya colonia está en la lista"""
+        if not colonias or not self.size:
+            return np.zeros(self.size, dtype=bool)
+        return np.isin(self.colonias, list(colonias))
+
+class LRUCache:
+    """Cache LRU acotada, con TTL opcional y contadores de aciertos/fallos"""
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data: 'OrderedDict[Any, Tuple[Any, Optional[float]]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self.lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key: Any, value: Any):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self.lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+@dataclass
+class ZoneFeatures:
+    """Columnas de zona que no dependen del perfil de usuario"""
+    data_version: str
+    seguridad: np.ndarray
+    amenidades: np.ndarray
+    conectividad: np.ndarray
+    precio_renta_m2: np.ndarray
+    calidad_vida_base: np.ndarray  # 50 + bonus de parques
+    bonus_tranquilidad: np.ndarray
+    baja_densidad: np.ndarray
+    bonus_aire: np.ndarray
+    servicios_cercanos: List[Any]
+    # Por ubicación de trabajo / estilo de vida
+    transporte_base: Dict[str, np.ndarray] = field(default_factory=dict)
+    tiempos_trabajo: Dict[str, np.ndarray] = field(default_factory=dict)
+    compatibilidad_estilo: Dict[str, np.ndarray] = field(default_factory=dict)
+    # Matriz de traslados colonia×destino (se construye al primer uso)
+    commute_model: Optional[CommuteModel] = None
+    # Grid lat/lon para filtros por radio y viewport (se construye al primer uso)
+    spatial_index: Optional[GridIndex] = None
+
+class ZoneFeatureStore:
+    """Cache en memoria de ZoneFeatures por versión de datos"""
+
+    def __init__(self, engine: 'IntelligentRecommendationEngine', max_versions: int = 4):
+        self.engine = engine
+        self.max_versions = max_versions
+        self._features: 'OrderedDict[str, ZoneFeatures]' = OrderedDict()
+        self._csv_tables: Dict[str, Tuple[Tuple[int, int], ZoneTable]] = {}
+        self.lock = threading.RLock()
+
+    def get(self, zone_table: ZoneTable) -> ZoneFeatures:
+        """Devuelve las features de la tabla, calculándolas si su versión es nueva"""
+        version = zone_table.data_version
+        with self.lock:
+            features = self._features.get(version)
+            if features is not None:
+                self._features.move_to_end(version)
+                return features
+
+        features = self.compute_features(zone_table)
+
+        with self.lock:
+            self._features[version] = features
+            while len(self._features) > self.max_versions:
+                self._features.popitem(last=False)
+        return features
+
+    def compute_features(self, zone_table: ZoneTable) -> ZoneFeatures:
+        """Calcula todas las columnas independientes del perfil"""
+        engine = self.engine
+        conectividad = zone_table.column('score_conectividad', 50)
+
+        features = ZoneFeatures(
+            data_version=zone_table.data_version,
+            seguridad=zone_table.column('indice_seguridad', 50),
+            amenidades=zone_table.column('score_amenidades', 50),
+            conectividad=conectividad,
+            precio_renta_m2=zone_table.column('precio_m2_renta_pesos', 400),
+            calidad_vida_base=50 + np.minimum(20, zone_table.column('parques_1km', 0) * 3),
+            bonus_tranquilidad=(10 - zone_table.column('nivel_ruido', 5)) * 2,
+            baja_densidad=zone_table.column('densidad_poblacional', 5000) < 3000,
+            bonus_aire=zone_table.column('calidad_aire_promedio', 50) * 0.3,
+            servicios_cercanos=[engine.count_nearby_services(zone) for zone in zone_table.records]
+        )
+
+        for work_location, location in engine.work_locations.items():
+            near_work = zone_table.colonia_mask(location['zonas_cercanas'])
+            features.transporte_base[work_location] = np.where(near_work, conectividad * 1.2, conectividad)
+            features.tiempos_trabajo[work_location] = zone_table.column(engine.work_time_field(work_location))
+
+        for lifestyle in engine.lifestyle_profiles:
+            features.compatibilidad_estilo[lifestyle] = engine.compute_lifestyle_compatibility(
+                zone_table, lifestyle
+            )
+
+        return features
+
+    def load_csv(self, csv_path: Union[str, Path] = "data/dataset_maestro_cdmx.csv") -> ZoneTable:
+        """Carga el dataset maestro; solo se relee y rehashea si el archivo cambió"""
+        key = str(Path(csv_path).resolve())
+        stat = os.stat(key)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            cached = self._csv_tables.get(key)
+            if cached and cached[0] == signature:
+                return cached[1]
+
+        zone_table = ZoneTable.from_csv(key)
+        if cached and cached[1].data_version == zone_table.data_version:
+            zone_table = cached[1]  # Mismo contenido: se conservan columnas ya construidas
+
+        with self.lock:
+            self._csv_tables[key] = (signature, zone_table)
+        return zone_table
+
+    def invalidate(self, data_version: Optional[str] = None):
+        """Descarta las features de una versión (o todas)"""
+        with self.lock:
+            if data_version is None:
+                self._features.clear()
+                self._csv_tables.clear()
+            else:
+                self._features.pop(data_version, None)
+
+@dataclass
+class DiversificationConfig:
+    """Parámetros del diversificador MMR (maximal marginal relevance)"""
+    relevance_weight: float = 0.7  # λ: 1.0 = solo relevancia, 0.0 = solo diversidad
+
+    # Pesos de cada componente de la similitud entre dos zonas
+    alcaldia_weight: float = 0.4
+    score_weight: float = 0.3
+    distance_weight: float = 0.3
+
+    score_vector: str = 'categorias'  # 'total' o 'categorias'
+    score_window: float = 10.0  # Diferencia de score a partir de la cual ya no son similares
+    distance_window_km: float = 3.0
+
+    # Si se define, se descartan candidatos con similitud mayor a este valor
+    max_similarity: Optional[float] = None
+    # Solo hay similitud entre zonas de la misma alcaldía (permite usar buckets)
+    require_same_alcaldia: bool = False
+
+DIVERSIFICATION_PRESETS = {
+    # Regla original: descartar zonas de la misma alcaldía con score a menos de 10 puntos
+    'misma_alcaldia': DiversificationConfig(
+        relevance_weight=1.0, alcaldia_weight=0.0, score_weight=1.0, distance_weight=0.0,
+        score_vector='total', score_window=10.0, max_similarity=0.0, require_same_alcaldia=True
+    ),
+    'mmr_balanceado': DiversificationConfig(),
+    'geografico': DiversificationConfig(
+        relevance_weight=0.6, alcaldia_weight=0.0, score_weight=0.0, distance_weight=1.0,
+        distance_window_km=2.0
+    )
+}
+
+class MMRDiversifier:
+    """Diversificador MMR sobre un ranking, con buckets por alcaldía"""
+
+    def __init__(self, config: DiversificationConfig):
+        self.config = config
+        self.total_weight = config.alcaldia_weight + config.score_weight + config.distance_weight
+
+    def select(self, scores: np.ndarray, alcaldias: np.ndarray, num_needed: int,
+               score_vectors: Optional[np.ndarray] = None,
+               coords: Optional[np.ndarray] = None,
+               exhaustive: bool = True) -> Optional[List[int]]:
+        """Selecciona posiciones de un ranking ordenado por score descendente
+
+        Devuelve None si el ranking no es completo (exhaustive=False) y no alcanzó
+        para llenar num_needed sin recurrir a candidatos descartados.
+        """
+        config = self.config
+        num_candidates = len(scores)
+        if exhaustive and num_candidates <= num_needed:
+            return list(range(num_candidates))
+        if num_needed <= 0:
+            return []
+
+        relevance = scores / 100.0
+        max_similarity = np.zeros(num_candidates)
+        available = np.ones(num_candidates, dtype=bool)
+        buckets = self.build_buckets(alcaldias) if config.require_same_alcaldia else None
+        all_positions = np.arange(num_candidates)
+
+        selected = []
+        while len(selected) < num_needed and available.any():
+            if config.relevance_weight >= 1.0:
+                # Solo relevancia: el siguiente disponible en el ranking
+                pick = int(np.argmax(available))
+            else:
+                marginal = (config.relevance_weight * relevance
+                            - (1 - config.relevance_weight) * max_similarity)
+                pick = int(np.argmax(np.where(available, marginal, -np.inf)))
+
+            selected.append(pick)
+            available[pick] = False
+
+            # Solo se actualizan los candidatos que pueden parecerse a la zona elegida
+            targets = buckets[alcaldias[pick]] if buckets is not None else all_positions
+            targets = targets[available[targets]]
+            if not targets.size or not self.total_weight:
+                continue
+
+            similarity = self.similarity(pick, targets, scores, alcaldias, score_vectors, coords)
+            max_similarity[targets] = np.maximum(max_similarity[targets], similarity)
+            if config.max_similarity is not None:
+                available[targets[similarity > config.max_similarity]] = False
+
+        if len(selected) < num_needed:
+            if not exhaustive:
+                return None
+
+            # Llenar con las siguientes mejores
+            chosen = set(selected)
+            for position in range(num_candidates):
+                if len(selected) >= num_needed:
+                    break
+                if position not in chosen:
+                    selected.append(position)
+
+        return selected
+
+    def build_buckets(self, alcaldias: np.ndarray) -> Dict[str, np.ndarray]:
+        """Agrupa las posiciones del ranking por alcaldía"""
+        names, inverse = np.unique(alcaldias, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(names) + 1))
+        return {name: order[bounds[i]:bounds[i + 1]] for i, name in enumerate(names.tolist())}
+
+    def similarity(self, pick: int, targets: np.ndarray, scores: np.ndarray,
+                   alcaldias: np.ndarray, score_vectors: Optional[np.ndarray],
+                   coords: Optional[np.ndarray]) -> np.ndarray:
+        """Similitud (0-1) entre la zona elegida y cada candidato"""
+        config = self.config
+        similarity = np.zeros(targets.size)
+
+        if config.alcaldia_weight:
+            similarity += config.alcaldia_weight * (alcaldias[targets] == alcaldias[pick])
+
+        if config.score_weight:
+            if config.score_vector == 'categorias' and score_vectors is not None:
+                diff = score_vectors[targets] - score_vectors[pick]
+                distance = np.sqrt(np.mean(diff * diff, axis=1))
+            else:
+                distance = np.abs(scores[targets] - scores[pick])
+            # (window - d) > 0 exactamente cuando d < window
+            closeness = (config.score_window - distance) / config.score_window
+            similarity += config.score_weight * np.clip(closeness, 0, 1)
+
+        if config.distance_weight and coords is not None:
+            km = haversine_km(coords[targets, 0], coords[targets, 1],
+                              coords[pick, 0], coords[pick, 1])
+            closeness = (config.distance_window_km - km) / config.distance_window_km
+            similarity += config.distance_weight * np.nan_to_num(np.clip(closeness, 0, 1))
+
+        return similarity / self.total_weight
 
 class IntelligentRecommendationEngine:
     """Motor de recomendaciones inteligente con algoritmo personalizado"""
@@ -99,6 +529,23 @@ class IntelligentRecommendationEngine:
             'Roma Norte': {'lat': 19.4149, 'lon': -99.1625, 'zonas_cercanas': ['Roma Norte', 'Condesa']},
             'Insurgentes Sur': {'lat': 19.3729, 'lon': -99.1619, 'zonas_cercanas': ['Del Valle', 'Narvarte']}
         }
+
+        # Diversificación por defecto (regla original por alcaldía)
+        self.diversification = DIVERSIFICATION_PRESETS['misma_alcaldia']
+
+        # Features de zona independientes del usuario, por versión de datos
+        self.feature_store = ZoneFeatureStore(self)
+
+        # Modelo de traslados: destinos y directorio opcional para matrices .npy
+        self.commute_hubs: Optional[Tuple[List[Dict[str, Any]], np.ndarray]] = None
+        self.commute_cache_dir: Optional[Path] = None
+
+        # Caches por perfil canónico: pesos y resultados top-k completos
+        self.weights_cache = LRUCache(maxsize=4096)
+        self.recommendation_cache = LRUCache(maxsize=1024, ttl_seconds=3600)
+
+        # Backend opcional de scoring en procesos (ver enable_parallel_scoring)
+        self.parallel_scorer: Optional[ParallelScorer] = None
     
     def define_lifestyle_profiles(self) -> Dict[str, Dict[str, Any]]:
         """Define perfiles de estilo de vida con preferencias específicas"""
@@ -153,7 +600,36 @@ class IntelligentRecommendationEngine:
             }
         }
     
+    def weights_key(self, user_profile: UserProfile) -> Tuple:
+        """Forma canónica de los campos del perfil que afectan los pesos"""
+        amenities_priority = (user_profile.prioridad_escuelas + user_profile.prioridad_hospitales +
+                              user_profile.prioridad_centros_comerciales)
+        has_young_children = bool(user_profile.tiene_hijos and
+                                  any(edad < 12 for edad in user_profile.edades_hijos))
+        return (
+            user_profile.estilo_vida,
+            user_profile.prioridad_seguridad,
+            user_profile.prioridad_transporte,
+            user_profile.prioridad_precio,
+            amenities_priority,
+            bool(user_profile.tiene_hijos),
+            has_young_children
+        )
+
+    def canonical_profile_key(self, user_profile: UserProfile) -> Tuple:
+        """Clave canónica de todo lo que el perfil aporta a las recomendaciones"""
+        return self.weights_key(user_profile) + self.score_context_key(user_profile)
+
     def calculate_personalized_weights(self, user_profile: UserProfile) -> Dict[str, float]:
+        """Pesos personalizados, memoizados por la forma canónica del perfil"""
+        key = self.weights_key(user_profile)
+        weights = self.weights_cache.get(key)
+        if weights is None:
+            weights = self.compute_personalized_weights(user_profile)
+            self.weights_cache.set(key, weights)
+        return dict(weights)
+
+    def compute_personalized_weights(self, user_profile: UserProfile) -> Dict[str, float]:
         """Calcula pesos personalizados basados en perfil de usuario"""
         weights = self.default_weights.copy()
         
@@ -326,52 +802,483 @@ class IntelligentRecommendationEngine:
             base_score += min(25, medical_score * 5)
         
         return min(base_score, 100)
-    
-    def generate_recommendations(self, zones_data: List[Dict[str, Any]], 
-                                user_profile: UserProfile, 
-                                num_recommendations: int = 5) -> List[ZoneRecommendation]:
-        """Genera recomendaciones personalizadas de zonas"""
-        
+
+    # ==================== SCORING VECTORIZADO ====================
+
+    def get_zone_table(self, zones_data: Union[ZoneTable, List[Dict[str, Any]]]) -> ZoneTable:
+        """Obtiene la tabla columnar de zonas, construyéndola una sola vez por lista"""
+        if isinstance(zones_data, ZoneTable):
+            return zones_data
+
+        # Se guarda la referencia a la lista para que su id() no pueda reutilizarse
+        cached = getattr(self, '_zone_table_cache', None)
+        if cached and cached[0] is zones_data and len(cached[1]) == len(zones_data):
+            return cached[1]
+
+        zone_table = ZoneTable.from_records(zones_data)
+        self._zone_table_cache = (zones_data, zone_table)
+        return zone_table
+
+    def work_time_field(self, work_location: str) -> str:
+        """Campo de tiempo estimado al trabajo (p. ej. tiempo_santa_fe_min)"""
+        return f'tiempo_{work_location.lower().replace(" ", "_")}_min'
+
+    def calculate_category_score_matrix(self, zone_table: ZoneTable,
+                                        user_profile: UserProfile) -> np.ndarray:
+        """Calcula los scores de las seis categorías para todas las zonas (matriz M×6)"""
+        features = self.feature_store.get(zone_table)
+        scores = np.empty((len(zone_table), len(SCORE_CATEGORIES)))
+
+        scores[:, 0] = features.seguridad
+        scores[:, 1] = self.calculate_transport_scores(zone_table, features, user_profile)
+        scores[:, 2] = self.calculate_price_scores(features, user_profile)
+        scores[:, 3] = features.amenidades
+        scores[:, 4] = self.calculate_quality_of_life_scores(features, user_profile)
+        scores[:, 5] = self.calculate_lifestyle_compatibility_scores(zone_table, features, user_profile)
+
+        return scores
+
+    def calculate_transport_scores(self, zone_table: ZoneTable, features: ZoneFeatures,
+                                   user_profile: UserProfile) -> np.ndarray:
+        """Versión vectorizada de calculate_transport_score"""
+        work_location = user_profile.ubicacion_trabajo
+        base_score = features.transporte_base.get(work_location, features.conectividad)
+
+        estimated_time, _ = self.resolve_commute_times(zone_table, features, user_profile)
+        if estimated_time is None:
+            return np.minimum(base_score, 100)
+
+        # Tiempo faltante → se asume el máximo aceptable (sin penalización)
+        max_time = user_profile.tiempo_max_trabajo_min
+        estimated_time = np.where(np.isnan(estimated_time), max_time, estimated_time)
+
+        over_limit = estimated_time > max_time
+        penalty = np.minimum(0.5, (estimated_time - max_time) / max_time)
+        base_score = np.where(over_limit, base_score * (1 - penalty), base_score)
+
+        return np.minimum(base_score, 100)
+
+    def resolve_commute_times(self, zone_table: ZoneTable, features: ZoneFeatures,
+                              user_profile: UserProfile) -> Tuple[Optional[np.ndarray], bool]:
+        """Tiempos al trabajo por zona y si provienen del modelo de traslados
+
+        Prioridad: coordenadas del trabajo → columnas tiempo_<zona>_min con datos →
+        destino conocido del modelo. None si no hay forma de estimarlos.
+        """
+        if user_profile.trabajo_lat is not None and user_profile.trabajo_lon is not None:
+            model = self.get_commute_model(zone_table, features)
+            return model.times_to_point(user_profile.trabajo_lat, user_profile.trabajo_lon), True
+
+        # Una columna sin ningún valor (no existe en los datos) no cuenta como fuente
+        work_location = user_profile.ubicacion_trabajo
+        column_times = features.tiempos_trabajo.get(work_location)
+        if column_times is not None and np.isfinite(column_times).any():
+            return column_times, False
+
+        hubs, _ = self.get_commute_hubs()
+        if any(hub['nombre'] == work_location for hub in hubs):
+            return self.get_commute_model(zone_table, features).times_to_hub(work_location), True
+
+        return None, False
+
+    def get_commute_hubs(self) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """Destinos del modelo de traslados (se cargan una vez)"""
+        if self.commute_hubs is None:
+            self.commute_hubs = load_default_hubs(self.work_locations)
+        return self.commute_hubs
+
+    def get_commute_model(self, zone_table: ZoneTable, features: ZoneFeatures) -> CommuteModel:
+        """Matriz de traslados de la versión de datos, desde disco (mmap) o calculada"""
+        if features.commute_model is not None:
+            return features.commute_model
+
+        hubs, metro_stations = self.get_commute_hubs()
+        hubs_hash = hashlib.sha256(json.dumps(hubs, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        version = f"{zone_table.data_version}_{hubs_hash}"
+
+        model = None
+        if self.commute_cache_dir is not None:
+            model = CommuteModel.load(self.commute_cache_dir, version)
+
+        if model is None:
+            model = CommuteModel.build(
+                zone_table.column('lat'), zone_table.column('lon'), hubs,
+                metro_stations=metro_stations, data_version=version
+            )
+            if self.commute_cache_dir is not None:
+                model.save(self.commute_cache_dir)
+
+        features.commute_model = model
+        return model
+
+    def get_spatial_index(self, zone_table: ZoneTable) -> GridIndex:
+        """Índice espacial de la versión de datos"""
+        features = self.feature_store.get(zone_table)
+        if features.spatial_index is None:
+            features.spatial_index = GridIndex(zone_table.column('lat'), zone_table.column('lon'))
+        return features.spatial_index
+
+    def filter_zones(self, zone_table: ZoneTable,
+                     bbox: Optional[Tuple[float, float, float, float]] = None,
+                     center: Optional[Tuple[float, float]] = None,
+                     radius_km: Optional[float] = None) -> Optional[np.ndarray]:
+        """Índices de zonas dentro del bbox (min_lat, min_lon, max_lat, max_lon) y/o del radio
+
+        Devuelve None si no hay filtro espacial.
+        """
+        if bbox is None and (center is None or radius_km is None):
+            return None
+
+        spatial_index = self.get_spatial_index(zone_table)
+        candidates = None
+        if bbox is not None:
+            candidates = spatial_index.query_bbox(*bbox)
+        if center is not None and radius_km is not None:
+            in_radius = spatial_index.query_radius(center[0], center[1], radius_km)
+            candidates = in_radius if candidates is None else np.intersect1d(candidates, in_radius)
+        return candidates
+
+    def calculate_price_scores(self, features: ZoneFeatures,
+                               user_profile: UserProfile) -> np.ndarray:
+        """Versión vectorizada de calculate_price_score"""
+        estimated_size_needed = 30 + (user_profile.tamano_familia * 15)
+        rent = features.precio_renta_m2 * estimated_size_needed
+        budget = user_profile.presupuesto_max_renta
+
+        return np.select(
+            [rent <= budget * 0.7, rent <= budget, rent <= budget * 1.2],
+            [
+                100.0,
+                80 + (budget - rent) / (budget * 0.3) * 20,
+                40 + (budget * 1.2 - rent) / (budget * 0.2) * 40
+            ],
+            default=np.maximum(10, 40 - np.minimum(60, (rent - budget * 1.2) / budget * 100))
+        )
+
+    def calculate_quality_of_life_scores(self, features: ZoneFeatures,
+                                         user_profile: UserProfile) -> np.ndarray:
+        """Versión vectorizada de calculate_quality_of_life_score"""
+        base_score = features.calidad_vida_base
+
+        if user_profile.prefiere_zonas_tranquilas:
+            base_score = base_score + features.bonus_tranquilidad
+
+        if user_profile.tiene_hijos:
+            base_score = base_score + np.where(features.baja_densidad, 15, 0)
+
+        base_score = base_score + features.bonus_aire
+
+        return np.minimum(base_score, 100)
+
+    def calculate_lifestyle_compatibility_scores(self, zone_table: ZoneTable, features: ZoneFeatures,
+                                                 user_profile: UserProfile) -> np.ndarray:
+        """Compatibilidad de estilo (solo depende del estilo de vida, no del resto del perfil)"""
+        lifestyle = user_profile.estilo_vida
+        scores = features.compatibilidad_estilo.get(lifestyle)
+        if scores is None:
+            scores = self.compute_lifestyle_compatibility(zone_table, lifestyle)
+            features.compatibilidad_estilo[lifestyle] = scores
+        return scores
+
+    def compute_lifestyle_compatibility(self, zone_table: ZoneTable, lifestyle: str) -> np.ndarray:
+        """Versión vectorizada de calculate_lifestyle_compatibility"""
+        lifestyle_config = self.lifestyle_profiles.get(lifestyle, {})
+
+        preferred = zone_table.colonia_mask(lifestyle_config.get('preferred_zones', []))
+        avoided = zone_table.colonia_mask(lifestyle_config.get('avoided_zones', []))
+        base_score = 50 + np.select([preferred, avoided], [30, -20], default=0)
+
+        for amenity in lifestyle_config.get('key_amenities', []):
+            amenity_count = zone_table.column(f'{amenity}_1km', 0)
+            base_score = base_score + np.where(amenity_count > 0, np.minimum(15, amenity_count * 2), 0)
+
+        if lifestyle == 'joven_profesional':
+            base_score = base_score + zone_table.column('vida_nocturna_score', 0) * 0.3
+        elif lifestyle == 'familiar':
+            base_score = base_score + np.minimum(20, zone_table.column('escuelas_primarias_1km', 0) * 4)
+        elif lifestyle == 'retirado':
+            base_score = base_score + np.minimum(25, zone_table.column('hospitales_1km', 0) * 5)
+
+        return np.minimum(base_score, 100)
+
+    def combine_category_scores(self, category_scores: np.ndarray,
+                                weights: Dict[str, float]) -> np.ndarray:
+        """Score total ponderado por zona (mismo orden de suma que el cálculo por zona)"""
+        total_scores = np.zeros(category_scores.shape[0])
+        for column, category in enumerate(SCORE_CATEGORIES):
+            if category in weights:
+                total_scores = total_scores + category_scores[:, column] * weights[category]
+        return total_scores
+
+    def generate_recommendations(self, zones_data: Union[ZoneTable, List[Dict[str, Any]]],
+                                user_profile: UserProfile,
+                                num_recommendations: int = 5,
+                                diversification: Optional[Union[str, DiversificationConfig]] = None,
+                                bbox: Optional[Tuple[float, float, float, float]] = None,
+                                center: Optional[Tuple[float, float]] = None,
+                                radius_km: Optional[float] = None
+                                ) -> List[ZoneRecommendation]:
+        """Genera recomendaciones personalizadas de zonas
+
+        bbox (min_lat, min_lon, max_lat, max_lon) y center + radius_km restringen
+        las candidatas a una región antes de seleccionar.
+        """
+        zone_table = self.get_zone_table(zones_data)
+
+        # Perfiles repetidos se responden desde la cache sin calcular scores
+        cache_key = self.recommendation_cache_key(
+            zone_table, user_profile, num_recommendations, diversification,
+            spatial_filter=(bbox, center, radius_km)
+        )
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
+            # Copias profundas: pros/contras/razones y datos_destacados no se comparten con la cache
+            return copy.deepcopy(cached)
+
         # Calcular pesos personalizados
         weights = self.calculate_personalized_weights(user_profile)
-        
-        zone_recommendations = []
-        
-        for zone in zones_data:
-            # Calcular scores por categoría
-            category_scores = self.calculate_zone_scores(zone, user_profile)
-            
-            # Calcular score total ponderado
-            total_score = sum(
-                category_scores.get(category, 50) * weight 
-                for category, weight in weights.items()
-                if category in category_scores
-            )
-            
-            # Crear recomendación
+
+        # Scores de todas las zonas en operaciones de arrays
+        category_matrix = self.calculate_category_score_matrix(zone_table, user_profile)
+        total_scores = self.combine_category_scores(category_matrix, weights)
+        candidates = self.filter_zones(zone_table, bbox, center, radius_km)
+
+        # Fase 1: selección top-k solo con scores numéricos
+        selected, rankings = self.select_recommendation_indices(
+            zone_table, total_scores, num_recommendations, category_matrix, diversification,
+            candidates=candidates
+        )
+
+        # Fase 2: explicaciones solo para las zonas seleccionadas
+        recommendations = self.build_recommendations(
+            zone_table, category_matrix, total_scores, selected, rankings, user_profile, weights
+        )
+
+        self.recommendation_cache.set(cache_key, recommendations)
+        return copy.deepcopy(recommendations)
+
+    def recommendation_cache_key(self, zone_table: ZoneTable, user_profile: UserProfile,
+                                 num_recommendations: int,
+                                 diversification: Optional[Union[str, DiversificationConfig]] = None,
+                                 spatial_filter: Optional[Tuple] = None
+                                 ) -> Tuple:
+        """Clave de la cache de resultados: datos, perfil canónico, k, diversificación y región"""
+        if diversification is None:
+            diversification = self.diversification
+        if isinstance(diversification, DiversificationConfig):
+            diversification = astuple(diversification)
+        return (zone_table.data_version, self.canonical_profile_key(user_profile),
+                num_recommendations, diversification, spatial_filter)
+
+    def clear_caches(self):
+        """Vacía las caches (p. ej. tras modificar pesos o perfiles de estilo de vida)"""
+        self.weights_cache.clear()
+        self.recommendation_cache.clear()
+        self.feature_store.invalidate()
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Contadores de aciertos/fallos de las caches del motor"""
+        return {
+            'pesos': self.weights_cache.stats(),
+            'recomendaciones': self.recommendation_cache.stats()
+        }
+
+    def get_diversifier(self, diversification: Optional[Union[str, DiversificationConfig]] = None
+                        ) -> MMRDiversifier:
+        """Resuelve un preset o configuración de diversificación"""
+        if diversification is None:
+            diversification = self.diversification
+        if isinstance(diversification, str):
+            diversification = DIVERSIFICATION_PRESETS[diversification]
+        return MMRDiversifier(diversification)
+
+    def select_recommendation_indices(self, zone_table: ZoneTable, total_scores: np.ndarray,
+                                      num_recommendations: int,
+                                      category_matrix: Optional[np.ndarray] = None,
+                                      diversification: Optional[Union[str, DiversificationConfig]] = None,
+                                      candidates: Optional[np.ndarray] = None
+                                      ) -> Tuple[np.ndarray, np.ndarray]:
+        """Selecciona las zonas a recomendar (índices y rankings) sin construir recomendaciones
+
+        Con candidates solo se consideran esas zonas; los índices devueltos siguen
+        siendo posiciones en la tabla completa.
+        """
+        alcaldias = zone_table.alcaldias
+        coords = None
+        diversifier = self.get_diversifier(diversification)
+        if diversifier.config.distance_weight:
+            coords = self.zone_coords(zone_table)
+
+        if candidates is not None:
+            total_scores = total_scores[candidates]
+            alcaldias = alcaldias[candidates]
+            if category_matrix is not None:
+                category_matrix = category_matrix[candidates]
+            if coords is not None:
+                coords = coords[candidates]
+
+        selected, rankings = select_diversified_indices(
+            total_scores, alcaldias, num_recommendations, diversifier, category_matrix, coords
+        )
+        if candidates is not None:
+            selected = candidates[selected]
+        return selected, rankings
+
+    def zone_coords(self, zone_table: ZoneTable) -> np.ndarray:
+        """Matriz (lat, lon) por zona para la diversificación geográfica"""
+        return np.column_stack([zone_table.column('lat'), zone_table.column('lon')])
+
+    def build_recommendations(self, zone_table: ZoneTable, category_matrix: np.ndarray,
+                              total_scores: np.ndarray, selected: np.ndarray,
+                              rankings: np.ndarray, user_profile: UserProfile,
+                              weights: Dict[str, float]) -> List[ZoneRecommendation]:
+        """Construye ZoneRecommendation (con explicaciones) solo para las zonas seleccionadas"""
+        features = self.feature_store.get(zone_table)
+        commute_times, from_model = self.resolve_commute_times(zone_table, features, user_profile)
+
+        recommendations = []
+        for index, ranking in zip(selected.tolist(), rankings.tolist()):
+            commute_minutes = None
+            if from_model and not np.isnan(commute_times[index]):
+                commute_minutes = int(round(commute_times[index]))
+
             recommendation = self.create_zone_recommendation(
-                zone, category_scores, total_score, user_profile, weights
+                zone_table.records[index],
+                dict(zip(SCORE_CATEGORIES, category_matrix[index].tolist())),
+                float(total_scores[index]), user_profile, weights,
+                nearby_services=features.servicios_cercanos[index],
+                commute_minutes=commute_minutes
             )
-            
-            zone_recommendations.append(recommendation)
-        
-        # Ordenar por score y asignar ranking
-        zone_recommendations.sort(key=lambda x: x.score_personalizado, reverse=True)
-        for i, rec in enumerate(zone_recommendations):
-            rec.ranking = i + 1
-        
-        # Aplicar diversificación (evitar recomendar zonas muy similares)
-        diversified_recommendations = self.diversify_recommendations(
-            zone_recommendations, num_recommendations
+            recommendation.ranking = ranking
+            recommendations.append(recommendation)
+        return recommendations
+
+    # ==================== RECOMENDACIONES EN LOTE ====================
+
+    def score_context_key(self, user_profile: UserProfile) -> Tuple:
+        """Campos del perfil que afectan los scores por categoría (no los pesos)"""
+        return (
+            user_profile.ubicacion_trabajo,
+            user_profile.trabajo_lat,
+            user_profile.trabajo_lon,
+            user_profile.tiempo_max_trabajo_min,
+            user_profile.tamano_familia,
+            user_profile.presupuesto_max_renta,
+            user_profile.prefiere_zonas_tranquilas,
+            user_profile.tiene_hijos,
+            user_profile.estilo_vida
         )
-        
-        return diversified_recommendations[:num_recommendations]
-    
+
+    def stack_personalized_weights(self, user_profiles: List[UserProfile]) -> np.ndarray:
+        """Apila los pesos personalizados de N perfiles en una matriz N×6"""
+        weight_matrix = np.zeros((len(user_profiles), len(SCORE_CATEGORIES)))
+        for row, user_profile in enumerate(user_profiles):
+            weights = self.calculate_personalized_weights(user_profile)
+            weight_matrix[row] = [weights.get(category, 0.0) for category in SCORE_CATEGORIES]
+        return weight_matrix
+
+    def generate_batch_recommendations(self, zones_data: Union[ZoneTable, List[Dict[str, Any]]],
+                                       user_profiles: List[UserProfile],
+                                       num_recommendations: int = 5,
+                                       diversification: Optional[Union[str, DiversificationConfig]] = None
+                                       ) -> List[List[ZoneRecommendation]]:
+        """Genera recomendaciones para N perfiles con una matriz de scores N×M
+
+        El producto matricial puede diferir en el último bit del score de
+        generate_recommendations, lo que solo afecta el orden de empates exactos.
+        """
+        zone_table = self.get_zone_table(zones_data)
+        weight_matrix = self.stack_personalized_weights(user_profiles)
+
+        # Los perfiles con el mismo contexto comparten el tensor de scores por categoría,
+        # así que se calcula una vez por grupo y se multiplica contra los pesos apilados
+        groups: Dict[Tuple, List[int]] = {}
+        for row, user_profile in enumerate(user_profiles):
+            groups.setdefault(self.score_context_key(user_profile), []).append(row)
+
+        if self.parallel_scorer is not None and self.parallel_scorer.should_parallelize(len(zone_table)):
+            return self.generate_batch_recommendations_parallel(
+                zone_table, user_profiles, weight_matrix, groups, num_recommendations, diversification
+            )
+
+        score_matrix = np.empty((len(user_profiles), len(zone_table)))
+        results: List[List[ZoneRecommendation]] = [[] for _ in user_profiles]
+        for rows in groups.values():
+            category_matrix = self.calculate_category_score_matrix(zone_table, user_profiles[rows[0]])
+            score_matrix[rows] = weight_matrix[rows] @ category_matrix.T
+
+            # Solo se construyen ZoneRecommendation para las zonas ganadoras
+            for row in rows:
+                weights = dict(zip(SCORE_CATEGORIES, weight_matrix[row].tolist()))
+                selected, rankings = self.select_recommendation_indices(
+                    zone_table, score_matrix[row], num_recommendations,
+                    category_matrix, diversification
+                )
+                results[row] = self.build_recommendations(
+                    zone_table, category_matrix, score_matrix[row], selected, rankings,
+                    user_profiles[row], weights
+                )
+
+        return results
+
+    def generate_batch_recommendations_parallel(self, zone_table: ZoneTable,
+                                                user_profiles: List[UserProfile],
+                                                weight_matrix: np.ndarray,
+                                                groups: Dict[Tuple, List[int]],
+                                                num_recommendations: int,
+                                                diversification: Optional[Union[str, DiversificationConfig]] = None
+                                                ) -> List[List[ZoneRecommendation]]:
+        """Variante de generate_batch_recommendations con scoring y selección en procesos
+
+        Aquí solo se calculan las matrices por categoría (mientras los workers
+        procesan la tanda anterior) y las explicaciones de las zonas elegidas. Los
+        scores usan la misma suma secuencial que generate_recommendations.
+        """
+        results: List[List[ZoneRecommendation]] = [[] for _ in user_profiles]
+        diversifier = self.get_diversifier(diversification)
+        coords = self.zone_coords(zone_table) if diversifier.config.distance_weight else None
+        _, alcaldia_codes = np.unique(zone_table.alcaldias, return_inverse=True)
+
+        group_rows = list(groups.values())
+        contexts = (
+            (weight_matrix[rows], self.calculate_category_score_matrix(zone_table, user_profiles[rows[0]]))
+            for rows in group_rows
+        )
+        selections = self.parallel_scorer.select_profiles(
+            contexts, alcaldia_codes, num_recommendations, diversifier.config, coords
+        )
+        for group, position, category_matrix, selected, rankings, selected_scores in selections:
+            row = group_rows[group][position]
+            # build_recommendations solo lee los scores de las zonas seleccionadas
+            total_scores = np.zeros(len(zone_table))
+            total_scores[selected] = selected_scores
+            weights = dict(zip(SCORE_CATEGORIES, weight_matrix[row].tolist()))
+            results[row] = self.build_recommendations(
+                zone_table, category_matrix, total_scores, selected, rankings,
+                user_profiles[row], weights
+            )
+
+        return results
+
+    def enable_parallel_scoring(self, max_workers: Optional[int] = None,
+                                min_zones: int = PARALLEL_MIN_ZONES):
+        """Activa el scoring en procesos para lotes sobre tablas de al menos min_zones"""
+        self.disable_parallel_scoring()
+        self.parallel_scorer = ParallelScorer(max_workers=max_workers, min_zones=min_zones)
+
+    def disable_parallel_scoring(self):
+        """Vuelve al scoring en proceso y termina los workers"""
+        if self.parallel_scorer is not None:
+            self.parallel_scorer.close()
+            self.parallel_scorer = None
+
     def create_zone_recommendation(self, zone_data: Dict[str, Any], 
                                  category_scores: Dict[str, float],
                                  total_score: float,
                                  user_profile: UserProfile,
-                                 weights: Dict[str, float]) -> ZoneRecommendation:
+                                 weights: Dict[str, float],
+                                 nearby_services: Optional[int] = None,
+                                 commute_minutes: Optional[int] = None) -> ZoneRecommendation:
         """Crea recomendación detallada para una zona"""
         
         colonia = zone_data.get('colonia', 'Desconocida')
@@ -392,8 +1299,10 @@ class IntelligentRecommendationEngine:
             'seguridad_clasificacion': self.classify_score(category_scores.get('seguridad', 50)),
             'transporte_clasificacion': self.classify_score(category_scores.get('transporte', 50)),
             'precio_clasificacion': self.classify_price_score(category_scores.get('precio', 50)),
-            'tiempo_estimado_trabajo': zone_data.get(f'tiempo_{user_profile.ubicacion_trabajo.lower().replace(" ", "_")}_min', 'N/A'),
-            'servicios_cercanos': self.count_nearby_services(zone_data),
+            'tiempo_estimado_trabajo': (commute_minutes if commute_minutes is not None else
+                                        zone_data.get(self.work_time_field(user_profile.ubicacion_trabajo), 'N/A')),
+            'servicios_cercanos': (nearby_services if nearby_services is not None
+                                   else self.count_nearby_services(zone_data)),
             'nivel_socioeconomico': zone_data.get('nivel_socioeconomico', 5)
         }
         
@@ -410,11 +1319,15 @@ class IntelligentRecommendationEngine:
             score_calidad_vida=category_scores.get('calidad_vida', 50),
             precio_renta_estimado=estimated_rent,
             precio_compra_m2=zone_data.get('precio_m2_venta_pesos', 40000),
-            tiempo_trabajo_min=zone_data.get(f'tiempo_{user_profile.ubicacion_trabajo.lower().replace(" ", "_")}_min', 0),
+            tiempo_trabajo_min=(commute_minutes if commute_minutes is not None else
+                                zone_data.get(self.work_time_field(user_profile.ubicacion_trabajo), 0)),
             razones_principales=razones_principales,
             pros=pros,
             contras=contras,
-            datos_destacados=datos_destacados
+            datos_destacados=datos_destacados,
+            score_compatibilidad_estilo=category_scores.get('compatibilidad_estilo', 50),
+            lat=zone_data.get('lat'),
+            lon=zone_data.get('lon')
         )
     
     def generate_main_reasons(self, category_scores: Dict[str, float], 
@@ -516,37 +1429,83 @@ class IntelligentRecommendationEngine:
         ]
         return sum(zone_data.get(service, 0) for service in services)
     
-    def diversify_recommendations(self, recommendations: List[ZoneRecommendation], 
-                                num_needed: int) -> List[ZoneRecommendation]:
-        """Diversifica recomendaciones para evitar zonas muy similares"""
-        if len(recommendations) <= num_needed:
-            return recommendations
-        
-        diversified = [recommendations[0]]  # Siempre incluir la mejor
-        
-        for rec in recommendations[1:]:
-            if len(diversified) >= num_needed:
-                break
-            
-            # Verificar que no sea muy similar a las ya seleccionadas
-            is_diverse = True
-            for selected in diversified:
-                if (abs(rec.score_personalizado - selected.score_personalizado) < 10 and 
-                    rec.alcaldia == selected.alcaldia):
-                    is_diverse = False
-                    break
-            
-            if is_diverse:
-                diversified.append(rec)
-        
-        # Si aún necesitamos más, llenar con las siguientes mejores
-        while len(diversified) < num_needed and len(diversified) < len(recommendations):
-            for rec in recommendations:
-                if rec not in diversified:
-                    diversified.append(rec)
-                    break
-        
-        return diversified
+    def diversify_recommendations(self, recommendations: List[ZoneRecommendation],
+                                num_needed: int,
+                                diversification: Optional[Union[str, DiversificationConfig]] = None
+                                ) -> List[ZoneRecommendation]:
+        """Diversifica recomendaciones (ordenadas por score) para evitar zonas muy similares
+
+        Usa las mismas entradas que select_recommendation_indices: un vector con
+        todas las categorías de SCORE_CATEGORIES y coordenadas (NaN si faltan).
+        """
+        scores = np.array([rec.score_personalizado for rec in recommendations], dtype=float)
+        alcaldias = np.array([rec.alcaldia for rec in recommendations], dtype=str)
+        score_vectors = np.array([
+            [getattr(rec, f'score_{category}') for category in SCORE_CATEGORIES]
+            for rec in recommendations
+        ], dtype=float).reshape(len(recommendations), len(SCORE_CATEGORIES))
+
+        diversifier = self.get_diversifier(diversification)
+        coords = None
+        if diversifier.config.distance_weight:
+            coords = np.array([
+                [np.nan if rec.lat is None else rec.lat, np.nan if rec.lon is None else rec.lon]
+                for rec in recommendations
+            ], dtype=float).reshape(len(recommendations), 2)
+
+        positions = diversifier.select(scores, alcaldias, num_needed,
+                                       score_vectors=score_vectors, coords=coords)
+        return [recommendations[position] for position in positions]
+
+def candidate_pool_size(num_zones: int, num_recommendations: int) -> int:
+    """Tamaño inicial del prefijo del ranking que se pasa a la diversificación"""
+    return min(num_zones, max(4 * num_recommendations, 32))
+
+def select_diversified_indices(total_scores: np.ndarray, alcaldias: np.ndarray,
+                               num_recommendations: int, diversifier: MMRDiversifier,
+                               category_matrix: Optional[np.ndarray] = None,
+                               coords: Optional[np.ndarray] = None
+                               ) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k diversificado sobre un vector de scores: (índices, rankings)
+
+    Solo se ordena un prefijo del ranking y se amplía si la diversificación lo
+    agota. Es la parte de select_recommendation_indices que también corre en los
+    workers del backend paralelo (alcaldias puede ser un vector de códigos).
+    """
+    num_zones = total_scores.size
+    if num_recommendations <= 0 or num_zones == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    pool_size = candidate_pool_size(num_zones, num_recommendations)
+    while True:
+        ranked = select_top_k_indices(total_scores, pool_size)
+        positions = diversifier.select(
+            total_scores[ranked], alcaldias[ranked], num_recommendations,
+            score_vectors=category_matrix[ranked] if category_matrix is not None else None,
+            coords=coords[ranked] if coords is not None else None,
+            exhaustive=pool_size == num_zones
+        )
+        if positions is not None:
+            break
+        pool_size = min(num_zones, pool_size * 2)
+
+    positions = np.asarray(positions, dtype=np.intp)
+    return ranked[positions], positions + 1
+
+def select_top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices de los k mayores scores en orden descendente (empates por orden original)"""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.size:
+        threshold = -np.partition(-scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(scores.size)
+
+    # Orden estable: score descendente y, en empate, posición original
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
 
 def create_sample_user_profiles() -> List[UserProfile]:
     """Crea perfiles de usuario de ejemplo para testing"""
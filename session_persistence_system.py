@@ -7,21 +7,43 @@ David Fernando Ávila Díaz - ITAM
 """
 
 import asyncio
+import atexit
 import json
+import os
+import queue
 import sqlite3
 import time
 import uuid
 import pickle
 import gzip
 import base64
+from collections import Counter, OrderedDict
 from datetime import datetime, timezone, timedelta
 from dataclasses import dataclass, asdict
 from enum import Enum
-from typing import Dict, List, Optional, Any, Union
+from typing import Callable, Dict, List, Optional, Any, Set, Tuple, Union
 from pathlib import Path
 import threading
 import logging
 import hashlib
+import zlib
+
+from sqlite_schema import connect_database, migrate_database
+
+try:
+    import zstandard as zstd
+except ImportError:  # Opcional: sin zstandard los checkpoints v2 usan zlib
+    zstd = None
+
+# Formatos de checkpoint: v1 = JSON en TEXT (contexto gzip+base64), v2 = un BLOB comprimido
+CHECKPOINT_FORMAT_V1 = 1
+CHECKPOINT_FORMAT_V2 = 2
+PAYLOAD_FIELDS = (
+    'context_snapshot', 'objectives_state', 'accumulated_results',
+    'agent_states', 'system_metrics', 'recovery_instructions'
+)
+# Campos de al menos este tamaño (JSON) se guardan una vez en checkpoint_chunks
+CHUNK_MIN_BYTES = 512
 
 class PersistenceLevel(Enum):
     MINIMAL = "minimal"      # Solo objetivos críticos
@@ -64,24 +86,701 @@ class ContinuityBridge:
     success_criteria_met: List[str]
     pending_dependencies: List[str]
 
+def json_diff(old: Any, new: Any, path: Tuple = ()) -> List[list]:
+    """Diferencia estructural tipo JSON-patch: ["set", ruta, valor] / ["del", ruta]
+
+    Los dicts se comparan clave por clave; listas y escalares se reemplazan completos.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in new.items():
+            if key not in old:
+                ops.append(["set", list(path + (key,)), value])
+            else:
+                ops.extend(json_diff(old[key], value, path + (key,)))
+        for key in old:
+            if key not in new:
+                ops.append(["del", list(path + (key,))])
+        return ops
+    if type(old) is not type(new) or old != new:
+        return [["set", list(path), new]]
+    return []
+
+def apply_json_patch(document: Dict[str, Any], ops: List[list]) -> Dict[str, Any]:
+    """Aplica (in place) las operaciones generadas por json_diff"""
+    for op in ops:
+        *parents, key = op[1]
+        target = document
+        for parent in parents:
+            target = target[parent]
+        if op[0] == "set":
+            target[key] = op[2]
+        else:
+            del target[key]
+    return document
+
+class CheckpointCodec:
+    """Compresión de payloads v2: zstd (con diccionario entrenado si existe) o zlib
+
+    Los diccionarios se guardan en la tabla checkpoint_dictionaries y cada fila
+    registra el códec y el id del diccionario con que se comprimió.
+    """
+
+    ZSTD = "zstd"
+    ZLIB = "zlib"
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.dictionaries: Dict[int, Any] = {}
+        self.active_dict_id: Optional[int] = None
+        self._local = threading.local()  # Compresores zstd no son thread-safe
+        self.load_dictionaries()
+
+    def load_dictionaries(self):
+        """Carga los diccionarios guardados; el más reciente queda activo"""
+        if zstd is None:
+            return
+        with connect_database(self.db_path) as conn:
+            rows = conn.execute(
+                'SELECT id, dictionary FROM checkpoint_dictionaries ORDER BY id'
+            ).fetchall()
+        for dict_id, data in rows:
+            self.dictionaries[dict_id] = zstd.ZstdCompressionDict(data)
+            self.active_dict_id = dict_id
+        self._local = threading.local()
+
+    def encode(self, payload: bytes, level: int = 6) -> Tuple[str, Optional[int], bytes]:
+        """Comprime un payload: (códec, id de diccionario, blob)"""
+        if zstd is None:
+            return self.ZLIB, None, zlib.compress(payload, level)
+
+        dict_id = self.active_dict_id
+        compressors = getattr(self._local, 'compressors', None)
+        if compressors is None:
+            compressors = self._local.compressors = {}
+        compressor = compressors.get((dict_id, level))
+        if compressor is None:
+            compressor = zstd.ZstdCompressor(
+                level=level, dict_data=self.dictionaries.get(dict_id) if dict_id else None
+            )
+            compressors[(dict_id, level)] = compressor
+        return self.ZSTD, dict_id, compressor.compress(payload)
+
+    def decode(self, codec: str, dict_id: Optional[int], blob: bytes) -> bytes:
+        if codec == self.ZLIB:
+            return zlib.decompress(blob)
+        if codec == self.ZSTD:
+            if zstd is None:
+                raise RuntimeError("Checkpoint comprimido con zstd y zstandard no está instalado")
+            if dict_id is not None and dict_id not in self.dictionaries:
+                self.load_dictionaries()
+            decompressor = zstd.ZstdDecompressor(
+                dict_data=self.dictionaries[dict_id] if dict_id is not None else None
+            )
+            return decompressor.decompress(blob)
+        raise ValueError(f"Códec de checkpoint desconocido: {codec}")
+
+    def train_dictionary(self, samples: List[bytes], dict_size: int = 16 * 1024) -> Optional[int]:
+        """Entrena y guarda un diccionario zstd; queda activo para nuevas escrituras"""
+        if zstd is None or not samples:
+            return None
+        dictionary = zstd.train_dictionary(dict_size, samples)
+        with connect_database(self.db_path) as conn:
+            cursor = conn.execute(
+                'INSERT INTO checkpoint_dictionaries (dictionary, sample_count, created_at) VALUES (?, ?, ?)',
+                (dictionary.as_bytes(), len(samples), datetime.now(timezone.utc).isoformat())
+            )
+            dict_id = cursor.lastrowid
+        self.load_dictionaries()
+        return dict_id
+
+@dataclass
+class QueuedCheckpoint:
+    """Checkpoint pendiente de escritura; su estado ya va serializado a JSON"""
+    checkpoint: SessionCheckpoint
+    context_json: str
+    objectives_json: str
+    results_json: str
+    agents_json: str
+    metrics_json: str
+    instructions_json: str
+    enqueued_at: float
+    # Lo fija el escritor: None = pendiente, True = escrito, False = fallido
+    stored: Optional[bool] = None
+
+    def field_jsons(self, keep_context: bool = True) -> Dict[str, str]:
+        """JSON de cada campo del payload, en el orden de PAYLOAD_FIELDS"""
+        return {
+            'context_snapshot': self.context_json if keep_context else '{}',
+            'objectives_state': self.objectives_json,
+            'accumulated_results': self.results_json,
+            'agent_states': self.agents_json,
+            'system_metrics': self.metrics_json,
+            'recovery_instructions': self.instructions_json
+        }
+
+@dataclass
+class WriteBarrier:
+    """Marca en la cola: se señala cuando todo lo encolado antes está escrito"""
+    fsync: bool
+    done: threading.Event
+
+@dataclass
+class WriterTask:
+    """Operación sobre la base ejecutada por el escritor, en orden con los checkpoints"""
+    function: Callable[[sqlite3.Connection], Any]
+    done: threading.Event
+    result: Any = None
+    error: Optional[BaseException] = None
+
+@dataclass
+class SessionHead:
+    """Último checkpoint escrito de una sesión, base del siguiente delta"""
+    checkpoint_id: str
+    field_jsons: Dict[str, str]
+    state: Dict[str, Any]
+    depth: int = 0
+
+class CheckpointWriter:
+    """Escritor write-behind de checkpoints en un thread de fondo
+
+    Agrupa los checkpoints encolados en una sola transacción por lote y escribe
+    los respaldos fuera del hilo que crea el checkpoint.
+    """
+
+    STOP = object()
+    MAX_SESSION_HEADS = 256
+
+    def __init__(self, manager: 'SessionPersistenceManager',
+                 max_queue_size: int = 10000, batch_size: int = 256):
+        self.manager = manager
+        self.batch_size = batch_size
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        # Solo los usa el thread escritor
+        self._heads: 'OrderedDict[str, SessionHead]' = OrderedDict()
+
+        # Métricas de la cola
+        self.max_depth = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.total_write_latency = 0.0
+        self.chunks_written = 0
+        self.chunks_reused = 0
+
+        self._unsynced_backups: List[Path] = []
+        # _closed: no se aceptan checkpoints nuevos; _stopped: el thread ya no lee la cola
+        self._closed = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._writer_loop, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: QueuedCheckpoint):
+        """Encola un checkpoint (bloquea solo si la cola está llena)"""
+        self._put(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def flush(self, fsync: bool = True, timeout: Optional[float] = None) -> bool:
+        """Espera a que lo encolado hasta ahora esté escrito (y en disco si fsync)"""
+        if self._stopped:
+            return self.queue.empty()
+        barrier = WriteBarrier(fsync=fsync, done=threading.Event())
+        try:
+            self._put(barrier, accept_closed=True)
+        except RuntimeError:
+            return self.queue.empty()
+        return barrier.done.wait(timeout)
+
+    def run_task(self, function: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Ejecuta function(conn) en el escritor tras lo ya encolado y reinicia las cadenas de deltas"""
+        task = WriterTask(function=function, done=threading.Event())
+        self._put(task, accept_closed=True)
+        task.done.wait()
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def close(self, timeout: Optional[float] = None):
+        """Vacía la cola y detiene el thread escritor"""
+        if not self._closed:
+            self._closed = True
+            self.queue.put(self.STOP)
+        self._thread.join(timeout)
+
+    def _put(self, item: Any, accept_closed: bool = False):
+        """Encola en el escritor; falla si ya no va a atender la cola"""
+        if self._stopped or (self._closed and not accept_closed):
+            raise RuntimeError("El escritor de checkpoints está detenido")
+        self.queue.put(item)
+        if self._stopped:
+            # El escritor terminó mientras se encolaba: nadie más va a leer la cola
+            self._drain()
+            raise RuntimeError("El escritor de checkpoints está detenido")
+
+    def _drain(self):
+        """Descarta lo pendiente tras detenerse el escritor, liberando a quien espera"""
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, QueuedCheckpoint):
+                self._fail([item])
+            elif isinstance(item, WriteBarrier):
+                item.done.set()
+            elif isinstance(item, WriterTask):
+                item.error = RuntimeError("El escritor de checkpoints está detenido")
+                item.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+            'last_batch_size': self.last_batch_size,
+            'avg_write_latency_ms': (self.total_write_latency / self.written * 1000) if self.written else 0.0,
+            'chunks_written': self.chunks_written,
+            'chunks_reused': self.chunks_reused
+        }
+
+    def _writer_loop(self):
+        conn = None
+        try:
+            conn = connect_database(self.manager.db_path)
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                # Checkpoints consecutivos van en una transacción; las marcas se atienden en orden
+                stop = False
+                checkpoints: List[QueuedCheckpoint] = []
+                for item in batch:
+                    if isinstance(item, QueuedCheckpoint):
+                        checkpoints.append(item)
+                        continue
+                    if checkpoints:
+                        self._write_batch(conn, checkpoints)
+                        checkpoints = []
+                    if isinstance(item, WriteBarrier):
+                        try:
+                            if item.fsync:
+                                self._sync(conn)
+                        finally:
+                            item.done.set()
+                    elif isinstance(item, WriterTask):
+                        self._run_task(conn, item)
+                    elif item is self.STOP:
+                        stop = True
+                if checkpoints:
+                    self._write_batch(conn, checkpoints)
+                if stop:
+                    break
+        except Exception as e:
+            self.manager.logger.error(f"❌ Escritor de checkpoints detenido: {e}")
+        finally:
+            self._closed = True
+            self._stopped = True
+            self._drain()
+            if conn is not None:
+                conn.close()
+
+    def _run_task(self, conn: sqlite3.Connection, task: WriterTask):
+        try:
+            task.result = task.function(conn)
+        except BaseException as e:
+            task.error = e
+        finally:
+            # La tarea pudo borrar bases de delta: los siguientes checkpoints serán completos
+            self._heads.clear()
+            task.done.set()
+
+    @staticmethod
+    def _chunk_exists(conn: sqlite3.Connection, digest: str) -> bool:
+        # Se consulta siempre la base (dentro del lock del lote): otro gestor o proceso
+        # puede haber recolectado el chunk con cleanup_old_checkpoints
+        return conn.execute('SELECT 1 FROM checkpoint_chunks WHERE hash = ?', (digest,)).fetchone() is not None
+
+    def _fail(self, items: List[QueuedCheckpoint]):
+        """Marca como fallidos los checkpoints aún pendientes"""
+        for item in items:
+            if item.stored is None:
+                item.stored = False
+                self.failed += 1
+
+    def _drop_missing_heads(self, conn: sqlite3.Connection, session_ids: Set[str]):
+        """Olvida las cabezas cuyo checkpoint ya no está en la base
+
+        Otro gestor o proceso pudo borrarlo con cleanup_old_checkpoints; el siguiente
+        checkpoint de esa sesión se escribe entonces como snapshot completo.
+        """
+        base_ids = [self._heads[session_id].checkpoint_id
+                    for session_id in session_ids if session_id in self._heads]
+        if not base_ids:
+            return
+        placeholders = ','.join('?' * len(base_ids))
+        existing = {row[0] for row in conn.execute(
+            f'SELECT id FROM session_checkpoints WHERE id IN ({placeholders})', base_ids
+        )}
+        for session_id in session_ids:
+            head = self._heads.get(session_id)
+            if head is not None and head.checkpoint_id not in existing:
+                del self._heads[session_id]
+
+    def _write_batch(self, conn: sqlite3.Connection, checkpoints: List[QueuedCheckpoint]):
+        manager = self.manager
+        keep_context = manager.persistence_level in [PersistenceLevel.COMPLETE, PersistenceLevel.ENTERPRISE]
+
+        written: List[QueuedCheckpoint] = []
+        rows = []
+        heads: Dict[str, SessionHead] = {}
+        deltas: Dict[str, Tuple[str, List[list]]] = {}
+        new_chunks: Dict[str, tuple] = {}
+        chunk_refs: List[Tuple[str, str, str]] = []
+        reused = 0
+
+        # Lock de escritura desde la codificación hasta el COMMIT: los chunks que el lote
+        # da por existentes no pueden desaparecer antes de insertar sus referencias
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            self._fail(checkpoints)
+            manager.logger.error(f"❌ Error creando checkpoint: {e}")
+            return
+
+        try:
+            # Las bases de delta se verifican bajo el mismo lock que el INSERT
+            if manager.delta_checkpoints:
+                self._drop_missing_heads(conn, {item.checkpoint.session_id for item in checkpoints})
+            for item in checkpoints:
+                # Un checkpoint que no se puede codificar se descarta sin tumbar el lote
+                try:
+                    row, head, delta, item_chunks, item_refs, item_reused = self._encode_checkpoint(
+                        conn, item, keep_context, heads, new_chunks
+                    )
+                except Exception as e:
+                    self._fail([item])
+                    manager.logger.error(f"❌ Error creando checkpoint {item.checkpoint.id}: {e}")
+                    continue
+                written.append(item)
+                rows.append(row)
+                if head is not None:
+                    heads[item.checkpoint.session_id] = head
+                if delta is not None:
+                    deltas[item.checkpoint.id] = delta
+                new_chunks.update(item_chunks)
+                chunk_refs.extend(item_refs)
+                reused += item_reused
+
+            conn.executemany('''
+                INSERT INTO session_checkpoints
+                (id, session_id, checkpoint_type, timestamp, payload, payload_codec,
+                 payload_dict_id, format_version, delta_base_id, delta_depth,
+                 compression_level, version, file_size_bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self._store_chunks(conn, new_chunks, chunk_refs)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self._fail(checkpoints)
+            manager.logger.error(f"❌ Error creando checkpoint: {e}")
+            # Las cadenas de estas sesiones ya no tienen base válida
+            for session_id in heads:
+                self._heads.pop(session_id, None)
+            return
+        if not rows:
+            return
+        for item in written:
+            item.stored = True
+
+        self.chunks_written += len(new_chunks)
+        self.chunks_reused += reused
+
+        for session_id, head in heads.items():
+            self._heads[session_id] = head
+            self._heads.move_to_end(session_id)
+        while len(self._heads) > self.MAX_SESSION_HEADS:
+            self._heads.popitem(last=False)
+
+        now = time.time()
+        self.written += len(rows)
+        self.batches += 1
+        self.last_batch_size = len(rows)
+        self.total_write_latency += sum(now - item.enqueued_at for item in written)
+
+        for row in rows:
+            manager.logger.info(
+                f"💾 Checkpoint creado: {row[0]} [{row[2]}] - {row[-1]:,} bytes"
+                + (f" (delta de {row[8]})" if row[8] else "")
+            )
+
+        # Respaldos físicos si es nivel enterprise
+        if manager.persistence_level == PersistenceLevel.ENTERPRISE:
+            for item in written:
+                try:
+                    delta = deltas.get(item.checkpoint.id)
+                    if delta is not None:
+                        backup_path = manager.create_backup_file(item.checkpoint, delta=delta)
+                    else:
+                        backup_path = manager.create_backup_file(self._snapshot(item))
+                except Exception as e:
+                    manager.logger.error(f"❌ Error respaldando checkpoint {item.checkpoint.id}: {e}")
+                    continue
+                if backup_path is not None:
+                    self._unsynced_backups.append(backup_path)
+
+    def _encode_checkpoint(self, conn: sqlite3.Connection, item: QueuedCheckpoint, keep_context: bool,
+                           heads: Dict[str, SessionHead], new_chunks: Dict[str, tuple]):
+        """Fila de session_checkpoints de un checkpoint, con su cabeza de delta y sus chunks
+
+        No toca las cabezas ni los contadores del escritor: el lote solo incorpora el resultado si
+        la codificación completa tuvo éxito.
+        """
+        manager = self.manager
+        checkpoint = item.checkpoint
+        field_jsons = item.field_jsons(keep_context)
+        head = heads.get(checkpoint.session_id) or self._heads.get(checkpoint.session_id)
+        base_id = None
+        depth = 0
+        delta = None
+        chunks_to_write: Dict[str, tuple] = {}
+        refs: List[Tuple[str, str, str]] = []
+        reused = 0
+
+        if manager.delta_checkpoints and head is not None and head.depth < manager.full_snapshot_every:
+            # Delta: solo se decodifican y comparan los campos cuyo JSON cambió
+            state = dict(head.state)
+            ops: List[list] = []
+            for name, text in field_jsons.items():
+                if text != head.field_jsons[name]:
+                    value = json.loads(text)
+                    ops.extend(json_diff(head.state[name], value, (name,)))
+                    state[name] = value
+            payload = json.dumps({'delta': ops}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            base_id = head.checkpoint_id
+            depth = head.depth + 1
+            delta = (base_id, ops)
+        else:
+            payload, chunks_to_write, refs, reused = self._encode_payload(
+                conn, checkpoint.id, field_jsons, checkpoint.compression_level,
+                checkpoint.timestamp, new_chunks
+            )
+            state = ({name: json.loads(text) for name, text in field_jsons.items()}
+                     if manager.delta_checkpoints else {})
+
+        new_head = SessionHead(checkpoint.id, field_jsons, state, depth) if manager.delta_checkpoints else None
+
+        codec, dict_id, blob = manager.codec.encode(payload, checkpoint.compression_level)
+        row = (
+            checkpoint.id, checkpoint.session_id, checkpoint.checkpoint_type.value,
+            checkpoint.timestamp, blob, codec, dict_id, CHECKPOINT_FORMAT_V2,
+            base_id, depth, checkpoint.compression_level, checkpoint.version, len(blob)
+        )
+        return row, new_head, delta, chunks_to_write, refs, reused
+
+    def _encode_payload(self, conn: sqlite3.Connection, checkpoint_id: str, field_jsons: Dict[str, str],
+                        compression_level: int, timestamp: str, new_chunks: Dict[str, tuple]
+                        ) -> Tuple[bytes, Dict[str, tuple], List[Tuple[str, str, str]], int]:
+        """Payload v2 completo: (payload, chunks nuevos, referencias, chunks reutilizados)
+
+        Los JSON ya serializados se unen sin volver a codificar; los campos grandes
+        van a checkpoint_chunks y el payload guarda su hash.
+        """
+        manager = self.manager
+        parts = []
+        chunks = {}
+        chunks_to_write: Dict[str, tuple] = {}
+        refs: List[Tuple[str, str, str]] = []
+        reused = 0
+        for name, text in field_jsons.items():
+            if not manager.dedup_payloads or len(text) < CHUNK_MIN_BYTES:
+                parts.append(f'"{name}":{text}')
+                continue
+            data = text.encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()
+            chunks[name] = digest
+            refs.append((checkpoint_id, name, digest))
+            if digest in new_chunks or digest in chunks_to_write or self._chunk_exists(conn, digest):
+                reused += 1
+                continue
+            chunk_codec, chunk_dict_id, chunk_blob = manager.codec.encode(data, compression_level)
+            chunks_to_write[digest] = (digest, chunk_codec, chunk_dict_id, chunk_blob,
+                                       len(chunk_blob), timestamp)
+        if chunks:
+            parts.append('"$chunks":' + json.dumps(chunks))
+        payload = ('{' + ','.join(parts) + '}').encode('utf-8')
+        return payload, chunks_to_write, refs, reused
+
+    @staticmethod
+    def _store_chunks(conn: sqlite3.Connection, new_chunks: Dict[str, tuple],
+                      chunk_refs: List[Tuple[str, str, str]]):
+        """Inserta los chunks nuevos y las referencias, y ajusta los conteos (dentro de la transacción)"""
+        conn.executemany('''
+            INSERT INTO checkpoint_chunks
+            (hash, payload_codec, payload_dict_id, data, size_bytes, refcount, created_at)
+            VALUES (?, ?, ?, ?, ?, 0, ?)
+            ON CONFLICT(hash) DO NOTHING
+        ''', new_chunks.values())
+        conn.executemany('''
+            INSERT INTO checkpoint_chunk_refs (checkpoint_id, field, chunk_hash) VALUES (?, ?, ?)
+        ''', chunk_refs)
+        conn.executemany(
+            'UPDATE checkpoint_chunks SET refcount = refcount + ? WHERE hash = ?',
+            [(count, digest) for digest, count in Counter(ref[2] for ref in chunk_refs).items()]
+        )
+
+    def migrate_batch(self, conn: sqlite3.Connection, after_rowid: int,
+                      batch_size: int) -> Optional[Tuple[int, Counter]]:
+        """Reescribe a v2 (con chunks deduplicados) un lote de filas v1 posteriores a after_rowid
+
+        Se ejecuta en el escritor vía run_task. Devuelve (último rowid, contadores) o
+        None si ya no quedan filas v1.
+        """
+        manager = self.manager
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        counts: Counter = Counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = cursor.execute('''
+                SELECT rowid, * FROM session_checkpoints
+                WHERE rowid > ? AND COALESCE(format_version, 1) < ?
+                ORDER BY rowid LIMIT ?
+            ''', (after_rowid, CHECKPOINT_FORMAT_V2, batch_size)).fetchall()
+            if not rows:
+                conn.commit()
+                return None
+
+            updates = []
+            new_chunks: Dict[str, tuple] = {}
+            chunk_refs: List[Tuple[str, str, str]] = []
+            for row in rows:
+                try:
+                    state = manager.decode_checkpoint_payload(row, conn)
+                    # Mismo JSON que create_checkpoint, para compartir chunks con checkpoints nuevos
+                    field_jsons = {
+                        name: (manager.encode_context(state[name]) if name == 'context_snapshot'
+                               else json.dumps(state[name]))
+                        for name in PAYLOAD_FIELDS
+                    }
+                    compression_level = row['compression_level'] or 6
+                    payload, row_chunks, row_refs, reused = self._encode_payload(
+                        conn, row['id'], field_jsons, compression_level, row['timestamp'], new_chunks
+                    )
+                    codec, dict_id, blob = manager.codec.encode(payload, compression_level)
+                except Exception as e:
+                    counts['failed'] += 1
+                    manager.logger.error(f"❌ Error migrando checkpoint {row['id']}: {e}")
+                    continue
+
+                new_chunks.update(row_chunks)
+                chunk_refs.extend(row_refs)
+                counts['chunks_reused'] += reused
+                counts['bytes_before'] += sum(len((row[column] or '').encode('utf-8')) for column in (
+                    'context_snapshot_compressed', 'objectives_state', 'accumulated_results',
+                    'agent_states', 'system_metrics', 'recovery_instructions'
+                ))
+                counts['bytes_after'] += len(blob)
+                updates.append((blob, codec, dict_id, CHECKPOINT_FORMAT_V2, len(blob), row['rowid']))
+
+            conn.executemany('''
+                UPDATE session_checkpoints
+                SET payload = ?, payload_codec = ?, payload_dict_id = ?, format_version = ?,
+                    file_size_bytes = ?, context_snapshot_compressed = NULL,
+                    objectives_state = NULL, accumulated_results = NULL, agent_states = NULL,
+                    system_metrics = NULL, recovery_instructions = NULL
+                WHERE rowid = ?
+            ''', updates)
+            self._store_chunks(conn, new_chunks, chunk_refs)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        counts['migrated'] += len(updates)
+        counts['chunks_written'] += len(new_chunks)
+        self.chunks_written += len(new_chunks)
+        self.chunks_reused += counts['chunks_reused']
+        return rows[-1]['rowid'], counts
+
+    @staticmethod
+    def _snapshot(item: QueuedCheckpoint) -> SessionCheckpoint:
+        """Checkpoint reconstruido desde el JSON encolado (no desde los dicts vivos)"""
+        checkpoint = item.checkpoint
+        return SessionCheckpoint(
+            id=checkpoint.id,
+            session_id=checkpoint.session_id,
+            checkpoint_type=checkpoint.checkpoint_type,
+            timestamp=checkpoint.timestamp,
+            context_snapshot=json.loads(item.context_json),
+            objectives_state=json.loads(item.objectives_json),
+            accumulated_results=json.loads(item.results_json),
+            agent_states=json.loads(item.agents_json),
+            system_metrics=json.loads(item.metrics_json),
+            recovery_instructions=json.loads(item.instructions_json),
+            compression_level=checkpoint.compression_level,
+            version=checkpoint.version
+        )
+
+    def _sync(self, conn: sqlite3.Connection):
+        """Barrera de durabilidad: checkpoint del WAL y fsync de los respaldos escritos"""
+        try:
+            conn.execute("PRAGMA wal_checkpoint(FULL)")
+            for path in self._unsynced_backups:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            if self._unsynced_backups:
+                fd = os.open(self.manager.backup_dir, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self._unsynced_backups.clear()
+        except Exception as e:
+            self.manager.logger.error(f"❌ Error sincronizando checkpoints a disco: {e}")
+
 class SessionPersistenceManager:
     """Gestor avanzado de persistencia con múltiples niveles"""
     
     def __init__(self, 
                  persistence_level: PersistenceLevel = PersistenceLevel.ENTERPRISE,
                  checkpoint_interval: int = 300,  # 5 minutos
-                 auto_cleanup_days: int = 30):
+                 auto_cleanup_days: int = 30,
+                 write_behind: bool = True,
+                 write_queue_size: int = 10000,
+                 write_batch_size: int = 256,
+                 delta_checkpoints: bool = False,
+                 full_snapshot_every: int = 20,
+                 dedup_payloads: bool = True):
         
         self.persistence_level = persistence_level
         self.checkpoint_interval = checkpoint_interval
         self.auto_cleanup_days = auto_cleanup_days
         
+        # Modo delta: diferencias contra el checkpoint anterior de la sesión y
+        # un snapshot completo cada full_snapshot_every deltas
+        self.delta_checkpoints = delta_checkpoints
+        self.full_snapshot_every = full_snapshot_every
+        # Sub-documentos grandes deduplicados por hash de contenido
+        self.dedup_payloads = dedup_payloads
+        
         self.db_path = "dataton_persistence.db"
         self.backup_dir = Path("backups/sessions")
         self.backup_dir.mkdir(parents=True, exist_ok=True)
         
         self.init_persistence_database()
         self.setup_persistence_logging()
+        self.codec = CheckpointCodec(self.db_path)
         
         # Cache en memoria para acceso rápido
         self.active_checkpoints: Dict[str, SessionCheckpoint] = {}
@@ -91,85 +790,157 @@ class SessionPersistenceManager:
         self.checkpoint_scheduler = None
         self.lock = threading.RLock()
         
+        # Escritura write-behind de checkpoints (write_behind=False espera cada escritura)
+        self.write_behind = write_behind
+        self.checkpoint_writer = CheckpointWriter(
+            self, max_queue_size=write_queue_size, batch_size=write_batch_size
+        )
+        atexit.register(self.close)
+        
         self.logger.info(f"🔒 PersistenceManager iniciado - Nivel: {persistence_level.value}")
     
     def init_persistence_database(self):
-        """Inicializa base de datos de persistencia empresarial"""
-        with sqlite3.connect(self.db_path) as conn:
-            # Tabla principal de checkpoints
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS session_checkpoints (
-                    id TEXT PRIMARY KEY,
-                    session_id TEXT NOT NULL,
-                    checkpoint_type TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    context_snapshot_compressed TEXT,
-                    objectives_state TEXT,
-                    accumulated_results TEXT,
-                    agent_states TEXT,
-                    system_metrics TEXT,
-                    recovery_instructions TEXT,
-                    compression_level INTEGER DEFAULT 6,
-                    version TEXT DEFAULT '1.0',
-                    file_size_bytes INTEGER,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    INDEX(session_id),
-                    INDEX(timestamp),
-                    INDEX(checkpoint_type)
-                )
-            ''')
-            
-            # Tabla de puentes de continuidad
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS continuity_bridges (
-                    bridge_id TEXT PRIMARY KEY,
-                    source_session TEXT NOT NULL,
-                    target_session TEXT NOT NULL,
-                    transfer_timestamp TEXT NOT NULL,
-                    critical_objectives TEXT,
-                    essential_context TEXT,
-                    progress_mapping TEXT,
-                    success_criteria_met TEXT,
-                    pending_dependencies TEXT,
-                    bridge_integrity_hash TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    INDEX(source_session),
-                    INDEX(target_session)
-                )
-            ''')
-            
-            # Tabla de métricas de continuidad
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS continuity_metrics (
-                    id TEXT PRIMARY KEY,
-                    session_id TEXT,
-                    metric_name TEXT,
-                    metric_value REAL,
-                    metric_unit TEXT,
-                    timestamp TEXT,
-                    checkpoint_id TEXT,
-                    INDEX(session_id),
-                    INDEX(metric_name),
-                    FOREIGN KEY(checkpoint_id) REFERENCES session_checkpoints(id)
-                )
-            ''')
-            
-            # Tabla de eventos de recuperación
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS recovery_events (
-                    id TEXT PRIMARY KEY,
-                    session_id TEXT,
-                    recovery_type TEXT,
-                    source_checkpoint_id TEXT,
-                    recovery_timestamp TEXT,
-                    recovery_success BOOLEAN,
-                    recovery_details TEXT,
-                    time_to_recovery_seconds INTEGER,
-                    data_integrity_score REAL,
-                    INDEX(session_id),
-                    FOREIGN KEY(source_checkpoint_id) REFERENCES session_checkpoints(id)
-                )
-            ''')
+        """Inicializa base de datos de persistencia empresarial (WAL + migraciones)"""
+        migrate_database(self.db_path, [
+            self._create_base_schema,
+            self._add_v2_columns,
+            [
+                # Listado y último checkpoint por sesión sin tocar la tabla
+                'CREATE INDEX IF NOT EXISTS idx_checkpoints_session_timestamp ON session_checkpoints '
+                '(session_id, timestamp, id, checkpoint_type, file_size_bytes)',
+                # Limpieza por antigüedad y muestras para diccionarios
+                'CREATE INDEX IF NOT EXISTS idx_checkpoints_timestamp ON session_checkpoints (timestamp)',
+                'CREATE INDEX IF NOT EXISTS idx_checkpoints_type ON session_checkpoints (checkpoint_type)',
+                'CREATE INDEX IF NOT EXISTS idx_checkpoints_delta_base ON session_checkpoints (delta_base_id)',
+                'CREATE INDEX IF NOT EXISTS idx_chunk_refs_hash ON checkpoint_chunk_refs (chunk_hash)',
+                'CREATE INDEX IF NOT EXISTS idx_bridges_source ON continuity_bridges (source_session)',
+                'CREATE INDEX IF NOT EXISTS idx_bridges_target ON continuity_bridges (target_session)',
+                'CREATE INDEX IF NOT EXISTS idx_metrics_session_timestamp ON continuity_metrics (session_id, timestamp)',
+                'CREATE INDEX IF NOT EXISTS idx_metrics_name_timestamp ON continuity_metrics (metric_name, timestamp)',
+                'CREATE INDEX IF NOT EXISTS idx_recovery_session ON recovery_events (session_id, recovery_timestamp)',
+                'CREATE INDEX IF NOT EXISTS idx_recovery_success ON recovery_events '
+                '(recovery_success, time_to_recovery_seconds)'
+            ]
+        ])
+    
+    @staticmethod
+    def _create_base_schema(conn: sqlite3.Connection):
+        """Migración 1: tablas (los índices van en su propia migración)"""
+        # Tabla principal de checkpoints
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS session_checkpoints (
+                id TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                checkpoint_type TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                context_snapshot_compressed TEXT,
+                objectives_state TEXT,
+                accumulated_results TEXT,
+                agent_states TEXT,
+                system_metrics TEXT,
+                recovery_instructions TEXT,
+                compression_level INTEGER DEFAULT 6,
+                version TEXT DEFAULT '1.0',
+                file_size_bytes INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                payload BLOB,
+                payload_codec TEXT,
+                payload_dict_id INTEGER,
+                format_version INTEGER DEFAULT 1,
+                delta_base_id TEXT,
+                delta_depth INTEGER DEFAULT 0
+            )
+        ''')
+        
+        # Sub-documentos de payloads v2 direccionados por contenido, con conteo de referencias
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoint_chunks (
+                hash TEXT PRIMARY KEY,
+                payload_codec TEXT NOT NULL,
+                payload_dict_id INTEGER,
+                data BLOB NOT NULL,
+                size_bytes INTEGER,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoint_chunk_refs (
+                checkpoint_id TEXT NOT NULL,
+                field TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                PRIMARY KEY (checkpoint_id, field)
+            )
+        ''')
+        
+        # Diccionarios zstd entrenados para payloads v2
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS checkpoint_dictionaries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dictionary BLOB NOT NULL,
+                sample_count INTEGER,
+                created_at TEXT
+            )
+        ''')
+        
+        # Tabla de puentes de continuidad
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS continuity_bridges (
+                bridge_id TEXT PRIMARY KEY,
+                source_session TEXT NOT NULL,
+                target_session TEXT NOT NULL,
+                transfer_timestamp TEXT NOT NULL,
+                critical_objectives TEXT,
+                essential_context TEXT,
+                progress_mapping TEXT,
+                success_criteria_met TEXT,
+                pending_dependencies TEXT,
+                bridge_integrity_hash TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Tabla de métricas de continuidad
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS continuity_metrics (
+                id TEXT PRIMARY KEY,
+                session_id TEXT,
+                metric_name TEXT,
+                metric_value REAL,
+                metric_unit TEXT,
+                timestamp TEXT,
+                checkpoint_id TEXT,
+                FOREIGN KEY(checkpoint_id) REFERENCES session_checkpoints(id)
+            )
+        ''')
+        
+        # Tabla de eventos de recuperación
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS recovery_events (
+                id TEXT PRIMARY KEY,
+                session_id TEXT,
+                recovery_type TEXT,
+                source_checkpoint_id TEXT,
+                recovery_timestamp TEXT,
+                recovery_success BOOLEAN,
+                recovery_details TEXT,
+                time_to_recovery_seconds INTEGER,
+                data_integrity_score REAL,
+                FOREIGN KEY(source_checkpoint_id) REFERENCES session_checkpoints(id)
+            )
+        ''')
+    
+    @staticmethod
+    def _add_v2_columns(conn: sqlite3.Connection):
+        """Migración 2: columnas del formato v2 en bases creadas antes de existir"""
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(session_checkpoints)')}
+        for column, definition in [('payload', 'BLOB'), ('payload_codec', 'TEXT'),
+                                   ('payload_dict_id', 'INTEGER'),
+                                   ('format_version', 'INTEGER DEFAULT 1'),
+                                   ('delta_base_id', 'TEXT'),
+                                   ('delta_depth', 'INTEGER DEFAULT 0')]:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE session_checkpoints ADD COLUMN {column} {definition}')
     
     def setup_persistence_logging(self):
         """Configuración de logging para persistencia"""
@@ -201,7 +972,14 @@ class SessionPersistenceManager:
     
     def compress_data(self, data: Dict[str, Any], compression_level: int = 6) -> str:
         """Comprime datos usando gzip y base64"""
-        json_data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        return self.compress_json(self.encode_context(data), compression_level)
+    
+    @staticmethod
+    def encode_context(data: Dict[str, Any]) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    
+    def compress_json(self, json_data: str, compression_level: int = 6) -> str:
+        """Comprime JSON ya serializado usando gzip y base64"""
         compressed = gzip.compress(json_data.encode('utf-8'), compresslevel=compression_level)
         return base64.b64encode(compressed).decode('ascii')
     
@@ -224,7 +1002,12 @@ class SessionPersistenceManager:
                          agent_states: Dict[str, Any] = None,
                          system_metrics: Dict[str, Any] = None,
                          recovery_instructions: List[str] = None) -> str:
-        """Crea checkpoint completo de sesión"""
+        """Crea checkpoint completo de sesión
+        
+        Solo serializa el estado (instantánea) y lo encola; compresión, INSERT y
+        respaldo los hace el escritor de fondo. Usar flush() si se necesita
+        durabilidad antes de continuar.
+        """
         
         checkpoint_id = f"chk_{uuid.uuid4().hex[:12]}"
         timestamp = datetime.now(timezone.utc).isoformat()
@@ -243,61 +1026,75 @@ class SessionPersistenceManager:
             recovery_instructions=recovery_instructions or []
         )
         
-        # Comprimir contexto si es necesario
-        compressed_context = ""
-        if self.persistence_level in [PersistenceLevel.COMPLETE, PersistenceLevel.ENTERPRISE]:
-            compressed_context = self.compress_data(context_snapshot)
-        
-        # Calcular tamaño del archivo
-        file_size = len(compressed_context.encode('utf-8'))
-        
         try:
-            with self.lock, sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT INTO session_checkpoints
-                    (id, session_id, checkpoint_type, timestamp, context_snapshot_compressed,
-                     objectives_state, accumulated_results, agent_states, system_metrics,
-                     recovery_instructions, compression_level, version, file_size_bytes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    checkpoint_id, session_id, checkpoint_type.value, timestamp,
-                    compressed_context, json.dumps(objectives_state),
-                    json.dumps(accumulated_results), json.dumps(agent_states or {}),
-                    json.dumps(system_metrics or {}), json.dumps(recovery_instructions or []),
-                    checkpoint_data.compression_level, checkpoint_data.version, file_size
-                ))
-                
-                # Cache en memoria
+            # El JSON es la instantánea: los dicts del llamador pueden cambiar después
+            queued = QueuedCheckpoint(
+                checkpoint=checkpoint_data,
+                context_json=self.encode_context(context_snapshot),
+                objectives_json=json.dumps(objectives_state),
+                results_json=json.dumps(accumulated_results),
+                agents_json=json.dumps(agent_states or {}),
+                metrics_json=json.dumps(system_metrics or {}),
+                instructions_json=json.dumps(recovery_instructions or []),
+                enqueued_at=time.time()
+            )
+            self.checkpoint_writer.submit(queued)
+            
+            # Cache en memoria
+            with self.lock:
                 self.active_checkpoints[checkpoint_id] = checkpoint_data
-                
-                self.logger.info(
-                    f"💾 Checkpoint creado: {checkpoint_id} "
-                    f"[{checkpoint_type.value}] - {file_size:,} bytes"
-                )
-                
-                # Crear respaldo si es nivel enterprise
-                if self.persistence_level == PersistenceLevel.ENTERPRISE:
-                    self.create_backup_file(checkpoint_data)
         
         except Exception as e:
             self.logger.error(f"❌ Error creando checkpoint: {e}")
             return None
         
+        if not self.write_behind:
+            # Modo síncrono: como antes, None si la escritura falló
+            self.flush(fsync=False)
+            if queued.stored is not True:
+                with self.lock:
+                    self.active_checkpoints.pop(checkpoint_id, None)
+                return None
+        
         return checkpoint_id
     
-    def create_backup_file(self, checkpoint: SessionCheckpoint):
-        """Crea archivo de respaldo físico"""
-        backup_filename = f"{checkpoint.session_id}_{checkpoint.id}_{checkpoint.timestamp[:10]}.pkl.gz"
+    def flush(self, fsync: bool = True, timeout: Optional[float] = None) -> bool:
+        """Barrera: espera a que los checkpoints encolados estén escritos (y en disco si fsync)"""
+        return self.checkpoint_writer.flush(fsync=fsync, timeout=timeout)
+    
+    def close(self):
+        """Escribe lo pendiente y detiene el escritor de fondo"""
+        self.checkpoint_writer.close()
+    
+    def create_backup_file(self, checkpoint: SessionCheckpoint,
+                           delta: Optional[Tuple[str, List[list]]] = None) -> Optional[Path]:
+        """Crea archivo de respaldo físico (con delta=(base, ops) solo guarda la diferencia)"""
+        suffix = "delta.pkl.gz" if delta is not None else "pkl.gz"
+        backup_filename = f"{checkpoint.session_id}_{checkpoint.id}_{checkpoint.timestamp[:10]}.{suffix}"
         backup_path = self.backup_dir / backup_filename
         
+        if delta is not None:
+            data = {
+                'id': checkpoint.id,
+                'session_id': checkpoint.session_id,
+                'checkpoint_type': checkpoint.checkpoint_type,
+                'timestamp': checkpoint.timestamp,
+                'delta_base_id': delta[0],
+                'delta': delta[1]
+            }
+        else:
+            data = asdict(checkpoint)
+        
         try:
             with gzip.open(backup_path, 'wb') as f:
-                pickle.dump(asdict(checkpoint), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
             
             self.logger.debug(f"💿 Backup creado: {backup_filename}")
+            return backup_path
         
         except Exception as e:
             self.logger.error(f"❌ Error creando backup: {e}")
+            return None
     
     def create_continuity_bridge(self,
                                source_session: str,
@@ -333,7 +1130,7 @@ class SessionPersistenceManager:
         ).hexdigest()
         
         try:
-            with self.lock, sqlite3.connect(self.db_path) as conn:
+            with self.lock, connect_database(self.db_path) as conn:
                 conn.execute('''
                     INSERT INTO continuity_bridges
                     (bridge_id, source_session, target_session, transfer_timestamp,
@@ -361,36 +1158,41 @@ class SessionPersistenceManager:
     def recover_session(self, checkpoint_id: str) -> Optional[Dict[str, Any]]:
         """Recupera sesión desde checkpoint"""
         recovery_start = time.time()
+        self.flush(fsync=False)
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute('''
-                    SELECT * FROM session_checkpoints WHERE id = ?
-                ''', (checkpoint_id,))
+            with connect_database(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                # Cadena desde el snapshot completo más cercano hasta el checkpoint pedido
+                chain = conn.execute('''
+                    WITH RECURSIVE chain(id, base_id, position) AS (
+                        SELECT id, delta_base_id, 0 FROM session_checkpoints WHERE id = ?
+                        UNION ALL
+                        SELECT c.id, c.delta_base_id, chain.position + 1
+                        FROM session_checkpoints c JOIN chain ON c.id = chain.base_id
+                    )
+                    SELECT s.* FROM chain JOIN session_checkpoints s ON s.id = chain.id
+                    ORDER BY chain.position DESC
+                ''', (checkpoint_id,)).fetchall()
                 
-                row = cursor.fetchone()
-                if not row:
+                if not chain:
                     self.logger.error(f"❌ Checkpoint no encontrado: {checkpoint_id}")
                     return None
+                if chain[0]['delta_base_id']:
+                    raise ValueError(f"Cadena de deltas incompleta para {checkpoint_id}")
                 
-                # Reconstruir checkpoint
+                # Reconstruir checkpoint (v2: un BLOB; v1: columnas JSON) y aplicar deltas
+                row = chain[-1]
                 checkpoint_data = {
-                    'id': row[0],
-                    'session_id': row[1],
-                    'checkpoint_type': row[2],
-                    'timestamp': row[3],
-                    'objectives_state': json.loads(row[5]) if row[5] else {},
-                    'accumulated_results': json.loads(row[6]) if row[6] else {},
-                    'agent_states': json.loads(row[7]) if row[7] else {},
-                    'system_metrics': json.loads(row[8]) if row[8] else {},
-                    'recovery_instructions': json.loads(row[9]) if row[9] else []
+                    'id': row['id'],
+                    'session_id': row['session_id'],
+                    'checkpoint_type': row['checkpoint_type'],
+                    'timestamp': row['timestamp']
                 }
-                
-                # Descomprimir contexto si existe
-                if row[4]:  # context_snapshot_compressed
-                    checkpoint_data['context_snapshot'] = self.decompress_data(row[4])
-                else:
-                    checkpoint_data['context_snapshot'] = {}
+                state = self.decode_checkpoint_payload(chain[0], conn)
+                for delta_row in chain[1:]:
+                    apply_json_patch(state, self.decode_checkpoint_payload(delta_row)['delta'])
+                checkpoint_data.update(state)
                 
                 recovery_time = time.time() - recovery_start
                 
@@ -426,6 +1228,107 @@ class SessionPersistenceManager:
         
         return None
     
+    def decode_checkpoint_payload(self, row: sqlite3.Row,
+                                  conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+        """Campos de estado de una fila de session_checkpoints, en formato v1 o v2
+        
+        conn es necesaria si el payload referencia chunks deduplicados.
+        """
+        if (row['format_version'] or CHECKPOINT_FORMAT_V1) >= CHECKPOINT_FORMAT_V2:
+            payload = self.codec.decode(row['payload_codec'], row['payload_dict_id'], row['payload'])
+            document = json.loads(payload.decode('utf-8'))
+            chunks = document.pop('$chunks', None)
+            if chunks:
+                placeholders = ','.join('?' * len(chunks))
+                stored = {
+                    chunk[0]: chunk for chunk in conn.execute(
+                        f'SELECT hash, payload_codec, payload_dict_id, data FROM checkpoint_chunks '
+                        f'WHERE hash IN ({placeholders})', list(chunks.values())
+                    )
+                }
+                for name, digest in chunks.items():
+                    if digest not in stored:
+                        raise ValueError(f"Chunk {digest} no encontrado para {row['id']}")
+                    _, codec, dict_id, data = stored[digest]
+                    document[name] = json.loads(self.codec.decode(codec, dict_id, data).decode('utf-8'))
+            return document
+        
+        return {
+            'objectives_state': json.loads(row['objectives_state']) if row['objectives_state'] else {},
+            'accumulated_results': json.loads(row['accumulated_results']) if row['accumulated_results'] else {},
+            'agent_states': json.loads(row['agent_states']) if row['agent_states'] else {},
+            'system_metrics': json.loads(row['system_metrics']) if row['system_metrics'] else {},
+            'recovery_instructions': json.loads(row['recovery_instructions']) if row['recovery_instructions'] else [],
+            'context_snapshot': (self.decompress_data(row['context_snapshot_compressed'])
+                                 if row['context_snapshot_compressed'] else {})
+        }
+    
+    def migrate_checkpoints_to_v2(self, batch_size: int = 500, train_dictionary: bool = True) -> Dict[str, int]:
+        """Reescribe las filas v1 al formato v2 por lotes (una transacción por lote)
+
+        Cada lote corre en el escritor de fondo con el mismo codificador que los
+        checkpoints nuevos, así que los campos grandes pasan por checkpoint_chunks.
+        """
+        self.flush(fsync=False)
+        
+        if train_dictionary and self.codec.active_dict_id is None:
+            self.train_compression_dictionary()
+        
+        writer = self.checkpoint_writer
+        totals: Counter = Counter()
+        last_rowid = 0
+        while True:
+            result = writer.run_task(
+                lambda conn, after=last_rowid: writer.migrate_batch(conn, after, batch_size)
+            )
+            if result is None:
+                break
+            last_rowid, counts = result
+            totals.update(counts)
+            self.logger.info(f"🔁 Migración v2: {totals['migrated']} checkpoints reescritos")
+        
+        return {
+            'migrated': totals['migrated'],
+            'failed': totals['failed'],
+            'bytes_before': totals['bytes_before'],
+            'bytes_after': totals['bytes_after'],
+            'chunks_written': totals['chunks_written'],
+            'chunks_reused': totals['chunks_reused']
+        }
+    
+    def train_compression_dictionary(self, max_samples: int = 1000,
+                                     dict_size: int = 16 * 1024) -> Optional[int]:
+        """Entrena un diccionario zstd con los checkpoints más recientes"""
+        if zstd is None:
+            return None
+        self.flush(fsync=False)
+        
+        samples = []
+        with connect_database(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            for row in conn.execute('''
+                SELECT * FROM session_checkpoints WHERE delta_base_id IS NULL
+                ORDER BY timestamp DESC LIMIT ?
+            ''', (max_samples,)):
+                try:
+                    state = self.decode_checkpoint_payload(row, conn)
+                except Exception:
+                    continue
+                samples.append(json.dumps(
+                    {field: state[field] for field in PAYLOAD_FIELDS},
+                    ensure_ascii=False, separators=(',', ':')
+                ).encode('utf-8'))
+        
+        try:
+            dict_id = self.codec.train_dictionary(samples, dict_size)
+        except Exception as e:  # zstd necesita suficientes muestras
+            self.logger.warning(f"⚠️ No se pudo entrenar diccionario de compresión: {e}")
+            return None
+        
+        if dict_id is not None:
+            self.logger.info(f"📚 Diccionario zstd {dict_id} entrenado con {len(samples)} checkpoints")
+        return dict_id
+    
     def record_recovery_event(self,
                             session_id: str,
                             recovery_type: str,
@@ -440,7 +1343,7 @@ class SessionPersistenceManager:
         timestamp = datetime.now(timezone.utc).isoformat()
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connect_database(self.db_path) as conn:
                 conn.execute('''
                     INSERT INTO recovery_events
                     (id, session_id, recovery_type, source_checkpoint_id,
@@ -458,8 +1361,9 @@ class SessionPersistenceManager:
     
     def get_session_checkpoints(self, session_id: str) -> List[Dict[str, Any]]:
         """Obtiene todos los checkpoints de una sesión"""
+        self.flush(fsync=False)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connect_database(self.db_path) as conn:
                 cursor = conn.execute('''
                     SELECT id, checkpoint_type, timestamp, file_size_bytes
                     FROM session_checkpoints
@@ -487,29 +1391,65 @@ class SessionPersistenceManager:
         cleanup_days = days_old or self.auto_cleanup_days
         cutoff_date = (datetime.now(timezone.utc) - timedelta(days=cleanup_days)).isoformat()
         
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Contar checkpoints a eliminar
-                cursor = conn.execute('''
-                    SELECT COUNT(*) FROM session_checkpoints WHERE timestamp < ?
-                ''', (cutoff_date,))
-                count_to_delete = cursor.fetchone()[0]
+        def delete_old(conn: sqlite3.Connection):
+            with conn:
+                # Checkpoints a eliminar; se conservan las bases de deltas que siguen vigentes
+                conn.execute('DROP TABLE IF EXISTS temp.expired_checkpoints')
+                conn.execute('''
+                    CREATE TEMP TABLE expired_checkpoints AS
+                    WITH RECURSIVE needed(id) AS (
+                        SELECT delta_base_id FROM session_checkpoints
+                        WHERE timestamp >= ? AND delta_base_id IS NOT NULL
+                        UNION
+                        SELECT c.delta_base_id FROM session_checkpoints c
+                        JOIN needed ON c.id = needed.id
+                        WHERE c.delta_base_id IS NOT NULL
+                    )
+                    SELECT id FROM session_checkpoints
+                    WHERE timestamp < ? AND id NOT IN (SELECT id FROM needed)
+                ''', (cutoff_date, cutoff_date))
+                count_to_delete = conn.execute('SELECT COUNT(*) FROM expired_checkpoints').fetchone()[0]
                 
                 if count_to_delete > 0:
+                    # Liberar referencias a chunks y recolectar los huérfanos
+                    conn.execute('''
+                        UPDATE checkpoint_chunks SET refcount = refcount - released.n
+                        FROM (
+                            SELECT r.chunk_hash, COUNT(*) AS n FROM checkpoint_chunk_refs r
+                            JOIN expired_checkpoints e ON e.id = r.checkpoint_id
+                            GROUP BY r.chunk_hash
+                        ) AS released
+                        WHERE checkpoint_chunks.hash = released.chunk_hash
+                    ''')
+                    conn.execute('''
+                        DELETE FROM checkpoint_chunk_refs
+                        WHERE checkpoint_id IN (SELECT id FROM expired_checkpoints)
+                    ''')
+                    
                     # Eliminar checkpoints antiguos
                     conn.execute('''
-                        DELETE FROM session_checkpoints WHERE timestamp < ?
-                    ''', (cutoff_date,))
+                        DELETE FROM session_checkpoints WHERE id IN (SELECT id FROM expired_checkpoints)
+                    ''')
+                    orphaned = conn.execute('DELETE FROM checkpoint_chunks WHERE refcount <= 0').rowcount
                     
-                    self.logger.info(f"🧹 {count_to_delete} checkpoints antiguos eliminados")
+                    self.logger.info(
+                        f"🧹 {count_to_delete} checkpoints antiguos eliminados, "
+                        f"{orphaned} chunks huérfanos recolectados"
+                    )
+                conn.execute('DROP TABLE temp.expired_checkpoints')
+        
+        try:
+            # En el escritor, para no borrar la base de un delta que aún está en cola
+            self.checkpoint_writer.run_task(delete_old)
         
         except Exception as e:
             self.logger.error(f"❌ Error limpiando checkpoints: {e}")
     
     def get_continuity_metrics(self) -> Dict[str, Any]:
         """Obtiene métricas de continuidad del sistema"""
+        self.flush(fsync=False)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with connect_database(self.db_path) as conn:
                 # Total de checkpoints
                 cursor = conn.execute('SELECT COUNT(*) FROM session_checkpoints')
                 total_checkpoints = cursor.fetchone()[0]
@@ -538,6 +1478,13 @@ class SessionPersistenceManager:
                 cursor = conn.execute('SELECT COUNT(*) FROM continuity_bridges')
                 active_bridges = cursor.fetchone()[0]
                 
+                # Almacén de chunks deduplicados
+                cursor = conn.execute('''
+                    SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(refcount), 0)
+                    FROM checkpoint_chunks
+                ''')
+                chunk_count, chunk_bytes, chunk_references = cursor.fetchone()
+                
                 return {
                     'total_checkpoints': total_checkpoints,
                     'checkpoints_by_type': checkpoints_by_type,
@@ -545,6 +1492,12 @@ class SessionPersistenceManager:
                     'avg_recovery_time_seconds': avg_recovery_time,
                     'active_continuity_bridges': active_bridges,
                     'persistence_level': self.persistence_level.value,
+                    'write_queue': self.checkpoint_writer.stats(),
+                    'chunk_store': {
+                        'chunks': chunk_count,
+                        'bytes': chunk_bytes,
+                        'references': chunk_references
+                    },
                     'last_updated': datetime.now(timezone.utc).isoformat()
                 }
         
@@ -553,6 +1506,23 @@ class SessionPersistenceManager:
             return {}
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Sistema de Persistencia de Sesiones - INEGI Datatón")
+    parser.add_argument('--migrar-v2', action='store_true',
+                        help='Reescribe los checkpoints v1 al formato v2 y termina')
+    parser.add_argument('--lote', type=int, default=500,
+                        help='Checkpoints por transacción durante la migración')
+    args = parser.parse_args()
+    
+    if args.migrar_v2:
+        persistence_manager = SessionPersistenceManager()
+        result = persistence_manager.migrate_checkpoints_to_v2(batch_size=args.lote)
+        persistence_manager.close()
+        print(f"🔁 Checkpoints migrados a v2: {result['migrated']} (fallidos: {result['failed']})")
+        print(f"📦 {result['bytes_before']:,} → {result['bytes_after']:,} bytes")
+        raise SystemExit(0)
+    
     print("🔒 Sistema de Persistencia de Sesiones - INEGI Datatón")
     print("👨‍💻 David Fernando Ávila Díaz - ITAM")
     print("=" * 60)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+ÍNDICE ESPACIAL - DATATÓN ITAM 2025
+Grid en memoria para consultas por radio y viewport sobre colonias
+
+David Fernando Ávila Díaz - ITAM
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from commute_model import haversine_km
+
+DEFAULT_CELL_DEG = 0.01  # ~1.1 km por celda en la CDMX
+
+class GridIndex:
+    """Grid uniforme lat/lon con celdas ordenadas por (fila, columna)
+
+    Las zonas de una misma fila de celdas quedan contiguas, así que un bbox se
+    resuelve con dos búsquedas binarias por fila y un filtro exacto final.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, cell_deg: float = DEFAULT_CELL_DEG):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.cell_deg = cell_deg
+
+        valid = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+        self.size = valid.size
+        if not self.size:
+            self.lat0 = self.lon0 = 0.0
+            self.num_rows = self.num_cols = 0
+            self.sorted_keys = np.empty(0, dtype=np.int64)
+            self.order = np.empty(0, dtype=np.intp)
+            return
+
+        self.lat0 = float(self.lat[valid].min())
+        self.lon0 = float(self.lon[valid].min())
+        rows = self._cell(self.lat[valid], self.lat0)
+        cols = self._cell(self.lon[valid], self.lon0)
+        self.num_rows = int(rows.max()) + 1
+        self.num_cols = int(cols.max()) + 1
+
+        keys = rows * self.num_cols + cols
+        sort = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[sort]
+        self.order = valid[sort]
+
+    def _cell(self, values: np.ndarray, origin: float) -> np.ndarray:
+        return np.floor((values - origin) / self.cell_deg).astype(np.int64)
+
+    def query_bbox(self, min_lat: float, min_lon: float,
+                   max_lat: float, max_lon: float) -> np.ndarray:
+        """Índices (ascendentes) de las zonas dentro del bbox"""
+        if not self.size or min_lat > max_lat or min_lon > max_lon:
+            return np.empty(0, dtype=np.intp)
+
+        row_range = np.clip(self._cell(np.array([min_lat, max_lat]), self.lat0), 0, self.num_rows - 1)
+        col_range = np.clip(self._cell(np.array([min_lon, max_lon]), self.lon0), 0, self.num_cols - 1)
+        rows = np.arange(row_range[0], row_range[1] + 1)
+
+        starts = np.searchsorted(self.sorted_keys, rows * self.num_cols + col_range[0], side='left')
+        ends = np.searchsorted(self.sorted_keys, rows * self.num_cols + col_range[1], side='right')
+        slices = [self.order[start:end] for start, end in zip(starts.tolist(), ends.tolist()) if end > start]
+        if not slices:
+            return np.empty(0, dtype=np.intp)
+
+        candidates = np.concatenate(slices)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        return np.sort(candidates[inside])
+
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Índices (ascendentes) de las zonas a menos de radius_km del punto"""
+        min_lat, min_lon, max_lat, max_lon = radius_bbox(lat, lon, radius_km)
+        candidates = self.query_bbox(min_lat, min_lon, max_lat, max_lon)
+        if not candidates.size:
+            return candidates
+
+        distance = haversine_km(self.lat[candidates], self.lon[candidates], lat, lon)
+        return candidates[distance <= radius_km]
+
+def radius_bbox(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """Bbox (min_lat, min_lon, max_lat, max_lon) que contiene el círculo de radio dado"""
+    delta_lat = radius_km / 110.57
+    delta_lon = radius_km / (111.32 * max(np.cos(np.radians(lat)), 1e-6))
+    return lat - delta_lat, lon - delta_lon, lat + delta_lat, lon + delta_lon
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+ESQUEMA SQLITE - DATATÓN ITAM 2025
+Conexiones en modo WAL y migraciones versionadas con PRAGMA user_version
+
+David Fernando Ávila Díaz - ITAM
+"""
+
+import sqlite3
+from typing import Callable, List, Sequence, Union
+
+# Cada migración es una lista de sentencias SQL o una función que recibe la conexión
+Migration = Union[Sequence[str], Callable[[sqlite3.Connection], None]]
+
+BUSY_TIMEOUT_MS = 30000
+
+def connect_database(db_path: str) -> sqlite3.Connection:
+    """Abre una conexión con synchronous=NORMAL (seguro y sin fsync por commit en WAL)"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate_database(db_path: str, migrations: List[Migration]) -> int:
+    """Activa WAL y aplica las migraciones pendientes; devuelve la versión final
+
+    La versión i + 1 corresponde a migrations[i]. Cada migración corre en su
+    propia transacción (BEGIN IMMEDIATE) junto con el cambio de user_version,
+    así que varios procesos pueden arrancar a la vez sin aplicarla dos veces.
+    """
+    conn = connect_database(db_path)
+    try:
+        # journal_mode es persistente en el archivo y no puede cambiar dentro de una transacción
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.isolation_level = None
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = schema_version(conn)
+                if version >= len(migrations):
+                    conn.execute('COMMIT')
+                    return version
+                migration = migrations[version]
+                if callable(migration):
+                    migration(conn)
+                else:
+                    for statement in migration:
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    finally:
+        conn.close()